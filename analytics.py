@@ -0,0 +1,261 @@
+import functools
+
+from database import db, now_ts
+
+DAY = 86400
+WEEKDAYS = ['日', '月', '火', '水', '木', '金', '土']
+# 分布の要約に使うパーセンタイル
+PERCENTILES = (10, 25, 50, 75, 90)
+# NumPy は読み込みに時間がかかるので、Bot の起動時ではなく最初の集計のときに各関数で読み込む
+
+
+def memoize_by_data_version(*tables):
+    """読む表（tables）の内容が変わるまで、同じ引数の集計結果を使い回す（async 関数用のデコレーター）
+
+    db.tables_version は表を書き換えるコミットのたびに変わるので、クォータ台帳など読まない表への書き込みでは
+    捨てない。現在時刻から決まる期間は、呼び出す側で区切りの時刻に丸めて引数に入れる（キーが変わるようにする）。
+    """
+    def decorate(func):
+        cache = {}
+        state = {'version': None}
+
+        @functools.wraps(func)
+        async def wrapper(*args):
+            # 読み込みより先にバージョンを取る（読んだデータより古い番号で保存されるだけで、逆は起きない）
+            version = db.tables_version(tables)
+            if state['version'] != version:
+                cache.clear()
+                state['version'] = version
+            if args not in cache:
+                cache[args] = await func(*args)
+            return cache[args]
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorate
+
+
+def window_start(days, size):
+    """現在から days 日前を size 秒の区切りに丸めた時刻（集計の期間の始まり・キャッシュのキー）"""
+    return (now_ts() - days * DAY) // size * size
+
+
+def _columns(rows, dtypes):
+    """行のリストを列ごとの NumPy 配列に変換"""
+    import numpy as np
+    if not rows:
+        return [np.array([], dtype=dtype) for dtype in dtypes]
+    columns = list(zip(*rows))
+    return [np.array(column, dtype=dtype) for column, dtype in zip(columns, dtypes)]
+
+
+def _channel_filter(channel_ids):
+    if not channel_ids:
+        return '', []
+    return f" AND channel_id IN ({','.join('?' * len(channel_ids))})", list(channel_ids)
+
+
+@memoize_by_data_version('video_stats')
+async def load_videos(channel_ids=(), since_ts=0):
+    """動画インデックスの数値列を配列で読み込む（published_ts のない動画は除く）"""
+    import numpy as np
+    where, params = _channel_filter(channel_ids)
+    rows = await db.fetchall(f'''
+        SELECT video_id, title, published_ts, views, likes, comments
+        FROM video_stats
+        WHERE published_ts >= ?{where}
+    ''', [since_ts] + params)
+    video_ids, titles, published, views, likes, comments = _columns(
+        rows, (object, object, np.int64, np.int64, np.int64, np.int64)
+    )
+    return {
+        'video_id': video_ids,
+        'title': titles,
+        'published_ts': published,
+        'views': views,
+        'likes': likes,
+        'comments': comments
+    }
+
+
+def engagement_rates(views, likes, comments):
+    """(高評価 + コメント) / 再生数 × 100（再生数 0 の動画は 0）"""
+    import numpy as np
+    views = np.asarray(views, dtype=np.float64)
+    interactions = np.asarray(likes, dtype=np.float64) + np.asarray(comments, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(views > 0, interactions / views * 100, 0.0)
+
+
+def summarize(values):
+    """分布の要約（件数・平均・パーセンタイル）"""
+    import numpy as np
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return {'count': 0, 'mean': 0.0, **{f'p{p}': 0.0 for p in PERCENTILES}}
+    return {
+        'count': int(values.size),
+        'mean': round(float(values.mean()), 2),
+        **{f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    }
+
+
+async def engagement_metrics(channel_ids=(), days=30):
+    """期間内の動画のエンゲージメント率（再生数の多い順）と分布"""
+    # 開始時刻を1時間単位に丸め、1時間の間は同じ期間としてキャッシュに当たるようにする
+    return await _engagement_metrics(tuple(channel_ids), window_start(days, 3600))
+
+
+@memoize_by_data_version('video_stats')
+async def _engagement_metrics(channel_ids, since):
+    import numpy as np
+    videos = await load_videos(channel_ids, since)
+    has_views = videos['views'] > 0
+    rates = engagement_rates(videos['views'], videos['likes'], videos['comments'])[has_views]
+    # 再生数の多い順に並べ替えた列
+    order = np.argsort(-videos['views'][has_views], kind='stable')
+    sorted_columns = {key: videos[key][has_views][order] for key in ('title', 'views', 'published_ts', 'video_id')}
+    sorted_rates = rates[order]
+
+    return {
+        'videos': [{
+            'title': title,
+            'engagement_rate': round(float(rate), 2),
+            'views': int(views),
+            'published_ts': int(published_ts),
+            'video_id': video_id
+        } for title, rate, views, published_ts, video_id in zip(
+            sorted_columns['title'], sorted_rates, sorted_columns['views'],
+            sorted_columns['published_ts'], sorted_columns['video_id']
+        )],
+        'distribution': summarize(rates)
+    }
+
+
+@memoize_by_data_version('video_stats')
+async def posting_heatmap(channel_ids=()):
+    """曜日×時間帯（UTC）ごとの投稿数と平均再生数（7×24 の配列）"""
+    import numpy as np
+    videos = await load_videos(channel_ids, 0)
+    published = videos['published_ts']
+    # 1970-01-01 は木曜日（日曜日 = 0 として 4）
+    weekday = (published // DAY + 4) % 7
+    hour = (published % DAY) // 3600
+    cell = weekday * 24 + hour
+
+    counts = np.bincount(cell, minlength=7 * 24).reshape(7, 24)
+    total_views = np.bincount(cell, weights=videos['views'], minlength=7 * 24).reshape(7, 24)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_views = np.where(counts > 0, total_views / counts, 0.0)
+    return {'counts': counts, 'avg_views': avg_views}
+
+
+async def best_posting_slots(channel_ids=(), limit=5):
+    """平均再生数の高い曜日×時間帯"""
+    import numpy as np
+    heatmap = await posting_heatmap(channel_ids)
+    avg_views = heatmap['avg_views'].ravel()
+    counts = heatmap['counts'].ravel()
+    cells = np.flatnonzero(counts)
+    best = cells[np.argsort(-avg_views[cells], kind='stable')][:limit]
+    return [{
+        'day': WEEKDAYS[cell // 24],
+        'hour': int(cell % 24),
+        'avg_views': int(avg_views[cell]),
+        'post_count': int(counts[cell])
+    } for cell in best]
+
+
+async def daily_channel_stats(channel_id, days=7):
+    """チャンネル統計の日ごと（UTC）の平均と、その日に公開された動画数（期間の始まりは1時間単位）"""
+    return await _daily_channel_stats(channel_id, window_start(days, 3600))
+
+
+@memoize_by_data_version('channel_stats', 'video_stats')
+async def _daily_channel_stats(channel_id, since):
+    import numpy as np
+    rows = await db.fetchall('''
+        SELECT ts, subscribers, views
+        FROM channel_stats
+        WHERE channel_id = ? AND ts >= ?
+    ''', (channel_id, since))
+    ts, subscribers, views = _columns(rows, (np.int64, np.float64, np.float64))
+    if ts.size == 0:
+        return None
+
+    day_index, inverse = np.unique(ts // DAY, return_inverse=True)
+    samples = np.bincount(inverse)
+    videos = await load_videos((channel_id,), int(day_index[0]) * DAY)
+    published_day = videos['published_ts'] // DAY
+    # 統計のある日だけ数える（同じ日に公開された動画を day_index の位置に集計）
+    position = np.searchsorted(day_index, published_day)
+    matched = (position < day_index.size) & (day_index[np.minimum(position, day_index.size - 1)] == published_day)
+
+    return {
+        'day': day_index * DAY,
+        'subscribers': np.bincount(inverse, weights=subscribers) / samples,
+        'views': np.bincount(inverse, weights=views) / samples,
+        'new_videos': np.bincount(position[matched], minlength=day_index.size)
+    }
+
+
+def growth_rate(first, last):
+    """first から last への増加率（%）。first が 0 以下なら 0"""
+    return float((last - first) / first * 100) if first > 0 else 0.0
+
+
+async def weekly_trend(channel_id, days=7):
+    """期間の最初と最後の日の平均から成長率を求める（最低2日分のデータが必要）"""
+    daily = await daily_channel_stats(channel_id, days)
+    if daily is None or daily['day'].size < 2:
+        return None
+    return {
+        'subscribers': growth_rate(daily['subscribers'][0], daily['subscribers'][-1]),
+        'views': growth_rate(daily['views'][0], daily['views'][-1]),
+        'videos_per_day': float(daily['new_videos'].mean())
+    }
+
+
+# この日数までは日ごとの集計、それより長い期間は週ごとの集計を読む
+DAILY_TREND_MAX_DAYS = 180
+
+
+async def channel_trend(channel_id, days=90):
+    """長期間のチャンネル統計の推移（生データは保持期間で削除されるので historical_trends の集計を読む）
+
+    期間が長いほど区間の数が増えないよう、DAILY_TREND_MAX_DAYS までは日ごと、それより長ければ週ごとの集計を使う。
+    集計は1日単位なので、期間の始まりも1日単位に丸める。
+    """
+    tier = 'day' if days <= DAILY_TREND_MAX_DAYS else 'week'
+    return await _channel_trend(channel_id, tier, window_start(days, DAY))
+
+
+@memoize_by_data_version('historical_trends')
+async def _channel_trend(channel_id, tier, since):
+    import numpy as np
+    rows = await db.fetchall('''
+        SELECT bucket_ts, subscribers_last, views_last, videos_last, views_avg, growth_rate
+        FROM historical_trends
+        WHERE channel_id = ? AND tier = ? AND bucket_ts >= ?
+        ORDER BY bucket_ts
+    ''', (channel_id, tier, since))
+    if len(rows) < 2:
+        return None
+    bucket_ts, subscribers, views, videos = _columns(
+        [row[:4] for row in rows], (np.int64, np.float64, np.float64, np.float64)
+    )
+    growth = np.array([row[5] if row[5] is not None else np.nan for row in rows], dtype=np.float64)
+    best = int(np.nanargmax(growth)) if not np.isnan(growth).all() else None
+    return {
+        'tier': tier,
+        'buckets': len(rows),
+        'first_ts': int(bucket_ts[0]),
+        'last_ts': int(bucket_ts[-1]),
+        'subscribers': growth_rate(subscribers[0], subscribers[-1]),
+        'subscribers_added': int(subscribers[-1] - subscribers[0]),
+        'views': growth_rate(views[0], views[-1]),
+        'views_added': int(views[-1] - views[0]),
+        'videos_added': int(videos[-1] - videos[0]),
+        'best_bucket_ts': int(bucket_ts[best]) if best is not None else None,
+        'best_growth_rate': float(growth[best]) if best is not None else None
+    }
@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# レポート処理のベンチマーク
+# YouTube API には接続せず、記録したレスポンス（なければ同じ形式の合成データ）と合成サムネイルで
+# 各段階の処理時間を規模ごとに計測し、JSON で出力する。規模ごとに別プロセス・空のDBで実行する。
+#
+#   python benchmark.py --output bench.json                 # 既定の規模をすべて計測
+#   python benchmark.py --channels 1 50 --snapshots 1000    # 規模を指定
+#   python benchmark.py --baseline bench.json               # 前回より遅くなった段階があれば終了コード 1
+#   YOUTUBE_API_KEY=... python benchmark.py --record fixtures.json UC... UC...   # 実際のレスポンスを記録
+#   python benchmark.py --fixtures fixtures.json            # 記録したレスポンスで計測
+
+DEFAULT_CHANNELS = (1, 50, 500)
+DEFAULT_SNAPSHOTS = (1000, 10000, 100000)
+# 合成データの1チャンネルあたりの新着動画の数
+UPLOADS_PER_CHANNEL = 20
+# 保存済みの履歴として入れる動画1本あたりのスナップショット数
+SNAPSHOTS_PER_VIDEO = 5
+# サムネイル分析の件数（チャンネル数に比例させ、上限で打ち切る）
+THUMBNAILS_PER_CHANNEL = 2
+MAX_THUMBNAILS = 200
+# 前回の結果よりこの割合以上遅く、かつ差が NOISE_SECONDS を超えたら劣化とみなす
+REGRESSION_THRESHOLD = 0.2
+NOISE_SECONDS = 0.005
+SEED = 0
+
+TITLE_WORDS = [
+    'ゲーム実況', 'マインクラフト', '初見', '検証', 'ドッキリ', '料理', '大食い', '雑談', '歌ってみた',
+    'vlog', 'live', 'music', 'tutorial', 'review', '100日', '1万円', '最強', '神回', '【総集編】', '#12'
+]
+
+
+def benchmark_channel_id(i):
+    return f"UCbench{i:017d}"
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def synthetic_fixtures(n_channels, uploads=UPLOADS_PER_CHANNEL, seed=SEED, now=None):
+    """API のレスポンスと同じ形式の合成データ（同じ引数なら同じ内容）"""
+    rng = random.Random(seed)
+    now = now or int(time.time())
+    fixtures = {'channels': {}, 'playlistItems': {}, 'videos': {}}
+    for i in range(n_channels):
+        channel_id = benchmark_channel_id(i)
+        playlist_id = 'UU' + channel_id[2:]
+        fixtures['channels'][channel_id] = {
+            'id': channel_id,
+            'snippet': {'title': f"ベンチマーク {i}"},
+            'contentDetails': {'relatedPlaylists': {'uploads': playlist_id}},
+            'statistics': {
+                'subscriberCount': str(rng.randint(1000, 5000000)),
+                'viewCount': str(rng.randint(10 ** 5, 10 ** 9)),
+                'videoCount': str(rng.randint(50, 3000))
+            }
+        }
+        items = []
+        for j in range(uploads):
+            video_id = f"b{i:05d}_{j:04d}"
+            published = now - j * 8 * 3600 - rng.randint(0, 3600)
+            views = rng.randint(100, 2000000)
+            items.append({'contentDetails': {'videoId': video_id, 'videoPublishedAt': iso(published)}})
+            fixtures['videos'][video_id] = {
+                'id': video_id,
+                'snippet': {
+                    'channelId': channel_id,
+                    'title': ' '.join(rng.sample(TITLE_WORDS, 3)),
+                    'publishedAt': iso(published)
+                },
+                'statistics': {
+                    'viewCount': str(views),
+                    'likeCount': str(views // rng.randint(20, 80)),
+                    'commentCount': str(views // rng.randint(200, 800))
+                }
+            }
+        fixtures['playlistItems'][playlist_id] = items
+    return fixtures
+
+
+class ReplayYouTubeClient:
+    """記録したレスポンスを返す YouTube API クライアント（AsyncYouTubeClient と同じメソッド）"""
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+        self.calls = {}
+
+    def _count(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    async def channels_list(self, id, **params):
+        self._count('channels.list')
+        return {'items': [self.fixtures['channels'][c] for c in id.split(',') if c in self.fixtures['channels']]}
+
+    async def videos_list(self, id, **params):
+        self._count('videos.list')
+        return {'items': [self.fixtures['videos'][v] for v in id.split(',') if v in self.fixtures['videos']]}
+
+    async def playlist_items_list(self, playlistId, maxResults=50, pageToken=None, **params):
+        from youtube_api import YouTubeAPIError
+        self._count('playlistItems.list')
+        items = self.fixtures['playlistItems'].get(playlistId)
+        if items is None:
+            raise YouTubeAPIError(404, 'playlistNotFound', playlistId)
+        start = int(pageToken or 0)
+        response = {'items': items[start:start + maxResults]}
+        if start + maxResults < len(items):
+            response['nextPageToken'] = str(start + maxResults)
+        return response
+
+    async def search_list(self, **params):
+        self._count('search.list')
+        return {'items': []}
+
+    async def close(self):
+        pass
+
+
+async def record_fixtures(path, channel_ids):
+    """実際の API のレスポンスを記録してファイルに保存（YOUTUBE_API_KEY が必要）"""
+    from collector import fetch_channels, fetch_videos
+    from discovery import fetch_new_uploads, uploads_playlist_id
+    from youtube_api import AsyncYouTubeClient
+
+    fixtures = {'channels': {}, 'playlistItems': {}, 'videos': {}}
+
+    class RecordingYouTubeClient(AsyncYouTubeClient):
+        async def request(self, resource, **params):
+            data = await super().request(resource, **params)
+            if resource == 'playlistItems':
+                fixtures['playlistItems'].setdefault(params['playlistId'], []).extend(data.get('items', []))
+            elif resource in fixtures:
+                fixtures[resource].update((item['id'], item) for item in data.get('items', []))
+            return data
+
+    youtube = RecordingYouTubeClient(os.getenv('YOUTUBE_API_KEY'))
+    try:
+        channels = await fetch_channels(youtube, channel_ids)
+        uploads = await asyncio.gather(*[
+            fetch_new_uploads(
+                youtube,
+                item.get('contentDetails', {}).get('relatedPlaylists', {}).get('uploads')
+                or uploads_playlist_id(channel_id)
+            )
+            for channel_id, item in channels.items()
+        ])
+        await fetch_videos(youtube, [video_id for videos in uploads for video_id, _ in videos])
+    finally:
+        await youtube.close()
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False)
+    print(f"{len(fixtures['channels'])}チャンネル・{len(fixtures['videos'])}本の動画のレスポンスを記録しました: {path}")
+
+
+def synthetic_thumbnail(rng):
+    """テキスト入りのサムネイル風の画像（JPEG のバイト列）"""
+    import cv2
+    import numpy as np
+
+    image = np.empty((360, 480, 3), dtype=np.uint8)
+    image[:] = rng.integers(0, 256, 3, dtype=np.uint8)
+    for _ in range(rng.integers(2, 6)):
+        x, y = int(rng.integers(0, 400)), int(rng.integers(0, 300))
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        cv2.rectangle(image, (x, y), (x + int(rng.integers(40, 200)), y + int(rng.integers(30, 120))), color, -1)
+    cv2.putText(image, 'BENCH', (int(rng.integers(0, 200)), int(rng.integers(60, 340))),
+                cv2.FONT_HERSHEY_SIMPLEX, 2.5, (255, 255, 255), 6)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+async def seed_history(channel_ids, n_snapshots, now):
+    """保存済みの履歴（1ヶ月より前の動画とそのスナップショット・チャンネル統計）を入れる"""
+    from cadence import rebuild_all_cadence
+    from database import db
+
+    rng = random.Random(SEED + 1)
+    n_videos = max(1, n_snapshots // SNAPSHOTS_PER_VIDEO)
+    videos = []
+    for i in range(n_videos):
+        published = now - rng.randint(31, 365) * 86400
+        videos.append((
+            f"h{i:07d}", channel_ids[i % len(channel_ids)], ' '.join(rng.sample(TITLE_WORDS, 3)),
+            published, rng.randint(100, 10 ** 6), rng.randint(0, 10 ** 4), rng.randint(0, 10 ** 3)
+        ))
+    snapshots = [
+        (video_id, published + k * 86400, views * (k + 1) // SNAPSHOTS_PER_VIDEO, likes, comments,
+         rng.randint(0, 1000), rng.randint(0, 5000))
+        for video_id, _, _, published, views, likes, comments in videos
+        for k in range(SNAPSHOTS_PER_VIDEO)
+    ][:n_snapshots]
+    channel_stats = [
+        (channel_id, now - day * 86400, 10000 + day * 10, 10 ** 6 + day * 1000, 100)
+        for channel_id in channel_ids
+        for day in range(1, 15)
+    ]
+
+    def write(c):
+        c.executemany('''
+            INSERT OR REPLACE INTO video_stats
+            (video_id, channel_id, title, published_ts, views, likes, comments, updated_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [v + (now,) for v in videos])
+        c.executemany('''
+            INSERT OR REPLACE INTO video_performance_metrics
+            (video_id, ts, views, likes, comments, engagement_bp, views_per_hour)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', snapshots)
+        c.executemany('''
+            INSERT OR REPLACE INTO channel_stats (channel_id, ts, subscribers, views, videos)
+            VALUES (?, ?, ?, ?, ?)
+        ''', channel_stats)
+        # 履歴を直接入れたので、投稿ペースのモデルも作っておく（収集では新しい動画の分だけ更新される）
+        rebuild_all_cadence(c)
+
+    await db.run_write(write)
+    return len(snapshots)
+
+
+class ReportSink:
+    """send_daily_report の送信先（送られたメッセージを保持するだけ）"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+
+
+async def run_scale(n_channels, n_snapshots, fixtures):
+    """1つの規模で各段階を計測し、結果のリストを返す（環境変数を設定してから呼ぶこと）"""
+    import numpy as np
+
+    import discordYoutube as bot
+    import analytics
+    from collector import add_tracked_channel, collect_channel_stats, parse_video_item, save_video_stats_batch
+    from database import db, now_ts
+    from discovery import discover_videos
+    from keywords import get_top_keywords
+    from thumbnail_cache import fetcher
+    from thumbnails import analyze_many, save_thumbnail_results
+    from thumbnail_index import cluster_templates, find_similar_thumbnails
+
+    channel_ids = list(fixtures['channels'])[:n_channels]
+    youtube = ReplayYouTubeClient(fixtures)
+    bot.youtube = youtube
+    bot.RIVAL_CHANNEL_ID = channel_ids[0]
+    results = []
+
+    async def measure(stage, func, items):
+        started = time.perf_counter()
+        value = await func()
+        seconds = time.perf_counter() - started
+        results.append({
+            'stage': stage,
+            'channels': len(channel_ids),
+            'snapshots': n_snapshots,
+            'seconds': round(seconds, 4),
+            'items': items,
+            'items_per_second': round(items / seconds, 1) if seconds > 0 else None
+        })
+        return value
+
+    # 準備（計測しない）
+    await bot.init_db()
+    await asyncio.gather(*[add_tracked_channel(channel_id) for channel_id in channel_ids])
+    await seed_history(channel_ids, n_snapshots, now_ts())
+
+    # 収集: チャンネル統計と新着動画の取得・保存（記録したレスポンスを返すので API の待ち時間は含まない）
+    await measure('collection', lambda: asyncio.gather(
+        collect_channel_stats(youtube, channel_ids),
+        discover_videos(youtube, channel_ids)
+    ), len(channel_ids))
+
+    # DB 書き込み: 収集した動画の再保存（スナップショット追記・キーワード集計の差分反映を含む）
+    playlists = [fixtures['channels'][c]['contentDetails']['relatedPlaylists']['uploads'] for c in channel_ids]
+    videos = [parse_video_item(fixtures['videos'][item['contentDetails']['videoId']])
+              for playlist_id in playlists for item in fixtures['playlistItems'].get(playlist_id, [])
+              if item['contentDetails']['videoId'] in fixtures['videos']]
+    for video in videos:
+        video['views'] += 1
+    await measure('db_writes', lambda: save_video_stats_batch(videos), len(videos))
+
+    # 集計: キャッシュなしでエンゲージメント・投稿パターン・トレンド・キーワードを集計
+    for func in (analytics.load_videos, analytics._engagement_metrics, analytics.posting_heatmap,
+                 analytics._daily_channel_stats):
+        func.cache_clear()
+    video_count = (await db.fetchone('SELECT COUNT(*) FROM video_stats'))[0]
+    await measure('analytics', lambda: asyncio.gather(
+        analytics.engagement_metrics((), 30),
+        analytics.best_posting_slots(),
+        analytics.weekly_trend(channel_ids[0], 7),
+        get_top_keywords(limit=10)
+    ), video_count)
+
+    # レポートのスナップショット: 全チャンネル分の集計結果を作ってキャッシュに保存
+    await measure('report_snapshots', lambda: bot.build_report_snapshots(channel_ids), len(channel_ids))
+
+    # サムネイル分析: 合成画像の分析と保存（画像はあらかじめキャッシュに置く）
+    rng = np.random.default_rng(SEED)
+    n_thumbnails = min(MAX_THUMBNAILS, len(channel_ids) * THUMBNAILS_PER_CHANNEL)
+    digests = [fetcher.cache.write(synthetic_thumbnail(rng)) for _ in range(n_thumbnails)]
+
+    async def analyze_thumbnails():
+        analyses = await analyze_many([fetcher.cache.path(digest) for digest in digests])
+        await save_thumbnail_results([
+            (video['video_id'], digest, analysis)
+            for video, digest, analysis in zip(videos, digests, analyses) if analysis
+        ])
+
+    await measure('thumbnails', analyze_thumbnails, n_thumbnails)
+
+    # 似たサムネイルの検索: 分析したすべてのサムネイルについて索引を引き、テンプレートに分ける
+    thumbnail_ids = [row[0] for row in await db.fetchall('SELECT video_id FROM thumbnail_analysis')]
+    await measure('thumbnail_search', lambda: asyncio.gather(
+        *[find_similar_thumbnails(video_id) for video_id in thumbnail_ids],
+        cluster_templates()
+    ), len(thumbnail_ids))
+
+    # レンダリング: スナップショットがある状態で send_daily_report を1回実行
+    sink = ReportSink()
+    await measure('rendering', lambda: bot.send_daily_report(sink), 1)
+    if not sink.messages:
+        raise RuntimeError('レポートが作成されませんでした')
+    return results
+
+
+def run_one(args):
+    """子プロセス: 1つの規模を計測して結果をファイルに書く"""
+    if args.fixtures:
+        with open(args.fixtures, encoding='utf-8') as f:
+            fixtures = json.load(f)
+    else:
+        fixtures = synthetic_fixtures(args.channels[0])
+    # 環境変数はモジュールを読み込む前に設定する（DB のパスなどは import 時に決まる）
+    os.environ['RIVAL_CHANNEL_ID'] = next(iter(fixtures['channels']))
+    results = asyncio.run(run_scale(args.channels[0], args.snapshots[0], fixtures))
+    with open(args.result_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f)
+
+
+def run_all(args):
+    """規模ごとに子プロセスを起動して計測し、結果をまとめる"""
+    results = []
+    for n_channels in args.channels:
+        for n_snapshots in args.snapshots:
+            with tempfile.TemporaryDirectory(prefix='youtube-bench-') as workdir:
+                result_file = os.path.join(workdir, 'result.json')
+                env = dict(
+                    os.environ,
+                    YOUTUBE_STATS_DB=os.path.join(workdir, 'bench.db'),
+                    THUMBNAIL_CACHE_DIR=os.path.join(workdir, 'thumbnails'),
+                    YOUTUBE_API_KEY='benchmark'
+                )
+                command = [sys.executable, os.path.abspath(__file__), '--run-one',
+                           '--channels', str(n_channels), '--snapshots', str(n_snapshots),
+                           '--result-file', result_file]
+                if args.fixtures:
+                    command += ['--fixtures', os.path.abspath(args.fixtures)]
+                print(f"計測中: {n_channels}チャンネル・スナップショット{n_snapshots:,}件", file=sys.stderr)
+                subprocess.run(command, env=env, cwd=workdir, check=True,
+                               stdout=None if args.verbose else subprocess.DEVNULL)
+                with open(result_file, encoding='utf-8') as f:
+                    results.extend(json.load(f))
+    return results
+
+
+def find_regressions(results, baseline):
+    """前回の結果と同じ段階・規模の処理時間を比べ、遅くなったものを返す"""
+    previous = {(r['stage'], r['channels'], r['snapshots']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['stage'], result['channels'], result['snapshots']))
+        if before is None:
+            continue
+        if result['seconds'] > before * (1 + REGRESSION_THRESHOLD) and result['seconds'] - before > NOISE_SECONDS:
+            regressions.append({**result, 'baseline_seconds': before})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='レポート処理のオフラインベンチマーク')
+    parser.add_argument('--channels', type=int, nargs='+', default=list(DEFAULT_CHANNELS),
+                        help='チャンネル数（複数指定可）')
+    parser.add_argument('--snapshots', type=int, nargs='+', default=list(DEFAULT_SNAPSHOTS),
+                        help='保存済みのスナップショット数（複数指定可）')
+    parser.add_argument('--fixtures', help='--record で記録したレスポンス（省略時は合成データ）')
+    parser.add_argument('--output', help='結果の JSON の出力先（省略時は標準出力）')
+    parser.add_argument('--baseline', help='比較する前回の結果の JSON')
+    parser.add_argument('--record', metavar='PATH', help='実際の API のレスポンスを記録して PATH に保存')
+    parser.add_argument('record_channels', nargs='*', help='--record で記録するチャンネルID')
+    parser.add_argument('--verbose', action='store_true', help='計測中のログを表示する')
+    parser.add_argument('--run-one', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record_fixtures(args.record, args.record_channels))
+        return 0
+    if args.run_one:
+        run_one(args)
+        return 0
+
+    output = {
+        'created_at': iso(int(time.time())),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'fixtures': args.fixtures or 'synthetic',
+        'results': run_all(args)
+    }
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = find_regressions(output['results'], json.load(f))
+        for r in regressions:
+            print(f"⚠️ 劣化: {r['stage']}（{r['channels']}チャンネル・{r['snapshots']:,}件）"
+                  f" {r['baseline_seconds']:.3f}秒 → {r['seconds']:.3f}秒", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
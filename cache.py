@@ -0,0 +1,196 @@
+import asyncio
+import json
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+
+from database import db, now_ts
+from metrics import registry
+
+# メモリに保持するキャッシュの件数の上限（超えたら最近使われていないものから捨てる）
+CACHE_MAX_ENTRIES = 1024
+
+CACHE_LOOKUPS = registry.counter(
+    'cache_lookups', 'キャッシュの参照回数（result: hit / stale / miss）', ('kind', 'result'))
+CACHE_LOAD_SECONDS = registry.histogram('cache_load_seconds', 'キャッシュの読み込み（loader）の処理時間', ('kind',))
+
+
+def key_kind(key):
+    """メトリクスのラベルに使うキーの種類（'channel_stats:UC..' -> 'channel_stats'）"""
+    return key.rsplit(':', 1)[0] if ':' in key else key
+
+
+def _encode_default(value):
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f"キャッシュに保存できない値です: {type(value).__name__}")
+
+
+def _decode_hook(obj):
+    if len(obj) == 1 and '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+def encode_value(value):
+    """値を JSON 文字列に変換（datetime はタイムゾーンごと保存する）"""
+    return json.dumps(value, ensure_ascii=False, default=_encode_default)
+
+
+def decode_value(text):
+    return json.loads(text, object_hook=_decode_hook)
+
+
+class SingleFlight:
+    """同じキーの処理が重なったら1回だけ実行し、結果を共有する"""
+
+    def __init__(self):
+        self._tasks = {}
+
+    def run(self, key, func):
+        """func() のタスクを返す（同じキーで実行中のものがあればそれを返す）"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return task
+
+    def running(self, key):
+        return key in self._tasks
+
+
+def log_background_failure(name):
+    """裏で実行したタスクが失敗したときにログを残すコールバック"""
+    def report(task):
+        if task.cancelled() or task.exception() is None:
+            return
+        e = task.exception()
+        print(f"⚠️ バックグラウンド処理に失敗しました: {name} ({str(e)})")
+        traceback.print_exception(type(e), e, e.__traceback__)
+    return report
+
+
+class CacheEntry:
+    def __init__(self, value, updated_ts, ttl, stale_ttl):
+        self.value = value
+        self.updated_ts = updated_ts
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    def age(self, now):
+        return now - self.updated_ts
+
+    def is_fresh(self, now):
+        return self.age(now) < self.ttl
+
+    def is_usable(self, now):
+        """期限切れでも、再検証の間に返してよい範囲か"""
+        return self.age(now) < self.ttl + self.stale_ttl
+
+
+class TieredCache:
+    """メモリ（LRU）と SQLite の2段キャッシュ
+
+    - キーごとに ttl（新しいとみなす秒数）と stale_ttl（期限切れ後も返してよい秒数）を指定する
+    - 期限切れで stale_ttl 以内なら古い値をすぐに返し、裏で読み込み直す（stale-while-revalidate）
+    - 同じキーの読み込みが重なっても loader は1回だけ実行する（single-flight）
+    - SQLite の cache_entries に保存するので、再起動後もメモリに載せ直して使える
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._flight = SingleFlight()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def peek(self, key):
+        """保存されているエントリを返す（期限は確認しない・なければ None）"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        row = await db.fetchone('''
+            SELECT value, updated_ts, ttl, stale_ttl FROM cache_entries WHERE key = ?
+        ''', (key,))
+        if row is None:
+            return None
+        entry = CacheEntry(decode_value(row[0]), row[1], row[2], row[3])
+        self._remember(key, entry)
+        return entry
+
+    async def set(self, key, value, ttl, stale_ttl=0):
+        entry = CacheEntry(value, now_ts(), ttl, stale_ttl)
+        self._remember(key, entry)
+        await db.execute('''
+            INSERT OR REPLACE INTO cache_entries (key, value, updated_ts, ttl, stale_ttl)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (key, encode_value(value), entry.updated_ts, ttl, stale_ttl))
+        return entry
+
+    async def set_many(self, values, ttl, stale_ttl=0):
+        """{キー: 値} をまとめて保存（SQLite へは1回の書き込み）"""
+        ts = now_ts()
+        for key, value in values.items():
+            self._remember(key, CacheEntry(value, ts, ttl, stale_ttl))
+        await db.executemany('''
+            INSERT OR REPLACE INTO cache_entries (key, value, updated_ts, ttl, stale_ttl)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(key, encode_value(value), ts, ttl, stale_ttl) for key, value in values.items()])
+
+    async def _load(self, key, loader, ttl, stale_ttl):
+        with CACHE_LOAD_SECONDS.time(kind=key_kind(key)):
+            value = await loader()
+        if value is not None:
+            await self.set(key, value, ttl, stale_ttl)
+        return value
+
+    def _refresh(self, key, loader, ttl, stale_ttl):
+        """読み込みのタスクを返す（同じキーで実行中のものがあればそれを共有）"""
+        return self._flight.run(key, lambda: self._load(key, loader, ttl, stale_ttl))
+
+    def _revalidate(self, key, loader, ttl, stale_ttl):
+        if self._flight.running(key):
+            return
+        # 裏で読み込み直したときの失敗は、古い値を返し続けるだけなのでログに残す
+        self._refresh(key, loader, ttl, stale_ttl).add_done_callback(log_background_failure(key))
+
+    async def get(self, key, loader, ttl, stale_ttl=0):
+        """キャッシュの値を返す（なければ loader の結果を保存して返す）
+
+        loader は引数なしの async 関数。ttl 以内ならそのまま、ttl + stale_ttl 以内なら
+        古い値を返しつつ裏で loader を実行する。それより古いか、値がなければ loader を待つ。
+        loader が None を返したときは保存しない。返す値は共有されるので、呼び出し元で書き換えないこと。
+        """
+        now = now_ts()
+        entry = await self.peek(key)
+        kind = key_kind(key)
+        if entry is not None and entry.is_fresh(now):
+            CACHE_LOOKUPS.inc(kind=kind, result='hit')
+            return entry.value
+        if entry is not None and entry.is_usable(now):
+            CACHE_LOOKUPS.inc(kind=kind, result='stale')
+            self._revalidate(key, loader, ttl, stale_ttl)
+            return entry.value
+        CACHE_LOOKUPS.inc(kind=kind, result='miss')
+        # 待っている呼び出し元がキャンセルされても、共有している読み込みは止めない
+        return await asyncio.shield(self._refresh(key, loader, ttl, stale_ttl))
+
+    async def invalidate(self, key):
+        self._memory.pop(key, None)
+        await db.execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    async def prune(self):
+        """stale_ttl も過ぎたエントリを SQLite から削除"""
+        return await db.run_write(lambda c: c.execute(
+            'DELETE FROM cache_entries WHERE updated_ts + ttl + stale_ttl < ?', (now_ts(),)
+        ).rowcount)
+
+
+# プロセス内で共有するキャッシュ
+cache = TieredCache()
@@ -0,0 +1,181 @@
+import json
+import statistics
+
+from database import db, now_ts
+
+# 平均・中央値を求める直近の投稿間隔の数
+CADENCE_WINDOW = 20
+# IN 句1回あたりのIDの数
+LOOKUP_CHUNK_SIZE = 500
+DAY = 86400
+
+
+def slot_of(ts):
+    """UNIX 時刻の曜日×時間帯（UTC・日曜日 = 0）の番号（0〜167。analytics.posting_heatmap と同じ区切り）"""
+    # 1970-01-01 は木曜日（日曜日 = 0 として 4）
+    return ((ts // DAY + 4) % 7) * 24 + (ts % DAY) // 3600
+
+
+def _empty_state():
+    return {
+        'video_count': 0,
+        'first_published_ts': None,
+        'last_published_ts': None,
+        'recent_intervals': [],
+        'slot_counts': [0] * (7 * 24)
+    }
+
+
+def _append(state, ts):
+    """最新の投稿より新しい動画を1本足す（直近の間隔は CADENCE_WINDOW 件だけ持つので O(1)）"""
+    if state['last_published_ts'] is not None:
+        state['recent_intervals'].append(ts - state['last_published_ts'])
+        del state['recent_intervals'][:-CADENCE_WINDOW]
+    else:
+        state['first_published_ts'] = ts
+    state['last_published_ts'] = ts
+    state['video_count'] += 1
+    state['slot_counts'][slot_of(ts)] += 1
+
+
+def _build(timestamps):
+    state = _empty_state()
+    for ts in sorted(timestamps):
+        _append(state, ts)
+    return state
+
+
+def _summary_columns(state):
+    """保存する平均・中央値・次の投稿の予想時刻（読むときに計算しなくてよいように）"""
+    intervals = state['recent_intervals']
+    if not intervals:
+        return None, None, None
+    mean = sum(intervals) / len(intervals)
+    median = statistics.median(intervals)
+    return round(mean), round(median), state['last_published_ts'] + round(median)
+
+
+def _load_states(c, channel_ids):
+    states = {}
+    for i in range(0, len(channel_ids), LOOKUP_CHUNK_SIZE):
+        chunk = channel_ids[i:i + LOOKUP_CHUNK_SIZE]
+        rows = c.execute(f'''
+            SELECT channel_id, video_count, first_published_ts, last_published_ts, recent_intervals, slot_counts
+            FROM posting_cadence
+            WHERE channel_id IN ({','.join('?' * len(chunk))})
+        ''', chunk).fetchall()
+        for row in rows:
+            states[row[0]] = {
+                'video_count': row[1],
+                'first_published_ts': row[2],
+                'last_published_ts': row[3],
+                'recent_intervals': json.loads(row[4]),
+                'slot_counts': json.loads(row[5])
+            }
+    return states
+
+
+def _save_states(c, states):
+    ts = now_ts()
+    c.executemany('''
+        INSERT OR REPLACE INTO posting_cadence
+        (channel_id, video_count, first_published_ts, last_published_ts, recent_intervals, slot_counts,
+         mean_interval, median_interval, next_expected_ts, updated_ts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        channel_id,
+        state['video_count'],
+        state['first_published_ts'],
+        state['last_published_ts'],
+        json.dumps(state['recent_intervals']),
+        json.dumps(state['slot_counts']),
+        *_summary_columns(state),
+        ts
+    ) for channel_id, state in states.items()])
+
+
+def _channel_timestamps(c, channel_id):
+    return [row[0] for row in c.execute('''
+        SELECT published_ts FROM video_stats WHERE channel_id = ? AND published_ts IS NOT NULL
+    ''', (channel_id,)).fetchall()]
+
+
+def apply_cadence_updates(c, videos):
+    """新しく見つかった動画を、チャンネルごとの投稿ペースのモデルに反映（書き込みスレッドで、video_stats の更新前に呼ぶ）
+
+    videos は video_id, channel_id, published_ts を持つ dict のリスト。video_stats にまだない動画だけを数える。
+    最新の投稿より新しい動画は1本 O(1) で足し、それより古い動画（初回の取り込みや過去分の補完）が
+    混じったチャンネルだけ、保存済みの動画から作り直す。
+    """
+    videos = list({v["video_id"]: v for v in videos if v.get("published_ts") is not None}.values())
+    if not videos:
+        return 0
+    known = set()
+    ids = [v["video_id"] for v in videos]
+    for i in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+        chunk = ids[i:i + LOOKUP_CHUNK_SIZE]
+        known.update(row[0] for row in c.execute(f'''
+            SELECT video_id FROM video_stats WHERE video_id IN ({','.join('?' * len(chunk))})
+        ''', chunk).fetchall())
+
+    new_by_channel = {}
+    for video in videos:
+        if video["video_id"] not in known and video.get("channel_id"):
+            new_by_channel.setdefault(video["channel_id"], []).append(video["published_ts"])
+    if not new_by_channel:
+        return 0
+
+    states = _load_states(c, list(new_by_channel))
+    for channel_id, timestamps in new_by_channel.items():
+        state = states.get(channel_id)
+        if state is not None and min(timestamps) >= (state['last_published_ts'] or 0):
+            for ts in sorted(timestamps):
+                _append(state, ts)
+        else:
+            states[channel_id] = _build(_channel_timestamps(c, channel_id) + timestamps)
+    _save_states(c, states)
+    return sum(len(timestamps) for timestamps in new_by_channel.values())
+
+
+def rebuild_all_cadence(c):
+    """保存済みのすべての動画から投稿ペースのモデルを作り直す（書き込みスレッド・マイグレーションで呼ぶ）"""
+    timestamps = {}
+    for channel_id, ts in c.execute('''
+        SELECT channel_id, published_ts FROM video_stats
+        WHERE channel_id IS NOT NULL AND published_ts IS NOT NULL
+    '''):
+        timestamps.setdefault(channel_id, []).append(ts)
+    c.execute('DELETE FROM posting_cadence')
+    _save_states(c, {channel_id: _build(values) for channel_id, values in timestamps.items()})
+    return len(timestamps)
+
+
+async def get_posting_cadence(channel_id):
+    """チャンネルの投稿ペース（保存済みのモデルを1行読むだけ・なければ None）
+
+    間隔は秒。平均・中央値は直近 CADENCE_WINDOW 本の間隔、overall_interval は最初から最新の投稿までの平均。
+    weekday_counts（日曜日から）・hour_counts は UTC の曜日・時間帯ごとの投稿数。
+    """
+    row = await db.fetchone('''
+        SELECT video_count, first_published_ts, last_published_ts, slot_counts,
+               mean_interval, median_interval, next_expected_ts, updated_ts
+        FROM posting_cadence
+        WHERE channel_id = ?
+    ''', (channel_id,))
+    if row is None:
+        return None
+    video_count, first_ts, last_ts = row[0], row[1], row[2]
+    slots = json.loads(row[3])
+    return {
+        'channel_id': channel_id,
+        'video_count': video_count,
+        'last_published_ts': last_ts,
+        'mean_interval': row[4],
+        'median_interval': row[5],
+        'overall_interval': round((last_ts - first_ts) / (video_count - 1)) if video_count > 1 else None,
+        'next_expected_ts': row[6],
+        'weekday_counts': [sum(slots[day * 24:(day + 1) * 24]) for day in range(7)],
+        'hour_counts': [sum(slots[hour::24]) for hour in range(24)],
+        'slot_counts': slots,
+        'updated_ts': row[7]
+    }
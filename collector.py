@@ -0,0 +1,173 @@
+import asyncio
+
+from cadence import apply_cadence_updates
+from database import db, now_ts, to_epoch
+from keywords import apply_keyword_updates, extract_keywords_many
+from snapshots import append_video_snapshots
+
+# channels.list / videos.list に一度に渡せるIDの上限
+MAX_IDS_PER_REQUEST = 50
+
+
+def chunked(items, size=MAX_IDS_PER_REQUEST):
+    """リストを size 件ずつに分割する"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# 追跡チャンネルの登録・管理
+async def add_tracked_channel(channel_id, channel_name=None):
+    await db.execute('''
+        INSERT INTO tracked_channels (channel_id, channel_name, active)
+        VALUES (?, ?, 1)
+        ON CONFLICT(channel_id) DO UPDATE SET
+            active = 1,
+            channel_name = COALESCE(excluded.channel_name, tracked_channels.channel_name)
+    ''', (channel_id, channel_name))
+
+
+async def remove_tracked_channel(channel_id):
+    """追跡を停止する（過去の統計は残す）"""
+    await db.execute('UPDATE tracked_channels SET active = 0 WHERE channel_id = ?', (channel_id,))
+
+
+async def get_tracked_channels(active_only=True):
+    if active_only:
+        rows = await db.fetchall('SELECT channel_id FROM tracked_channels WHERE active = 1 ORDER BY added_at')
+    else:
+        rows = await db.fetchall('SELECT channel_id FROM tracked_channels ORDER BY added_at')
+    return [row[0] for row in rows]
+
+
+# 一括取得
+async def fetch_channels(youtube, channel_ids, part="statistics,snippet,contentDetails"):
+    """50件ずつ channels.list を呼び出し、チャンネルIDごとの結果を返す"""
+    channel_ids = list(dict.fromkeys(channel_ids))  # 重複を除去（順序は維持）
+    responses = await asyncio.gather(*[
+        youtube.channels_list(part=part, id=",".join(batch), maxResults=MAX_IDS_PER_REQUEST)
+        for batch in chunked(channel_ids)
+    ])
+    return {item["id"]: item for response in responses for item in response.get("items", [])}
+
+
+async def fetch_videos(youtube, video_ids, part="statistics,snippet"):
+    """50件ずつ videos.list を呼び出し、動画IDごとの結果を返す"""
+    video_ids = list(dict.fromkeys(video_ids))
+    responses = await asyncio.gather(*[
+        youtube.videos_list(part=part, id=",".join(batch), maxResults=MAX_IDS_PER_REQUEST)
+        for batch in chunked(video_ids)
+    ])
+    return {item["id"]: item for response in responses for item in response.get("items", [])}
+
+
+def parse_channel_item(item):
+    stats = item.get("statistics", {})
+    return {
+        "channel_id": item["id"],
+        "channel_name": item.get("snippet", {}).get("title"),
+        "uploads_playlist_id": item.get("contentDetails", {}).get("relatedPlaylists", {}).get("uploads"),
+        "subscribers": int(stats.get("subscriberCount", "0")),
+        "views": int(stats.get("viewCount", "0")),
+        "videos": int(stats.get("videoCount", "0"))
+    }
+
+
+def parse_video_item(item):
+    stats = item.get("statistics", {})
+    snippet = item.get("snippet", {})
+    return {
+        "video_id": item["id"],
+        "channel_id": snippet.get("channelId"),
+        "title": snippet.get("title"),
+        "published_ts": to_epoch(snippet.get("publishedAt")),
+        "views": int(stats.get("viewCount", 0)),
+        "likes": int(stats.get("likeCount", 0)),
+        "comments": int(stats.get("commentCount", 0))
+    }
+
+
+# 一括保存
+async def save_channel_stats_batch(channel_stats):
+    """チャンネル統計をまとめて保存（1トランザクション）"""
+    if not channel_stats:
+        return
+
+    ts = now_ts()
+
+    def write(c):
+        c.executemany('''
+            INSERT OR REPLACE INTO channel_stats (channel_id, ts, subscribers, views, videos)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(s["channel_id"], ts, s["subscribers"], s["views"], s["videos"]) for s in channel_stats])
+        c.executemany('''
+            INSERT OR REPLACE INTO channel_info (channel_id, channel_name, updated_ts)
+            VALUES (?, ?, ?)
+        ''', [(s["channel_id"], s["channel_name"], ts) for s in channel_stats if s["channel_name"]])
+        c.executemany('''
+            UPDATE tracked_channels
+            SET channel_name = COALESCE(?, channel_name),
+                uploads_playlist_id = COALESCE(?, uploads_playlist_id)
+            WHERE channel_id = ?
+        ''', [(s["channel_name"], s["uploads_playlist_id"], s["channel_id"]) for s in channel_stats])
+
+    await db.run_write(write)
+
+
+async def save_video_stats_batch(video_stats):
+    """動画統計をまとめて保存/更新（1トランザクション）"""
+    if not video_stats:
+        return
+    ts = now_ts()
+    keyword_updates = [
+        {**v, "keywords": keywords}
+        for v, keywords in zip(video_stats, extract_keywords_many([v["title"] for v in video_stats]))
+    ]
+
+    def write(c):
+        # 上書きで前回の数値が失われる前に、変化した動画のスナップショットを残す
+        append_video_snapshots(c, video_stats, ts)
+        # キーワード別の集計に再生数の差分を反映
+        apply_keyword_updates(c, keyword_updates)
+        # 新しく見つかった動画をチャンネルの投稿ペースに反映（video_stats に入る前に新旧を判定する）
+        apply_cadence_updates(c, video_stats)
+        c.executemany('''
+            INSERT OR REPLACE INTO video_stats
+            (video_id, channel_id, title, published_ts, views, likes, comments, updated_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(
+            v["video_id"], v["channel_id"], v["title"], v["published_ts"],
+            v["views"], v["likes"], v["comments"], ts
+        ) for v in video_stats])
+
+    await db.run_write(write)
+
+
+# 収集処理
+async def collect_channel_stats(youtube, channel_ids=None):
+    """追跡中の全チャンネルの統計を取得・保存し、チャンネルIDごとの統計を返す"""
+    if channel_ids is None:
+        channel_ids = await get_tracked_channels()
+    if not channel_ids:
+        return {}
+
+    items = await fetch_channels(youtube, channel_ids)
+    channel_stats = [parse_channel_item(item) for item in items.values()]
+    await save_channel_stats_batch(channel_stats)
+
+    missing = set(channel_ids) - set(items)
+    if missing:
+        print(f"取得できなかったチャンネル: {', '.join(sorted(missing))}")
+
+    return {s["channel_id"]: s for s in channel_stats}
+
+
+async def collect_video_stats(youtube, video_ids):
+    """動画統計を50件ずつ取得・保存し、動画IDごとの統計を返す"""
+    if not video_ids:
+        return {}
+
+    items = await fetch_videos(youtube, video_ids)
+    video_stats = [parse_video_item(item) for item in items.values()]
+    await save_video_stats_batch(video_stats)
+
+    return {v["video_id"]: v for v in video_stats}
@@ -0,0 +1,255 @@
+import asyncio
+from collections import Counter
+
+from database import db, now_ts, to_epoch
+from tokenizer import tokenize_many
+from youtube_api import YouTubeAPIError
+
+# 1ページのコメント数（commentThreads.list の上限・1ユニット）
+COMMENT_PAGE_SIZE = 100
+# この件数ごとにまとめて保存する（メモリに持つのは1バッチ分と先読みのページだけ）
+COMMENT_BATCH_SIZE = 1000
+# 先に取得しておくページ数
+PREFETCH_PAGES = 2
+# 1回の取り込みで読むページ数の上限（続きは次回、保存したページトークンから再開する）
+MAX_PAGES_PER_RUN = 50
+# 取り込みをやめる API のエラー（コメントが無効・動画が非公開など）
+DISABLED_REASONS = {'commentsDisabled', 'videoNotFound', 'forbidden'}
+
+_END = object()
+
+
+async def comment_pages(youtube, video_id, page_token=None, max_pages=MAX_PAGES_PER_RUN):
+    """commentThreads.list のページを新しい順に返すジェネレーター（(レスポンス, 次のページトークン)）"""
+    for _ in range(max_pages):
+        response = await youtube.comment_threads_list(
+            part="snippet",
+            videoId=video_id,
+            maxResults=COMMENT_PAGE_SIZE,
+            order="time",
+            textFormat="plainText",
+            pageToken=page_token
+        )
+        page_token = response.get("nextPageToken")
+        yield response, page_token
+        if not page_token:
+            break
+
+
+async def prefetch(source, size=PREFETCH_PAGES):
+    """source を別タスクで先に進めておく（保存している間に次のページを取得する。先読みは size 件まで）"""
+    queue = asyncio.Queue(size)
+
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put((item, None))
+            await queue.put((_END, None))
+        except Exception as e:
+            await queue.put((_END, e))
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        task.cancel()
+
+
+def parse_comment_thread(item):
+    """コメントスレッド1件を (comment_id, published_ts, likes, replies, 本文) に変換"""
+    snippet = item.get("snippet", {})
+    comment = snippet.get("topLevelComment", {}).get("snippet", {})
+    return (
+        item["id"],
+        to_epoch(comment.get("publishedAt")),
+        int(comment.get("likeCount", 0)),
+        int(snippet.get("totalReplyCount", 0)),
+        comment.get("textOriginal") or comment.get("textDisplay") or ""
+    )
+
+
+async def comment_batches(pages, stop_ts=None, batch_size=COMMENT_BATCH_SIZE):
+    """ページを batch_size 件ほどのバッチにまとめるジェネレーター
+
+    (コメントのリスト, 再開用のページトークン, 最後まで読んだか) を返す。バッチはページの境目で区切るので、
+    ページトークンから再開すれば続きのコメントから読める。stop_ts より前のコメントに届いたら（取り込み済み）そこで終える。
+    """
+    batch = []
+    async for response, next_token in pages:
+        rows = [parse_comment_thread(item) for item in response.get("items", [])]
+        # 同じ秒のコメントを取りこぼさないよう、stop_ts ちょうどのものは読み直す（保存時に重複は除く）
+        reached = stop_ts is not None and any(row[1] is not None and row[1] < stop_ts for row in rows)
+        if reached:
+            rows = [row for row in rows if row[1] is None or row[1] >= stop_ts]
+        batch.extend(rows)
+        finished = reached or not next_token
+        if finished or len(batch) >= batch_size:
+            yield batch, None if finished else next_token, finished
+            batch = []
+            if finished:
+                return
+    if batch:
+        # ページ数の上限で止まった（続きは次回）
+        yield batch, next_token, False
+
+
+async def get_comment_sync_state(video_id):
+    row = await db.fetchone('''
+        SELECT page_token, pass_newest_ts, synced_ts, disabled FROM comment_sync_state WHERE video_id = ?
+    ''', (video_id,))
+    if row is None:
+        return {"page_token": None, "pass_newest_ts": None, "synced_ts": None, "disabled": 0}
+    return {"page_token": row[0], "pass_newest_ts": row[1], "synced_ts": row[2], "disabled": row[3]}
+
+
+async def save_comment_batch(video_id, rows, next_token, finished, pass_newest_ts):
+    """コメントのバッチ・語の集計・再開位置を1トランザクションで保存
+
+    同じコメントをもう一度受け取ったとき（再開・差分取得の境目）は、高評価数と返信数だけを更新し語は数え直さない。
+    """
+    # 語はコメントごとに重複を除いて数える（その語を含むコメントの数）
+    term_sets = [set(tokens) for tokens in await asyncio.to_thread(tokenize_many, [row[4] for row in rows])]
+    ts = now_ts()
+
+    def write(c):
+        known = {}
+        ids = [row[0] for row in rows]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            known.update(c.execute(f'''
+                SELECT comment_id, replies FROM video_comments
+                WHERE video_id = ? AND comment_id IN ({','.join('?' * len(chunk))})
+            ''', [video_id] + chunk).fetchall())
+
+        terms = Counter()
+        new_threads = 0
+        reply_delta = 0
+        for row, term_set in zip(rows, term_sets):
+            if row[0] in known:
+                reply_delta += row[3] - (known[row[0]] or 0)
+            else:
+                terms.update(term_set)
+                new_threads += 1
+                reply_delta += row[3]
+                known[row[0]] = row[3]
+
+        # 最後まで読んだら、そのときの動画のコメント数を残す（これより増えたら次の取り込みを登録する）
+        synced_comments = None
+        if finished:
+            row = c.execute('SELECT comments FROM video_stats WHERE video_id = ?', (video_id,)).fetchone()
+            synced_comments = row[0] if row and row[0] is not None else 0
+
+        c.executemany('''
+            INSERT INTO video_comments (video_id, comment_id, published_ts, likes, replies)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(video_id, comment_id) DO UPDATE SET likes = excluded.likes, replies = excluded.replies
+        ''', [(video_id, row[0], row[1], row[2], row[3]) for row in rows])
+        c.executemany('''
+            INSERT INTO comment_terms (video_id, term, comments) VALUES (?, ?, ?)
+            ON CONFLICT(video_id, term) DO UPDATE SET comments = comment_terms.comments + excluded.comments
+        ''', [(video_id, term, count) for term, count in terms.items()])
+        c.execute('''
+            INSERT INTO comment_sync_state
+            (video_id, page_token, pass_newest_ts, synced_ts, threads, replies, synced_comments, updated_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(video_id) DO UPDATE SET
+                page_token = excluded.page_token,
+                pass_newest_ts = excluded.pass_newest_ts,
+                synced_ts = COALESCE(excluded.synced_ts, comment_sync_state.synced_ts),
+                threads = comment_sync_state.threads + excluded.threads,
+                replies = comment_sync_state.replies + excluded.replies,
+                synced_comments = COALESCE(excluded.synced_comments, comment_sync_state.synced_comments),
+                updated_ts = excluded.updated_ts
+        ''', (
+            video_id,
+            next_token,
+            None if finished else pass_newest_ts,
+            pass_newest_ts if finished else None,
+            new_threads,
+            reply_delta,
+            synced_comments,
+            ts
+        ))
+        return new_threads
+
+    return await db.run_write(write)
+
+
+async def mark_comments_disabled(video_id):
+    await db.execute('''
+        INSERT INTO comment_sync_state (video_id, disabled, updated_ts) VALUES (?, 1, ?)
+        ON CONFLICT(video_id) DO UPDATE SET disabled = 1, page_token = NULL, updated_ts = excluded.updated_ts
+    ''', (video_id, now_ts()))
+
+
+async def ingest_comments(youtube, video_id, max_pages=MAX_PAGES_PER_RUN):
+    """動画のコメントを取り込む（取得・解析・保存をページ単位で流し、メモリは1バッチ分に収める）
+
+    前回途中で止まっていれば保存したページトークンから再開し、前回最後まで読んだ時点で取り込み済みだった
+    時刻に届いたら止める（2回目以降は新しいコメントだけを読む）。
+    新たに保存したコメント数と、最後まで読んだかを返す。
+    """
+    state = await get_comment_sync_state(video_id)
+    if state["disabled"]:
+        return {"comments": 0, "finished": True}
+    page_token = state["page_token"]
+    # 読むのは前回までに取り込み済みの時刻まで（途中から再開するときも同じ）
+    stop_ts = state["synced_ts"]
+    # 読み始めたときの最新のコメントの時刻（最後まで読んだら、ここまで取り込み済みになる）
+    pass_newest_ts = state["pass_newest_ts"] if page_token is not None else None
+
+    saved = 0
+    finished = False
+    pages = prefetch(comment_pages(youtube, video_id, page_token, max_pages))
+    try:
+        async for rows, next_token, finished in comment_batches(pages, stop_ts):
+            if pass_newest_ts is None:
+                pass_newest_ts = max((row[1] for row in rows if row[1] is not None), default=stop_ts) or now_ts()
+            saved += await save_comment_batch(video_id, rows, next_token, finished, pass_newest_ts)
+    except YouTubeAPIError as e:
+        if page_token is not None and e.status == 400:
+            # 保存していたページトークンが使えなくなった。次回は先頭から読み直す
+            await db.execute('UPDATE comment_sync_state SET page_token = NULL WHERE video_id = ?', (video_id,))
+        elif e.reason in DISABLED_REASONS or e.status == 404:
+            await mark_comments_disabled(video_id)
+            finished = True
+        else:
+            raise
+    finally:
+        await pages.aclose()
+    return {"comments": saved, "finished": finished}
+
+
+async def get_comment_summary(video_id, top_terms=10):
+    """取り込んだコメントの集計（よく使われる語・コメントの速度・返信の割合）"""
+    state = await db.fetchone('SELECT threads, replies, updated_ts FROM comment_sync_state WHERE video_id = ?', (video_id,))
+    if not state or not state[0]:
+        return None
+    now = now_ts()
+    row = await db.fetchone('''
+        SELECT MIN(published_ts), MAX(published_ts),
+               SUM(CASE WHEN published_ts >= ? THEN 1 ELSE 0 END)
+        FROM video_comments
+        WHERE video_id = ?
+    ''', (now - 24 * 3600, video_id))
+    terms = await db.fetchall('''
+        SELECT term, comments FROM comment_terms WHERE video_id = ? ORDER BY comments DESC, term LIMIT ?
+    ''', (video_id, top_terms))
+    threads, replies = state[0], state[1]
+    span_hours = max(1.0, ((row[1] or now) - (row[0] or now)) / 3600)
+    return {
+        "video_id": video_id,
+        "threads": threads,
+        "replies": replies,
+        "reply_ratio": round(replies / threads, 3),
+        "comments_per_hour": round(threads / span_hours, 2),
+        "comments_last_24h": row[2] or 0,
+        "top_terms": [(term, count) for term, count in terms],
+        "updated_ts": state[2]
+    }
@@ -0,0 +1,305 @@
+import asyncio
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from metrics import registry
+
+DB_PATH = os.getenv('YOUTUBE_STATS_DB', 'youtube_stats.db')
+# 1回のコミットにまとめる書き込みの最大件数
+WRITE_BATCH_SIZE = 500
+# 最初の書き込みを受けてから、後続の書き込みを待つ時間（秒）
+WRITE_BATCH_WINDOW = 0.02
+# 読み込み用スレッド数
+READ_WORKERS = 4
+
+DB_READ_SECONDS = registry.histogram('db_read_seconds', '読み込みクエリの処理時間', ('kind',))
+DB_WRITE_SECONDS = registry.histogram('db_write_seconds', '書き込みを積んでからコミットされるまでの時間')
+DB_COMMIT_SECONDS = registry.histogram('db_commit_seconds', '1回のコミット（バッチ）の処理時間')
+DB_WRITE_BATCH_SIZE = registry.histogram(
+    'db_write_batch_size', '1回のコミットにまとめた書き込みの件数', buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+DB_WRITE_ERRORS = registry.counter('db_write_errors', '失敗した書き込みの件数')
+
+
+# 時刻はすべて UNIX 時刻（秒, UTC）の整数で保存する
+def now_ts():
+    return int(time.time())
+
+
+def to_epoch(value):
+    """各種の時刻表現を UNIX 時刻（秒）に変換
+
+    - '2024-01-01T00:00:00Z' / '+09:00' などオフセット付き → その時刻
+    - '2024-01-01 00:00:00'（SQLite の CURRENT_TIMESTAMP）→ UTC とみなす
+    - '2024-01-01T00:00:00'（datetime.now().isoformat()）→ ローカル時刻とみなす
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    text = str(value).strip()
+    dt = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    if dt.tzinfo is None and 'T' not in text:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def from_epoch(ts):
+    """UNIX 時刻（秒）を UTC の datetime に変換"""
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+# 表を書き換える操作（authorizer に渡される action）
+_WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+
+
+def _track_writes(conn, tables):
+    """この後に実行する文が書き換える表の名前を tables に集める
+
+    authorizer は文をコンパイルするときにしか呼ばれないが、設定し直すとコンパイル済みの文が無効になるので、
+    キャッシュされた文もここから先で最初に実行するときにもう一度呼ばれる。
+    """
+    def authorizer(action, table, column, database, trigger):
+        if action in _WRITE_ACTIONS:
+            tables.add(table)
+        return sqlite3.SQLITE_OK
+    conn.set_authorizer(authorizer)
+
+
+class _WriteOp:
+    """書き込みキューに積む1件分の処理"""
+
+    def __init__(self, func, standalone=False):
+        self.func = func
+        # True ならトランザクションの外で単独で実行する（VACUUM など）
+        self.standalone = standalone
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class Database:
+    """SQLite の共有アクセス層
+
+    - 書き込みは専用スレッドがキューから取り出し、まとめて1トランザクションでコミットする
+    - 読み込みはスレッドごとの接続で行い、非同期コードからはスレッドプール経由で呼ぶ
+    - WAL モードにより、書き込み中でも読み込みはブロックされない
+    """
+
+    def __init__(self, path=DB_PATH, read_workers=READ_WORKERS):
+        self.path = path
+        self.read_workers = read_workers
+        self._queue = queue.Queue()
+        self._writer = None
+        self._readers = threading.local()
+        self._read_executor = None
+        self._lock = threading.Lock()
+        # コミットのたびに増える番号と、表ごとに最後に書き換えたときの番号（集計結果のキャッシュの無効化に使う）
+        self.data_version = 0
+        self.table_versions = {}
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        # 新しい DB では削除した行の空きページを incremental_vacuum で返せるようにする（既存の DB では効かない）
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # WAL ではコミット毎の fsync を省いても壊れない
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    # 書き込み
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+                self._writer.start()
+
+    def _writer_loop(self):
+        conn = self.connect()
+        while True:
+            op = self._queue.get()
+            if op is None:
+                break
+            if op.standalone:
+                self._run_standalone(conn, op)
+                continue
+            batch = [op]
+            stop = False
+            standalone = None
+            # 少しだけ待って、後続の書き込みを同じコミットにまとめる
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    op = self._queue.get(timeout=WRITE_BATCH_WINDOW)
+                except queue.Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                if op.standalone:
+                    standalone = op
+                    break
+                batch.append(op)
+            self._commit_batch(conn, batch)
+            if standalone is not None:
+                self._run_standalone(conn, standalone)
+            if stop:
+                break
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        started = time.perf_counter()
+        touched = set()
+        _track_writes(conn, touched)
+        try:
+            conn.execute('BEGIN')
+            for op in batch:
+                # 1件の失敗でバッチ全体が失われないよう、処理ごとにセーブポイントを置く
+                conn.execute('SAVEPOINT op')
+                try:
+                    results.append((op, op.func(conn), None))
+                    conn.execute('RELEASE op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO op')
+                    conn.execute('RELEASE op')
+                    results.append((op, None, e))
+            conn.execute('COMMIT')
+            self._bump_versions(touched)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            DB_WRITE_ERRORS.inc(len(batch))
+            for op in batch:
+                if not op.future.done():
+                    op.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        DB_COMMIT_SECONDS.observe(finished - started)
+        DB_WRITE_BATCH_SIZE.observe(len(batch))
+        for op, result, error in results:
+            DB_WRITE_SECONDS.observe(finished - op.submitted)
+            if error is not None:
+                DB_WRITE_ERRORS.inc()
+                op.future.set_exception(error)
+            else:
+                op.future.set_result(result)
+
+    def _run_standalone(self, conn, op):
+        """前に積まれた書き込みをコミットした後、トランザクションを開かずに実行する"""
+        touched = set()
+        _track_writes(conn, touched)
+        try:
+            result = op.func(conn)
+        except Exception as e:
+            DB_WRITE_ERRORS.inc()
+            op.future.set_exception(e)
+            return
+        finally:
+            self._bump_versions(touched)
+        op.future.set_result(result)
+
+    def _bump_versions(self, tables):
+        self.data_version += 1
+        for table in tables:
+            self.table_versions[table] = self.data_version
+
+    def tables_version(self, tables):
+        """tables のどれかが書き換えられると変わる値（最後に書き換えられたときの data_version）"""
+        return max((self.table_versions.get(table, 0) for table in tables), default=0)
+
+    def submit(self, func, standalone=False):
+        """書き込み処理 func(conn) をキューに積み、結果の Future を返す"""
+        self._ensure_writer()
+        op = _WriteOp(func, standalone)
+        self._queue.put(op)
+        return op.future
+
+    def submit_execute(self, sql, params=()):
+        return self.submit(lambda conn: conn.execute(sql, params).rowcount)
+
+    def submit_many(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        return self.submit(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    async def run_write(self, func):
+        """書き込み処理 func(conn) を実行し、コミットされるまで待つ"""
+        return await asyncio.wrap_future(self.submit(func))
+
+    async def run_maintenance(self, func):
+        """func(conn) を書き込みスレッドでトランザクションの外で実行する（VACUUM など。他の書き込みとはまとめない）"""
+        return await asyncio.wrap_future(self.submit(func, standalone=True))
+
+    async def execute(self, sql, params=()):
+        return await asyncio.wrap_future(self.submit_execute(sql, params))
+
+    async def executemany(self, sql, seq_of_params):
+        return await asyncio.wrap_future(self.submit_many(sql, seq_of_params))
+
+    def flush(self):
+        """キューに積まれた書き込みがすべてコミットされるまで待つ"""
+        self.submit(lambda conn: None).result()
+
+    def close(self):
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        if self._read_executor is not None:
+            self._read_executor.shutdown(wait=True)
+            self._read_executor = None
+
+    # 読み込み
+    def _reader(self):
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self._readers.conn = conn
+        return conn
+
+    def query(self, sql, params=()):
+        """同期で読み込む（イベントループ外のスレッド・プロセス用）"""
+        with DB_READ_SECONDS.time(kind='fetchall'):
+            return self._reader().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with DB_READ_SECONDS.time(kind='fetchone'):
+            return self._reader().execute(sql, params).fetchone()
+
+    def _executor(self):
+        if self._read_executor is None:
+            with self._lock:
+                if self._read_executor is None:
+                    self._read_executor = ThreadPoolExecutor(self.read_workers, thread_name_prefix='db-read')
+        return self._read_executor
+
+    async def run_read(self, func, *args):
+        """読み込み処理 func(conn, *args) を読み込み用スレッドで実行"""
+        loop = asyncio.get_running_loop()
+
+        def run():
+            with DB_READ_SECONDS.time(kind='run_read'):
+                return func(self._reader(), *args)
+        return await loop.run_in_executor(self._executor(), run)
+
+    async def fetchall(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), self.query, sql, params)
+
+    async def fetchone(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), self.query_one, sql, params)
+
+
+# プロセス内で共有するデータベース
+db = Database()
+atexit.register(db.close)
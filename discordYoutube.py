@@ -1,28 +1,41 @@
+import time
+# 起動時間の計測の起点（他のモジュールより先に記録する）
+STARTED_AT = time.perf_counter()
+
 import discord
+from discord import app_commands
 import os
-import googleapiclient.discovery
-import schedule
-import time
-import ssl
-import certifi
-import aiohttp
 import asyncio
-import sqlite3
 import json
-import re
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
-import cv2
-import numpy as np
-from PIL import Image
-import requests
-import io
-from collections import Counter
 import traceback
 
-# .envファイルから環境変数を読み込む
+# .envファイルから環境変数を読み込む（各モジュールは読み込み時に設定を読むので、それらを import する前に）
 load_dotenv()
 
+from database import db, now_ts, from_epoch
+from schema import apply_migrations
+from youtube_api import AsyncYouTubeClient
+from collector import add_tracked_channel, get_tracked_channels, collect_channel_stats
+from discovery import discover_videos, utc_iso
+from scheduler import scheduler
+from job_queue import job_queue
+from comments import ingest_comments, get_comment_summary, MAX_PAGES_PER_RUN as COMMENT_PAGES_PER_RUN
+from cache import cache, SingleFlight, log_background_failure
+from thumbnail_index import find_similar_thumbnails, cluster_templates
+from cadence import get_posting_cadence
+from retention import run_retention
+from metrics import registry
+from resilience import Endpoint, RetryHint, parse_retry_after
+import analytics
+from keywords import analyze_titles, apply_keyword_updates, get_top_keywords, month_of
+from quota import (
+    record_api_call, get_quota_status, get_refresh_allowance, select_channels_for_refresh, estimate_refresh_cost
+)
+
+print(f"モジュールの読み込み: {time.perf_counter() - STARTED_AT:.2f}秒")
+
 # 非同期イベントループの作成
 try:
     loop = asyncio.get_running_loop()
@@ -30,9 +43,6 @@ except RuntimeError:
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-# SSL 証明書の設定
-ssl_context = ssl.create_default_context(cafile=certifi.where())
-
 # クライアントの作成を修正
 intents = discord.Intents.default()
 intents.message_content = True
@@ -40,184 +50,105 @@ intents.guilds = True
 intents.members = True
 intents.presences = True
 client = discord.Client(intents=intents)
+# スラッシュコマンド
+tree = app_commands.CommandTree(client)
 
 TOKEN = os.getenv('DISCORD_TOKEN')
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
 RIVAL_CHANNEL_ID = os.getenv('RIVAL_CHANNEL_ID')
+# 追加で追跡するライバルチャンネル（カンマ区切り）
+RIVAL_CHANNEL_IDS = [cid.strip() for cid in os.getenv('RIVAL_CHANNEL_IDS', '').split(',') if cid.strip()]
 LAST_VIDEO_ID = None  # 直近の動画IDを保存
+# on_ready の起動処理を始めたか（再接続で2回目の起動をしない）
+_started = False
+
+# 追跡チャンネルを少しずつ更新する間隔（分）
+REFRESH_INTERVAL_MINUTES = int(os.getenv('REFRESH_INTERVAL_MINUTES', '60'))
+# レポートの送信先と送信時刻
+REPORT_CHANNEL_ID = 1350462901541929060
+REPORT_TIMES = ['09:00', '20:00']
+# 夜間処理の時刻
+NIGHTLY_MAINTENANCE_TIME = '03:30'
+# 分析ジョブの優先度（新着動画を、夜間にまとめて登録する未分析の動画より先に処理する）
+PRIORITY_NEW_VIDEO = 10
+PRIORITY_BACKLOG = 0
+# 分析ジョブを1回に取り出す件数と、同時に処理するバッチの数
+# サムネイルは画像処理をプロセスプールで行うので、2バッチ並べてダウンロード中も CPU を空けない
+TITLE_JOB_BATCH = 500
+THUMBNAIL_JOB_BATCH = 200
+THUMBNAIL_JOB_CONCURRENCY = 2
+# コメントを取り込む動画の公開期間と、同時に取り込む動画の数
+COMMENT_WINDOW_DAYS = 7
+COMMENT_JOB_CONCURRENCY = 4
+PRIORITY_COMMENTS = 5
+# キャッシュの有効期間（秒）。期限切れでも STALE の間は古い値を返し、裏で取得し直す
+CHANNEL_NAME_TTL = 24 * 3600
+CHANNEL_NAME_STALE = 30 * 24 * 3600
+CHANNEL_STATS_TTL = REFRESH_INTERVAL_MINUTES * 60
+CHANNEL_STATS_STALE = 24 * 3600
+# レポートのスナップショット（収集のたびに作り直す）。この秒数を過ぎたらコマンドの呼び出し時に裏で更新する
+SNAPSHOT_TTL = REFRESH_INTERVAL_MINUTES * 60
+SNAPSHOT_STALE = 7 * 24 * 3600
+# /recent で表示する動画の数（Discord のメッセージは2000文字まで）
+COMMAND_RECENT_LIMIT = 10
+
+REPORT_STAGE_SECONDS = registry.histogram('report_stage_seconds', 'レポート作成の段階ごとの処理時間', ('stage',))
+COMMAND_SECONDS = registry.histogram('command_seconds', 'スラッシュコマンドの応答までの時間', ('command',))
+DISCORD_SEND_SECONDS = registry.histogram('discord_send_seconds', 'Discord へのメッセージ送信の処理時間', ('kind',))
+# Discord へのメッセージ送信のレート（回/秒）。チャンネルへの送信は上限（5回/5秒）より少し控えめにする
+DISCORD_SEND_RATE = 0.8
+DISCORD_INTERACTION_RATE = 20
+
+# YouTube Data API クライアント（セッションはプロセス内で共有、呼び出しはクォータ台帳に記録）
+youtube = AsyncYouTubeClient(YOUTUBE_API_KEY, on_request=record_api_call)
+
+def classify_discord_error(e):
+    """リトライしてよい送信の失敗なら RetryHint を返す（429 のみ）
+
+    メッセージの送信は冪等でなく、タイムアウト・通信エラー・5xx では届いている場合があるので、やり直すと
+    同じレポートが2回投稿されうる。429 は Discord が受け付けなかったことが確かなので、それだけやり直す。
+    """
+    if isinstance(e, discord.HTTPException) and e.status == 429:
+        headers = getattr(e.response, 'headers', None) or {}
+        return RetryHint(throttled=True, retry_after=parse_retry_after(headers.get('Retry-After')))
+    return None
+
+# Discord へのメッセージ送信（レート制限で断られたときだけ、間を空けてやり直す）
+discord_sends = Endpoint('discord:send', DISCORD_SEND_RATE, classify_discord_error, burst=5, concurrency=2)
+# コマンドへの返信（チャンネルの送信上限とは別に数えられる）
+discord_replies = Endpoint('discord:reply', DISCORD_INTERACTION_RATE, classify_discord_error, concurrency=10)
 
 # データベースの初期化
-def init_db():
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS channel_stats (
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            subscribers INTEGER,
-            views INTEGER,
-            videos INTEGER
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS video_stats (
-            video_id TEXT PRIMARY KEY,
-            title TEXT,
-            published_at DATETIME,
-            views INTEGER,
-            likes INTEGER,
-            comments INTEGER,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS channel_info (
-            channel_id TEXT PRIMARY KEY,
-            channel_name TEXT,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS top_videos_cache (
-            last_updated DATETIME,
-            video_data TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS top_videos_history (
-            video_id TEXT,
-            rank INTEGER,
-            views INTEGER,
-            likes INTEGER,
-            comments INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (video_id, timestamp)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS video_performance_metrics (
-            video_id TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            views INTEGER,
-            likes INTEGER,
-            comments INTEGER,
-            engagement_rate REAL,
-            views_per_hour REAL,
-            PRIMARY KEY (video_id, timestamp)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS content_analysis (
-            video_id TEXT PRIMARY KEY,
-            title_keywords TEXT,
-            video_length INTEGER,
-            upload_hour INTEGER,
-            day_of_week INTEGER,
-            category_id TEXT,
-            performance_score REAL
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS historical_trends (
-            date DATE,
-            avg_views INTEGER,
-            avg_likes INTEGER,
-            avg_comments INTEGER,
-            total_videos INTEGER,
-            growth_rate REAL,
-            PRIMARY KEY (date)
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS thumbnail_analysis (
-            video_id TEXT PRIMARY KEY,
-            analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            dominant_colors TEXT,  -- JSON形式で色情報を保存
-            text_placement TEXT,   -- テキスト配置位置
-            composition_score REAL,
-            impact_score REAL,
-            template_type TEXT,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS title_analysis (
-            video_id TEXT PRIMARY KEY,
-            analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            keywords TEXT,         -- JSON形式でキーワードリストを保存
-            keyword_scores TEXT,   -- JSON形式でキーワードごとのスコアを保存
-            pattern_type TEXT,     -- タイトルパターンの分類
-            effectiveness_score REAL,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS keyword_performance (
-            keyword TEXT,
-            month_year TEXT,
-            use_count INTEGER,
-            avg_views REAL,
-            avg_engagement REAL,
-            PRIMARY KEY (keyword, month_year)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# 統計情報の保存
-def save_stats(stats):
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    # チャンネル統計を保存
-    c.execute('''
-        INSERT INTO channel_stats (subscribers, views, videos)
-        VALUES (?, ?, ?)
-    ''', (stats['subscribers'], stats['views'], stats['videos']))
+async def init_db():
+    await db.run_write(apply_migrations)
     
-    # 動画統計を保存/更新
-    c.execute('''
-        INSERT OR REPLACE INTO video_stats 
-        (video_id, title, published_at, views, likes, comments, last_updated)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (
-        stats['latest_video_id'],
-        stats['latest_video_title'],
-        stats['latest_video_published_at'],
-        stats['latest_video_views'],
-        stats['latest_video_likes'],
-        stats['latest_video_comments']
-    ))
-    
-    conn.commit()
-    conn.close()
+    # 環境変数で指定されたチャンネルを追跡対象に登録
+    for channel_id in [RIVAL_CHANNEL_ID] + RIVAL_CHANNEL_IDS:
+        if channel_id:
+            await add_tracked_channel(channel_id)
 
 # 統計の変化を取得
-def get_stats_changes(current_stats):
+async def get_stats_changes(current_stats):
     """前回と1週間前の統計との比較を取得"""
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
+    today_start = int(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
     
-    # 前回の統計を取得
-    c.execute('''
-        SELECT subscribers, views, videos, timestamp
+    # 前回の統計を取得（(channel_id, ts) の主キーを逆順にシーク）
+    last_stats = await db.fetchone('''
+        SELECT subscribers, views, videos, ts
         FROM channel_stats 
-        WHERE timestamp < CURRENT_DATE
-        ORDER BY timestamp DESC
+        WHERE channel_id = ? AND ts < ?
+        ORDER BY ts DESC
         LIMIT 1
-    ''')
-    last_stats = c.fetchone()
+    ''', (current_stats['channel_id'], today_start))
     
     # 7日前の統計を取得
-    c.execute('''
+    week_ago_stats = await db.fetchone('''
         SELECT subscribers, views, videos
         FROM channel_stats 
-        WHERE timestamp <= datetime('now', '-7 days')
-        ORDER BY timestamp DESC
+        WHERE channel_id = ? AND ts <= ?
+        ORDER BY ts DESC
         LIMIT 1
-    ''')
-    week_ago_stats = c.fetchone()
-    
-    conn.close()
+    ''', (current_stats['channel_id'], now_ts() - 7 * 86400))
     
     if not last_stats or not week_ago_stats:
         return None
@@ -235,292 +166,235 @@ def get_stats_changes(current_stats):
         }
     }
 
-def get_channel_name():
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    # キャッシュされたチャンネル名を確認
-    c.execute('''
-        SELECT channel_name, last_updated 
-        FROM channel_info 
-        WHERE channel_id = ?
-    ''', (RIVAL_CHANNEL_ID,))
-    result = c.fetchone()
-    
-    # キャッシュが24時間以内なら、それを使用
-    if result and (datetime.now() - datetime.fromisoformat(result[1])) < timedelta(hours=24):
-        conn.close()
-        return result[0]
-    
-    # キャッシュがない、または古い場合はAPIで取得
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-    channel_request = youtube.channels().list(
+async def get_channel_name(channel_id=None):
+    channel_id = channel_id or RIVAL_CHANNEL_ID
+    # 24時間以内ならキャッシュを使い、古ければキャッシュを返しつつ裏でAPIから取得し直す
+    return await cache.get(
+        f"channel_name:{channel_id}",
+        lambda: fetch_channel_name(channel_id),
+        CHANNEL_NAME_TTL, CHANNEL_NAME_STALE
+    )
+
+async def fetch_channel_name(channel_id):
+    channel_response = await youtube.channels_list(
         part="snippet",
-        id=RIVAL_CHANNEL_ID
+        id=channel_id
     )
-    channel_response = channel_request.execute()
     channel_name = channel_response["items"][0]["snippet"]["title"]
     
     # チャンネル名を更新
-    c.execute('''
-        INSERT OR REPLACE INTO channel_info (channel_id, channel_name, last_updated)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-    ''', (RIVAL_CHANNEL_ID, channel_name))
-    conn.commit()
-    conn.close()
+    await db.execute('''
+        INSERT OR REPLACE INTO channel_info (channel_id, channel_name, updated_ts)
+        VALUES (?, ?, ?)
+    ''', (channel_id, channel_name, now_ts()))
     
     return channel_name
 
-def get_channel_stats():
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-    
-    # チャンネル統計を取得
-    channel_request = youtube.channels().list(
-        part="statistics,snippet",
-        id=RIVAL_CHANNEL_ID
+async def refresh_channels(channel_ids=None, required=None):
+    """追跡中チャンネルの統計と動画インデックスをAPIから更新
+    
+    クォータの残り予算に収まるよう、最後の同期が古いチャンネルから選んで更新する。
+    """
+    all_channel_ids = channel_ids or await get_tracked_channels()
+    channel_ids = await select_channels_for_refresh(all_channel_ids, await get_refresh_allowance(), required)
+    if not channel_ids:
+        print("⚠️ クォータ予算が残っていないため、更新をスキップして保存済みデータを使用します")
+        return {}, []
+    if len(channel_ids) < len(all_channel_ids):
+        print(f"クォータ予算に合わせて {len(channel_ids)}/{len(all_channel_ids)} チャンネルを更新します")
+    
+    # チャンネル統計（50件ずつ）と新着動画の検出（アップロード再生リスト）を並行実行
+    channel_stats, new_video_ids = await asyncio.gather(
+        collect_channel_stats(youtube, channel_ids),
+        discover_videos(youtube, channel_ids)
     )
-    channel_response = channel_request.execute()
-    stats = channel_response["items"][0]["statistics"]
-    channel_name = channel_response["items"][0]["snippet"]["title"]
+    # 新着動画のタイトル・サムネイルと、最近の動画のコメントは裏のジョブで処理する
+    await enqueue_analysis(new_video_ids, PRIORITY_NEW_VIDEO)
+    await enqueue_comment_sync(channel_ids)
+    # 更新したチャンネルのレポートを集計しておき、コマンドにすぐ答えられるようにする
+    await build_report_snapshots(list(channel_stats))
+    return channel_stats, new_video_ids
 
-    # 最新の動画のパフォーマンスを取得
-    videos_request = youtube.search().list(
-        part="snippet",
-        channelId=RIVAL_CHANNEL_ID,
-        order="date",
-        maxResults=1,
-        type="video"
-    )
-    videos_response = videos_request.execute()
-    
-    if videos_response["items"]:
-        latest_video = videos_response["items"][0]
-        latest_video_id = latest_video["id"]["videoId"]
-        latest_video_title = latest_video["snippet"]["title"]
-        latest_video_published_at = latest_video["snippet"]["publishedAt"]
-        
-        video_request = youtube.videos().list(
-            part="statistics",
-            id=latest_video_id
-        )
-        video_response = video_request.execute()
-        video_stats = video_response["items"][0]["statistics"]
+async def scheduled_refresh():
+    """定期的に追跡チャンネルを少しずつ更新（1日のクォータを分散して使う）"""
+    try:
+        channel_stats, _ = await refresh_channels()
+        # レポート対象のチャンネルを更新したら、キャッシュも新しい統計に置き換える
+        if RIVAL_CHANNEL_ID in channel_stats:
+            await cache.set(
+                f"channel_stats:{RIVAL_CHANNEL_ID}", await get_channel_stats(RIVAL_CHANNEL_ID),
+                CHANNEL_STATS_TTL, CHANNEL_STATS_STALE
+            )
+    except Exception as e:
+        print(f"❌ 定期更新でエラーが発生しました: {str(e)}")
+        traceback.print_exc()
+
+async def send_scheduled_report():
+    target_channel = client.get_channel(REPORT_CHANNEL_ID)
+    if target_channel:
+        await send_daily_report(target_channel)
     else:
-        latest_video_id = None
-        latest_video_title = None
-        latest_video_published_at = None
-        video_stats = {"viewCount": "0", "likeCount": "0", "commentCount": "0"}
-
-    stats_data = {
-        "channel_name": channel_name,
-        "subscribers": int(stats.get("subscriberCount", "0")),
-        "views": int(stats.get("viewCount", "0")),
-        "videos": int(stats.get("videoCount", "0")),
-        "latest_video_id": latest_video_id,
-        "latest_video_title": latest_video_title,
-        "latest_video_published_at": latest_video_published_at,
-        "latest_video_views": int(video_stats.get("viewCount", "0")),
-        "latest_video_likes": int(video_stats.get("likeCount", "0")),
-        "latest_video_comments": int(video_stats.get("commentCount", "0"))
-    }
-    
-    # 統計を保存
-    save_stats(stats_data)
-    
-    return stats_data
+        print('エラー: 対象のチャンネルが見つかりません')
+
+async def nightly_maintenance():
+    """夜間にまとめて行う処理（未分析の動画の登録・サムネイルのテンプレート分け・古いデータの集計と削除・統計情報の更新）"""
+    await enqueue_analysis_backlog()
+    await cluster_templates()
+    await cache.prune()
+    await run_retention()
+    await db.execute('PRAGMA optimize')
+
+async def get_fresh_channel_stats(channel_id=None):
+    """チャンネル統計をキャッシュから取得
 
-def get_top_videos():
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
+    更新間隔より古ければキャッシュを返しつつ裏でAPIから更新するので、レポートはAPIを待たない。
+    キャッシュがないか1日以上古いときだけ、更新を待ってから返す。
+    """
+    channel_id = channel_id or RIVAL_CHANNEL_ID
     
-    # 最後の更新時刻を確認
-    c.execute('SELECT last_updated, video_data FROM top_videos_cache')
-    cache_data = c.fetchone()
+    async def load():
+        await refresh_channels(required=[channel_id])
+        return await get_channel_stats(channel_id)
     
-    # キャッシュが1週間以内なら、それを使用
-    if cache_data and (datetime.now() - datetime.fromisoformat(cache_data[0])) < timedelta(days=7):
-        import json
-        videos = json.loads(cache_data[1])
-        
-        # published_atを文字列からdatetimeに変換
-        for video in videos:
-            video["published_at"] = datetime.fromisoformat(video["published_at"])
-        
-        # 前回のランキングデータを取得（1週間前）
-        c.execute('''
-            SELECT video_id, rank, views, likes, comments
-            FROM top_videos_history
-            WHERE timestamp <= datetime('now', '-7 days')
-            ORDER BY timestamp DESC
-            LIMIT 3
-        ''')
-        last_week_data = {row[0]: {"rank": row[1], "views": row[2], "likes": row[3], "comments": row[4]} 
-                         for row in c.fetchall()}
-        
-        # 投稿日時を取得
-        video_ids = [v["video_id"] for v in videos]
-        placeholders = ','.join('?' * len(video_ids))
-        c.execute(f'''
-            SELECT video_id, published_at
-            FROM video_stats
-            WHERE video_id IN ({placeholders})
-        ''', video_ids)
-        publish_dates = {row[0]: datetime.fromisoformat(row[1]) for row in c.fetchall()}
-        
-        # 各動画の情報を更新
-        for i, video in enumerate(videos, 1):
-            video_id = video["video_id"]
-            last_week = last_week_data.get(video_id, {"rank": None, "views": 0, "likes": 0, "comments": 0})
-            
-            # ランキング変動を計算
-            if last_week["rank"] is None:
-                rank_change = "🆕"  # 新規ランクイン
-            else:
-                rank_diff = last_week["rank"] - i
-                if rank_diff > 0:
-                    rank_change = f"⬆️ +{rank_diff}"
-                elif rank_diff < 0:
-                    rank_change = f"⬇️ {rank_diff}"
-                else:
-                    rank_change = "➡️"
-            
-            # 統計の増加を計算
-            views_increase = video["views"] - last_week["views"]
-            likes_increase = video["likes"] - last_week["likes"]
-            comments_increase = video["comments"] - last_week["comments"]
-            
-            # 投稿日時を追加
-            video["published_at"] = publish_dates.get(video_id, datetime.now())
-            video["rank_change"] = rank_change
-            video["views_increase"] = views_increase
-            video["likes_increase"] = likes_increase
-            video["comments_increase"] = comments_increase
-        
-        conn.close()
-        return videos
+    return await cache.get(f"channel_stats:{channel_id}", load, CHANNEL_STATS_TTL, CHANNEL_STATS_STALE)
+
+async def get_channel_stats(channel_id=None):
+    """保存済みの最新のチャンネル統計と最新動画を取得"""
+    channel_id = channel_id or RIVAL_CHANNEL_ID
     
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
+    stats = await db.fetchone('''
+        SELECT cs.subscribers, cs.views, cs.videos, ci.channel_name
+        FROM channel_stats cs
+        LEFT JOIN channel_info ci ON ci.channel_id = cs.channel_id
+        WHERE cs.channel_id = ?
+        ORDER BY cs.ts DESC
+        LIMIT 1
+    ''', (channel_id,))
     
-    # 1ヶ月前の時刻を計算
-    one_month_ago = (datetime.now() - timedelta(days=30)).isoformat() + 'Z'
+    # 動画インデックスから最新の動画を取得
+    latest_video = await db.fetchone('''
+        SELECT video_id, title, published_ts, views, likes, comments
+        FROM video_stats
+        WHERE channel_id = ?
+        ORDER BY published_ts DESC
+        LIMIT 1
+    ''', (channel_id,))
+    latest_video = latest_video or (None, None, None, 0, 0, 0)
     
-    # チャンネルの動画を取得（過去1ヶ月のみ）
-    videos = []
-    next_page_token = None
+    if not stats:
+        return None
     
-    while True:
-        # 動画一覧を取得
-        request = youtube.search().list(
-            part="snippet",
-            channelId=RIVAL_CHANNEL_ID,
-            maxResults=50,
-            type="video",
-            order="viewCount",
-            publishedAfter=one_month_ago,
-            pageToken=next_page_token
+    return {
+        "channel_id": channel_id,
+        "channel_name": stats[3],
+        "subscribers": stats[0],
+        "views": stats[1],
+        "videos": stats[2],
+        "latest_video_id": latest_video[0],
+        "latest_video_title": latest_video[1],
+        "latest_video_published_at": utc_iso(from_epoch(latest_video[2])) if latest_video[2] else None,
+        "latest_video_views": latest_video[3],
+        "latest_video_likes": latest_video[4],
+        "latest_video_comments": latest_video[5]
+    }
+
+async def get_top_videos(channel_id=None):
+    """レポート用の過去1ヶ月の再生数トップ3（古いスナップショットは使わずその場で集計し、ランキング履歴に保存）"""
+    channel_id = channel_id or RIVAL_CHANNEL_ID
+    return await rank_top_videos(channel_id, record=True)
+
+async def rank_top_videos(channel_id, record=False):
+    """動画インデックスから過去1ヶ月の再生数トップ3を集計
+
+    record=True のとき（レポート）だけランキング履歴に保存する。スナップショットの作成のたびに保存すると、
+    1週間前との比較に使う履歴が収集の回数だけ増えてしまう。
+    """
+    # 過去1ヶ月以内に公開された動画を再生回数の多い順に取得
+    one_month_ago = now_ts() - 30 * 86400
+    rows = await db.fetchall('''
+        SELECT video_id, title, published_ts, views, likes, comments
+        FROM video_stats
+        WHERE channel_id = ? AND published_ts >= ?
+        ORDER BY views DESC
+        LIMIT 3
+    ''', (channel_id, one_month_ago))
+    videos = [{
+        "video_id": row[0],
+        "title": row[1],
+        "published_at": from_epoch(row[2]),
+        "views": row[3],
+        "likes": row[4],
+        "comments": row[5]
+    } for row in rows]
+    
+    # 前回のランキングデータを取得（1週間前）
+    rows = await db.fetchall('''
+        SELECT video_id, rank, views, likes, comments
+        FROM top_videos_history
+        WHERE channel_id = ? AND ts = (
+            SELECT MAX(ts) FROM top_videos_history WHERE channel_id = ? AND ts <= ?
         )
-        response = request.execute()
-        
-        video_ids = [item["id"]["videoId"] for item in response["items"]]
+        ORDER BY rank
+    ''', (channel_id, channel_id, now_ts() - 7 * 86400))
+    last_week_data = {row[0]: {"rank": row[1], "views": row[2], "likes": row[3], "comments": row[4]} 
+                     for row in rows}
+    
+    # 各動画の情報を更新
+    for i, video in enumerate(videos, 1):
+        video_id = video["video_id"]
+        last_week = last_week_data.get(video_id, {"rank": None, "views": 0, "likes": 0, "comments": 0})
         
-        # 動画の詳細情報を取得
-        if video_ids:
-            video_request = youtube.videos().list(
-                part="statistics,snippet",
-                id=",".join(video_ids)
-            )
-            video_response = video_request.execute()
-            
-            for video in video_response["items"]:
-                published_at = video["snippet"]["publishedAt"]
-                videos.append({
-                    "title": video["snippet"]["title"],
-                    "views": int(video["statistics"].get("viewCount", 0)),
-                    "likes": int(video["statistics"].get("likeCount", 0)),
-                    "comments": int(video["statistics"].get("commentCount", 0)),
-                    "video_id": video["id"],
-                    "published_at": datetime.fromisoformat(published_at.replace('Z', '+00:00')),
-                    "rank_change": "🆕",  # 新規取得時は全て新規
-                    "views_increase": 0,   # 新規取得時は増加分を0に
-                    "likes_increase": 0,   # 新規取得時は増加分を0に
-                    "comments_increase": 0  # 新規取得時は増加分を0に
-                })
+        # ランキング変動を計算
+        if last_week["rank"] is None:
+            rank_change = "🆕"  # 新規ランクイン
+        else:
+            rank_diff = last_week["rank"] - i
+            if rank_diff > 0:
+                rank_change = f"⬆️ +{rank_diff}"
+            elif rank_diff < 0:
+                rank_change = f"⬇️ {rank_diff}"
+            else:
+                rank_change = "➡️"
         
-        next_page_token = response.get("nextPageToken")
-        if not next_page_token or len(videos) >= 100:  # 最大100動画まで取得
-            break
-    
-    # 再生回数で降順ソート
-    videos.sort(key=lambda x: x["views"], reverse=True)
-    top_3_videos = videos[:3]
+        video["rank_change"] = rank_change
+        video["views_increase"] = video["views"] - last_week["views"]
+        video["likes_increase"] = video["likes"] - last_week["likes"]
+        video["comments_increase"] = video["comments"] - last_week["comments"]
     
+    if not record:
+        return videos
+
     # ランキング履歴を保存
-    for i, video in enumerate(top_3_videos, 1):
-        c.execute('''
-            INSERT INTO top_videos_history (video_id, rank, views, likes, comments)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (video["video_id"], i, video["views"], video["likes"], video["comments"]))
-    
-    # キャッシュを更新する前に、datetime オブジェクトを文字列に変換
-    cache_videos = []
-    for video in top_3_videos:
-        video_copy = video.copy()
-        video_copy["published_at"] = video_copy["published_at"].isoformat()
-        cache_videos.append(video_copy)
-    
-    # キャッシュを更新
-    import json
-    c.execute('DELETE FROM top_videos_cache')  # 古いキャッシュを削除
-    c.execute('''
-        INSERT INTO top_videos_cache (last_updated, video_data)
-        VALUES (CURRENT_TIMESTAMP, ?)
-    ''', (json.dumps(cache_videos),))
-    conn.commit()
-    conn.close()
-    
-    return top_3_videos
+    ts = now_ts()
+    await db.executemany('''
+        INSERT OR IGNORE INTO top_videos_history (channel_id, ts, rank, video_id, views, likes, comments)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(channel_id, ts, i, video["video_id"], video["views"], video["likes"], video["comments"])
+          for i, video in enumerate(videos, 1)])
+    
+    return videos
 
-def get_recent_videos():
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
+async def get_recent_videos(channel_id=None):
+    """動画インデックスから過去24時間の新着動画を取得"""
+    channel_id = channel_id or RIVAL_CHANNEL_ID
     
     # 24時間前の時刻を計算
-    one_day_ago = (datetime.now() - timedelta(days=1)).isoformat() + 'Z'
-    
-    # 最新の動画を取得
-    request = youtube.search().list(
-        part="snippet",
-        channelId=RIVAL_CHANNEL_ID,
-        order="date",
-        maxResults=10,  # 十分な数を指定
-        type="video",
-        publishedAfter=one_day_ago
-    )
-    response = request.execute()
-    
-    recent_videos = []
-    if response["items"]:
-        video_ids = [item["id"]["videoId"] for item in response["items"]]
-        
-        # 動画の詳細情報を一括取得
-        video_request = youtube.videos().list(
-            part="statistics",
-            id=",".join(video_ids)
-        )
-        video_response = video_request.execute()
-        
-        # 動画情報とstatisticsを結合
-        for search_item, video_item in zip(response["items"], video_response["items"]):
-            published_at = search_item["snippet"]["publishedAt"]
-            published_datetime = datetime.fromisoformat(published_at.replace('Z', '+00:00'))
-            
-            recent_videos.append({
-                "title": search_item["snippet"]["title"],
-                "published_at": published_datetime,
-                "views": int(video_item["statistics"].get("viewCount", 0)),
-                "likes": int(video_item["statistics"].get("likeCount", 0)),
-                "comments": int(video_item["statistics"].get("commentCount", 0)),
-                "video_id": video_item["id"]
-            })
+    one_day_ago = now_ts() - 86400
+    rows = await db.fetchall('''
+        SELECT video_id, title, published_ts, views, likes, comments
+        FROM video_stats
+        WHERE channel_id = ? AND published_ts >= ?
+        ORDER BY published_ts DESC
+    ''', (channel_id, one_day_ago))
+    
+    recent_videos = [{
+        "title": row[1],
+        "published_at": from_epoch(row[2]),
+        "views": row[3],
+        "likes": row[4],
+        "comments": row[5],
+        "video_id": row[0]
+    } for row in rows]
     
     return recent_videos
 
@@ -546,205 +420,68 @@ def analyze_video_performance(video_data):
         "engagement_rate": engagement_rate
     }
 
-def calculate_posting_pace():
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-    
-    # 最新の10件の動画を取得
-    request = youtube.search().list(
-        part="snippet",
-        channelId=RIVAL_CHANNEL_ID,
-        order="date",
-        maxResults=10,
-        type="video"
-    )
-    response = request.execute()
-    
-    if len(response["items"]) < 2:
+def format_interval(seconds):
+    hours = seconds / 3600
+    if hours < 24:
+        return f"{round(hours, 1)}時間"
+    return f"{round(hours / 24, 1)}日"
+
+async def calculate_posting_pace(channel_id=None):
+    """投稿ペース（動画を見つけるたびに更新しているモデルを読むだけで、API も動画の一覧も使わない）"""
+    channel_id = channel_id or RIVAL_CHANNEL_ID
+    cadence = await get_posting_cadence(channel_id)
+    if not cadence or cadence['mean_interval'] is None:
         return "不明"  # データが不十分な場合
     
-    # 投稿日時のリストを作成
-    dates = []
-    for item in response["items"]:
-        published_at = datetime.fromisoformat(item["snippet"]["publishedAt"].replace('Z', '+00:00'))
-        dates.append(published_at)
-    
-    # 投稿間隔を計算
-    intervals = []
-    for i in range(len(dates) - 1):
-        interval = dates[i] - dates[i + 1]
-        intervals.append(interval.total_seconds() / 3600)  # 時間単位に変換
-    
-    # 平均投稿間隔を計算
-    avg_interval = sum(intervals) / len(intervals)
-    
-    # 投稿ペースを分かりやすい表現に変換
-    if avg_interval < 24:
-        return f"{round(avg_interval, 1)}時間に1回"
-    else:
-        days = avg_interval / 24
-        return f"{round(days, 1)}日に1回"
+    # 直近の投稿間隔の平均と中央値、次の投稿の予想時刻（Discord が見る人の言語で「3時間後」「2日前」のように表示する）
+    return (
+        f"{format_interval(cadence['mean_interval'])}に1回"
+        f"（中央値 {format_interval(cadence['median_interval'])}・次回予想 <t:{cadence['next_expected_ts']}:R>）"
+    )
 
 def analyze_title(title, views=0):
-    # 基本的な単語分割
-    words = re.findall(r'\w+', title.lower())
-    word_count = Counter(words)
-    
-    # パターンの検出
-    patterns = []
-    if re.search(r'#\d+', title):
-        patterns.append('numbered_series')
-    if re.search(r'【.*】', title):
-        patterns.append('bracketed')
-    if re.search(r'\d+分|分間', title):
-        patterns.append('duration_mentioned')
-    
-    # 効果的なキーワードの抽出
-    keywords = [word for word, count in word_count.most_common(5)]
-    
-    return {
-        'keywords': keywords,
-        'pattern_type': ','.join(patterns) if patterns else 'standard',
-        'effectiveness_score': min(100, len(title) * 2),  # 仮のスコアリング
-        'keyword_scores': {word: 1.0 for word in keywords}  # 将来の分析のために
-    }
-
-def analyze_thumbnail_image(image_url):
-    try:
-        # 画像をダウンロード
-        response = requests.get(image_url)
-        image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            return None
-        
-        # 画像サイズを取得
-        height, width = image.shape[:2]
-        
-        # 色分析
-        pixels = image.reshape(-1, 3)
-        pixels = np.float32(pixels)
-        n_colors = 3
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, .1)
-        _, labels, palette = cv2.kmeans(pixels, n_colors, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-        
-        # 各色の割合を計算
-        _, counts = np.unique(labels, return_counts=True)
-        percentages = counts / counts.sum() * 100
-        
-        # 色情報をRGB形式で保存
-        colors = []
-        for color, percentage in zip(palette, percentages):
-            b, g, r = color
-            colors.append({
-                'rgb': f'#{int(r):02x}{int(g):02x}{int(b):02x}',
-                'percentage': round(percentage, 1)
-            })
-        
-        # テキスト領域の検出
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # テキスト配置の分析
-        text_regions = []
-        for contour in contours:
-            x, y, w, h = cv2.boundingRect(contour)
-            if w * h > (width * height * 0.01):  # 小さすぎる領域を除外
-                region = {
-                    'x': x / width,
-                    'y': y / height,
-                    'width': w / width,
-                    'height': h / height
-                }
-                text_regions.append(region)
-        
-        # テキスト配置の分類
-        text_placement = 'center'  # デフォルト
-        if text_regions:
-            avg_x = np.mean([r['x'] for r in text_regions])
-            avg_y = np.mean([r['y'] for r in text_regions])
-            
-            if avg_x < 0.33:
-                text_placement = 'left'
-            elif avg_x > 0.66:
-                text_placement = 'right'
-            
-            if avg_y < 0.33:
-                text_placement = f'top_{text_placement}'
-            elif avg_y > 0.66:
-                text_placement = f'bottom_{text_placement}'
-        
-        # インパクトスコアの計算
-        impact_score = min(100, (
-            len(text_regions) * 20 +  # テキスト領域の数
-            len(colors) * 15 +        # 使用色数
-            (max(percentages) - min(percentages)) * 0.5  # 色の対比
-        ))
-        
-        return {
-            'dominant_colors': colors,
-            'text_placement': text_placement,
-            'composition_score': round(min(100, len(text_regions) * 25), 1),
-            'impact_score': round(impact_score, 1),
-            'template_type': 'standard'  # 今後のパターン分析のために
-        }
-        
-    except Exception as e:
-        print(f"サムネイル分析エラー: {str(e)}")
-        return None
+    # キーワード（日本語は文字種の境界で分割）とパターンの検出
+    return analyze_titles([title])[0]
 
-def get_title_analysis_report(video_id, title, views):
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
+async def get_title_analysis_report(video_id, title, views):
     # 分析実行
     analysis = analyze_title(title, views)
+    current_month = month_of(None)
     
-    # 分析結果を保存
-    import json
-    c.execute('''
-        INSERT OR REPLACE INTO title_analysis 
-        (video_id, keywords, keyword_scores, pattern_type, effectiveness_score)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        video_id,
-        json.dumps(analysis['keywords']),
-        json.dumps(analysis['keyword_scores']),
-        analysis['pattern_type'],
-        analysis['effectiveness_score']
-    ))
-    
-    # キーワードのパフォーマンスを更新
-    current_month = datetime.now().strftime('%Y-%m')
-    for keyword in analysis['keywords']:
+    def save_analysis(c):
+        # 分析結果を保存
         c.execute('''
-            INSERT OR REPLACE INTO keyword_performance 
-            (keyword, month_year, use_count, avg_views, avg_engagement)
-            VALUES (
-                ?,
-                ?,
-                COALESCE((SELECT use_count FROM keyword_performance 
-                          WHERE keyword = ? AND month_year = ?) + 1, 1),
-                ?,
-                COALESCE((SELECT avg_engagement FROM keyword_performance 
-                          WHERE keyword = ? AND month_year = ?), 0)
-            )
-        ''', (keyword, current_month, keyword, current_month, views, keyword, current_month))
-    
-    conn.commit()
-    
-    # トレンドキーワードを取得
-    c.execute('''
-        SELECT keyword, use_count, avg_views
-        FROM keyword_performance
-        WHERE month_year = ?
-        ORDER BY use_count DESC, avg_views DESC
-        LIMIT 3
-    ''', (current_month,))
-    trending_keywords = c.fetchall()
-    
-    conn.close()
+            INSERT OR REPLACE INTO title_analysis 
+            (video_id, keywords, keyword_scores, pattern_type, effectiveness_score)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (
+            video_id,
+            json.dumps(analysis['keywords']),
+            json.dumps(analysis['keyword_scores']),
+            analysis['pattern_type'],
+            analysis['effectiveness_score']
+        ))
+        
+        # キーワードのパフォーマンスを更新（登録済みの動画は差分だけ反映）
+        row = c.execute('''
+            SELECT likes, comments, published_ts FROM video_stats WHERE video_id = ?
+        ''', (video_id,)).fetchone() or (0, 0, None)
+        apply_keyword_updates(c, [{
+            "video_id": video_id,
+            "keywords": analysis['keywords'],
+            "views": views,
+            "likes": row[0],
+            "comments": row[1],
+            "published_ts": row[2]
+        }])
+    
+    await db.run_write(save_analysis)
+    
+    # 今月、再生数を集めているキーワードを取得
+    trending_keywords = [
+        (k["keyword"], k["use_count"], k["avg_views"])
+        for k in await get_top_keywords(current_month, limit=3)
+    ]
     
     return {
         'pattern_type': analysis['pattern_type'],
@@ -753,274 +490,249 @@ def get_title_analysis_report(video_id, title, views):
         'trending_keywords': trending_keywords
     }
 
-def get_thumbnail_analysis_report(video_id, thumbnail_url):
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    # サムネイル分析を実行
-    analysis = analyze_thumbnail_image(thumbnail_url)
-    if not analysis:
-        conn.close()
+async def get_thumbnail_analysis_report(video_id, thumbnail_url):
+    # サムネイル分析を実行（同じ画像が分析済みなら結果を流用して保存）
+    from thumbnails import analyze_thumbnail_batch
+    summary = await analyze_thumbnail_batch([(video_id, thumbnail_url)])
+    if summary['failed']:
         return None
     
-    # 分析結果を保存
-    import json
-    c.execute('''
-        INSERT OR REPLACE INTO thumbnail_analysis 
-        (video_id, dominant_colors, text_placement, composition_score, 
-         impact_score, template_type)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        video_id,
-        json.dumps(analysis['dominant_colors']),
-        analysis['text_placement'],
-        analysis['composition_score'],
-        analysis['impact_score'],
-        analysis['template_type']
-    ))
-    
-    conn.commit()
-    conn.close()
+    row = await db.fetchone('''
+        SELECT dominant_colors, text_placement, composition_score, impact_score, template_type
+        FROM thumbnail_analysis
+        WHERE video_id = ?
+    ''', (video_id,))
+    if not row:
+        return None
     
-    return analysis
+    return {
+        'dominant_colors': json.loads(row[0]),
+        'text_placement': row[1],
+        'composition_score': row[2],
+        'impact_score': row[3],
+        'template_type': row[4]
+    }
 
-def get_cached_stats(max_age_hours=1):
-    """キャッシュされた統計情報を取得"""
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    # チャンネル統計の取得
-    c.execute('''
-        SELECT subscribers, views, videos, timestamp, channel_name
-        FROM channel_stats cs
-        JOIN channel_info ci ON ci.channel_id = ?
-        WHERE cs.timestamp >= datetime('now', ? || ' hours')
-        ORDER BY cs.timestamp DESC
-        LIMIT 1
-    ''', (RIVAL_CHANNEL_ID, -max_age_hours))
-    
-    result = c.fetchone()
+async def enqueue_analysis(video_ids, priority):
+    """動画のタイトル分析・サムネイル分析をジョブキューに登録（分析済みの動画は登録し直しても実行しない）"""
+    if not video_ids:
+        return
+    await job_queue.enqueue('title', video_ids, priority)
+    await job_queue.enqueue('thumbnail', video_ids, priority)
+
+async def enqueue_analysis_backlog():
+    """追跡チャンネルの動画のうち、タイトルかサムネイルが未分析のものを登録（知覚ハッシュのないサムネイルも含む）"""
+    channel_ids = await get_tracked_channels()
+    if not channel_ids:
+        return
+    placeholders = ','.join('?' * len(channel_ids))
+    for kind, table, column in (('title', 'content_analysis', 'video_id'), ('thumbnail', 'thumbnail_analysis', 'phash')):
+        rows = await db.fetchall(f'''
+            SELECT vs.video_id
+            FROM video_stats vs
+            LEFT JOIN {table} a ON a.video_id = vs.video_id
+            WHERE a.{column} IS NULL AND vs.channel_id IN ({placeholders})
+            ORDER BY vs.published_ts DESC
+        ''', channel_ids)
+        count = await job_queue.enqueue(kind, [row[0] for row in rows], PRIORITY_BACKLOG)
+        if count:
+            print(f"未分析の動画を登録しました: {kind} {count}件")
+
+def _in_clause(values):
+    return ','.join('?' * len(values))
+
+async def run_title_jobs(jobs):
+    """タイトル分析ジョブ: title_analysis と content_analysis を保存（形態素解析はスレッドで実行）"""
+    video_ids = [job['key'] for job in jobs]
+    rows = await db.fetchall(f'''
+        SELECT video_id, channel_id, title, published_ts, views
+        FROM video_stats
+        WHERE video_id IN ({_in_clause(video_ids)})
+    ''', video_ids)
+    if not rows:
+        return None
+    analyses = await asyncio.to_thread(analyze_titles, [row[2] or '' for row in rows])
     
-    if result:
-        stats = {
-            "subscribers": result[0],
-            "views": result[1],
-            "videos": result[2],
-            "channel_name": result[4],
-            "is_cached": True,
-            "cache_age": result[3]
-        }
-        
-        # 最新の動画情報も取得
-        c.execute('''
-            SELECT video_id, title, published_at, views, likes, comments
-            FROM video_stats
-            WHERE published_at >= datetime('now', '-1 day')
-            ORDER BY published_at DESC
-            LIMIT 1
-        ''')
-        latest_video = c.fetchone()
+    def save(c):
+        c.executemany('''
+            INSERT OR REPLACE INTO title_analysis
+            (video_id, keywords, keyword_scores, pattern_type, effectiveness_score)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(
+            row[0],
+            json.dumps(analysis['keywords']),
+            json.dumps(analysis['keyword_scores']),
+            analysis['pattern_type'],
+            analysis['effectiveness_score']
+        ) for row, analysis in zip(rows, analyses)])
         
-        if latest_video:
-            stats.update({
-                "latest_video_id": latest_video[0],
-                "latest_video_title": latest_video[1],
-                "latest_video_published_at": latest_video[2],
-                "latest_video_views": latest_video[3],
-                "latest_video_likes": latest_video[4],
-                "latest_video_comments": latest_video[5]
-            })
+        # パフォーマンスはチャンネルの平均再生数に対する比（分析した時点の値）
+        channel_ids = list({row[1] for row in rows if row[1]})
+        averages = dict(c.execute(f'''
+            SELECT channel_id, AVG(views) FROM video_stats
+            WHERE channel_id IN ({_in_clause(channel_ids)})
+            GROUP BY channel_id
+        ''', channel_ids).fetchall()) if channel_ids else {}
         
-        conn.close()
-        return stats
+        content = []
+        for row, analysis in zip(rows, analyses):
+            published = datetime.fromtimestamp(row[3]) if row[3] else None
+            average = averages.get(row[1])
+            content.append((
+                row[0],
+                json.dumps(analysis['keywords'], ensure_ascii=False),
+                published.hour if published else None,
+                published.weekday() if published else None,
+                round((row[4] or 0) / average, 3) if average else None
+            ))
+        c.executemany('''
+            INSERT OR REPLACE INTO content_analysis
+            (video_id, title_keywords, upload_hour, day_of_week, performance_score)
+            VALUES (?, ?, ?, ?, ?)
+        ''', content)
     
-    conn.close()
+    await db.run_write(save)
     return None
 
-def get_cached_videos(cache_type="top", max_age_hours=12):
-    """キャッシュされた動画情報を取得"""
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    if cache_type == "top":
-        c.execute('''
-            SELECT last_updated, video_data 
-            FROM top_videos_cache
-            WHERE last_updated >= datetime('now', ? || ' hours')
-        ''', (-max_age_hours,))
-    else:  # recent
-        c.execute('''
-            SELECT video_id, title, published_at, views, likes, comments
-            FROM video_stats
-            WHERE published_at >= datetime('now', '-1 day')
-            AND last_updated >= datetime('now', ? || ' hours')
-            ORDER BY published_at DESC
-        ''', (-max_age_hours,))
-    
-    result = c.fetchall()
-    conn.close()
-    
-    if result:
-        if cache_type == "top":
-            import json
-            videos = json.loads(result[0][1])
-            for video in videos:
-                video["published_at"] = datetime.fromisoformat(video["published_at"])
-            return videos
-        else:
-            return [{
-                "video_id": r[0],
-                "title": r[1],
-                "published_at": datetime.fromisoformat(r[2]),
-                "views": r[3],
-                "likes": r[4],
-                "comments": r[5]
-            } for r in result]
-    
-    return None
+async def run_thumbnail_jobs(jobs):
+    """サムネイル分析ジョブ: まとめてダウンロードし、画像処理はプロセスプールで実行"""
+    from thumbnails import analyze_thumbnail_batch, thumbnail_url
+    video_ids = [job['key'] for job in jobs]
+    await analyze_thumbnail_batch([(video_id, thumbnail_url(video_id)) for video_id in video_ids])
+    rows = await db.fetchall(f'''
+        SELECT video_id FROM thumbnail_analysis WHERE video_id IN ({_in_clause(video_ids)}) AND phash IS NOT NULL
+    ''', video_ids)
+    analyzed = {row[0] for row in rows}
+    return {video_id: 'サムネイルを取得・分析できませんでした' for video_id in video_ids if video_id not in analyzed}
+
+async def enqueue_comment_sync(channel_ids):
+    """最近の動画のうち、コメントの取り込みが途中か、前回最後まで読んだときよりコメント数が増えたものを登録
+
+    取り込んだ件数（threads + replies）とは比べない。削除・スパム判定されたコメントや、commentThreads.list が
+    返さない返信があると公開のコメント数に届かず、毎回登録し直してしまうため。
+    """
+    if not channel_ids:
+        return
+    since = now_ts() - COMMENT_WINDOW_DAYS * 24 * 3600
+    rows = await db.fetchall(f'''
+        SELECT vs.video_id
+        FROM video_stats vs
+        LEFT JOIN comment_sync_state cs ON cs.video_id = vs.video_id
+        WHERE vs.channel_id IN ({_in_clause(channel_ids)})
+          AND vs.published_ts >= ?
+          AND COALESCE(cs.disabled, 0) = 0
+          AND (cs.video_id IS NULL OR cs.page_token IS NOT NULL OR vs.comments > COALESCE(cs.synced_comments, -1))
+        ORDER BY vs.published_ts DESC
+    ''', list(channel_ids) + [since])
+    # 処理済みのジョブもやり直す（続きや新しいコメントを読む）
+    await job_queue.enqueue('comments', [row[0] for row in rows], PRIORITY_COMMENTS, force=True)
 
-def calculate_engagement_metrics():
+async def run_comment_jobs(jobs):
+    """コメント取り込みジョブ: 1動画ずつ、残りのクォータの範囲でページを読む
+
+    次のチャンネル更新で全チャンネルを読む分（estimate_refresh_cost）は残しておき、更新を優先する。
+    """
+    failures = {}
+    reserve = estimate_refresh_cost(len(await get_tracked_channels()))
+    for job in jobs:
+        allowance = await get_refresh_allowance() - reserve
+        if allowance <= 0:
+            failures[job['key']] = 'クォータ予算が残っていません（チャンネルの更新分を残しています）'
+            continue
+        await ingest_comments(youtube, job['key'], min(COMMENT_PAGES_PER_RUN, allowance))
+    return failures
+
+job_queue.register('title', run_title_jobs, batch_size=TITLE_JOB_BATCH)
+job_queue.register(
+    'thumbnail', run_thumbnail_jobs, concurrency=THUMBNAIL_JOB_CONCURRENCY, batch_size=THUMBNAIL_JOB_BATCH
+)
+job_queue.register('comments', run_comment_jobs, concurrency=COMMENT_JOB_CONCURRENCY)
+
+async def calculate_engagement_metrics():
     """保存済みデータを使用したエンゲージメント分析"""
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    # 過去30日間の動画のエンゲージメント率を計算
-    thirty_days_ago = (datetime.now() - timedelta(days=30)).isoformat()
-    c.execute('''
-        SELECT 
-            title,
-            views,
-            likes,
-            comments,
-            published_at,
-            video_id
-        FROM video_stats
-        WHERE published_at >= ?
-        ORDER BY views DESC
-    ''', (thirty_days_ago,))
-    
-    videos = c.fetchall()
-    engagement_data = []
-    
-    for video in videos:
-        title, views, likes, comments, published_at, video_id = video
-        if views > 0:
-            engagement_rate = ((likes + comments) / views) * 100
-            engagement_data.append({
-                "title": title,
-                "engagement_rate": round(engagement_rate, 2),
-                "views": views,
-                "published_at": published_at,
-                "video_id": video_id
-            })
-    
-    conn.close()
-    return engagement_data
+    # 過去30日間の動画のエンゲージメント率を計算（まとめて配列で計算し、データが変わるまで再利用）
+    metrics = await analytics.engagement_metrics((), 30)
+    return [
+        {**video, "published_at": from_epoch(video["published_ts"])}
+        for video in metrics["videos"]
+    ]
 
-def analyze_posting_pattern():
+async def analyze_posting_pattern():
     """投稿パターンの分析"""
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    c.execute('''
-        SELECT 
-            strftime('%H', published_at) as hour,
-            strftime('%w', published_at) as day_of_week,
-            AVG(views) as avg_views,
-            COUNT(*) as post_count
-        FROM video_stats
-        GROUP BY hour, day_of_week
-        ORDER BY avg_views DESC
-    ''')
-    
-    patterns = c.fetchall()
-    conn.close()
-    
-    days = ['日', '月', '火', '水', '木', '金', '土']
-    best_patterns = []
-    
-    for hour, day_of_week, avg_views, post_count in patterns[:5]:
-        best_patterns.append({
-            "day": days[int(day_of_week)],
-            "hour": int(hour),
-            "avg_views": int(avg_views),
-            "post_count": post_count
-        })
-    
-    return best_patterns
+    return await analytics.best_posting_slots()
 
-def analyze_weekly_trend():
+async def analyze_weekly_trend(channel_id=None):
     """過去7日間のトレンド分析"""
-    conn = sqlite3.connect('youtube_stats.db')
-    c = conn.cursor()
-    
-    # 過去7日間の日次データを取得
-    c.execute('''
-        SELECT 
-            date(cs.timestamp) as date,
-            AVG(cs.subscribers) as avg_subscribers,
-            AVG(cs.views) as avg_views,
-            COUNT(DISTINCT vs.video_id) as new_videos
-        FROM channel_stats cs
-        LEFT JOIN video_stats vs ON date(vs.published_at) = date(cs.timestamp)
-        WHERE cs.timestamp >= datetime('now', '-7 days')
-        GROUP BY date(cs.timestamp)
-        ORDER BY date
-    ''')
-    daily_stats = c.fetchall()
-    
-    conn.close()
-    
-    if not daily_stats or len(daily_stats) < 2:  # 最低2日分のデータが必要
-        return None
-    
-    # 成長率の計算
-    first_day = daily_stats[0]
-    last_day = daily_stats[-1]
-    
-    try:
-        growth_rate = {
-            'subscribers': ((last_day[1] - first_day[1]) / first_day[1] * 100) if first_day[1] > 0 else 0,
-            'views': ((last_day[2] - first_day[2]) / first_day[2] * 100) if first_day[2] > 0 else 0,
-            'videos_per_day': sum(day[3] for day in daily_stats) / len(daily_stats)
-        }
-    except (TypeError, ZeroDivisionError):
+    channel_id = channel_id or RIVAL_CHANNEL_ID
+    return await analytics.weekly_trend(channel_id, 7)
+
+async def load_stats_snapshot(channel_id):
+    """チャンネル統計と、前日・1週間前との比較、投稿ペース"""
+    stats = await get_channel_stats(channel_id)
+    if not stats:
         return None
-    
-    return growth_rate
+    changes, posting_pace = await asyncio.gather(
+        get_stats_changes(stats),
+        calculate_posting_pace(channel_id)
+    )
+    return {'stats': stats, 'changes': changes, 'posting_pace': posting_pace}
 
-async def send_daily_report(channel):
-    try:
-        print("\n=== レポート生成開始 ===")
-        
-        # チャンネル統計を取得
-        channel_stats = get_channel_stats()
-        print("チャンネル統計を取得しました")
-        
-        # 統計の変化を取得
-        stats_changes = get_stats_changes(channel_stats)
-        print("統計の変化を取得しました")
-        
-        # トレンド分析を実行
-        trend_analysis = analyze_weekly_trend()
-        print("トレンド分析を実行しました")
-        
-        # 人気動画を取得（過去1ヶ月以内、再生数トップ3）
-        top_videos = get_top_videos()
-        print("人気動画情報を取得しました")
-        
-        # 新着動画を取得（過去24時間以内）
-        recent_videos = get_recent_videos()
-        print("新着動画情報を取得しました")
+# レポートの項目ごとのスナップショット（保存済みデータから集計する関数）
+REPORT_SNAPSHOTS = {
+    'stats': load_stats_snapshot,
+    'top': rank_top_videos,
+    'recent': get_recent_videos,
+    'trend': analyze_weekly_trend,
+}
 
-        # レポートの作成
-        report = f"""
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-　　🎥 **YouTubeチャンネル分析レポート** 🎥
-　　　　　　{datetime.now().strftime('%m/%d %H:%M')}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+# チャンネルごとのスナップショットの更新（API呼び出しを伴う）を重複させない
+snapshot_refreshes = SingleFlight()
+
+def snapshot_key(kind, channel_id):
+    return f"report:{kind}:{channel_id}"
+
+async def build_report_snapshots(channel_ids):
+    """チャンネルごとにレポートの各項目を集計し、キャッシュにまとめて保存
 
-📊 **{channel_stats.get('channel_name', '不明')}**
+    全チャンネル分を並行して集計する。
+    """
+    keys = [snapshot_key(kind, channel_id) for channel_id in channel_ids for kind in REPORT_SNAPSHOTS]
+    values = await asyncio.gather(*[
+        load(channel_id) for channel_id in channel_ids for load in REPORT_SNAPSHOTS.values()
+    ])
+    await cache.set_many(dict(zip(keys, values)), SNAPSHOT_TTL, SNAPSHOT_STALE)
+
+async def refresh_report_snapshots(channel_id):
+    """APIから更新してスナップショットを作り直す（クォータ不足で更新できなくても保存済みデータで作る）"""
+    channel_stats, _ = await refresh_channels(required=[channel_id])
+    if channel_id not in channel_stats:
+        await build_report_snapshots([channel_id])
+
+async def read_report_snapshot(kind, channel_id):
+    """スナップショットを待たずに返す
+
+    (エントリ, 更新タスク) を返す。古いかまだなければ更新を始め、そのタスクを返す（新しければ None）。
+    """
+    entry = await cache.peek(snapshot_key(kind, channel_id))
+    if entry is not None and entry.is_fresh(now_ts()):
+        return entry, None
+    started = not snapshot_refreshes.running(channel_id)
+    task = snapshot_refreshes.run(channel_id, lambda: refresh_report_snapshots(channel_id))
+    if started:
+        task.add_done_callback(log_background_failure(f"スナップショット {channel_id}"))
+    return entry, task
+
+def format_age(seconds):
+    if seconds < 60:
+        return "たった今"
+    if seconds < 3600:
+        return f"{seconds // 60}分前"
+    if seconds < 86400:
+        return f"{seconds // 3600}時間前"
+    return f"{seconds // 86400}日前"
+
+def format_stats_section(channel_stats, stats_changes, posting_pace):
+    return f"""📊 **{channel_stats.get('channel_name', '不明')}**
 ┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 ┃ 👥 チャンネル登録者数: {channel_stats['subscribers']:,}
 ┃ 　前日比: {f"{stats_changes['daily']['subscribers']:+,}" if stats_changes else "集計不可（データ不足）"}
@@ -1033,71 +745,289 @@ async def send_daily_report(channel):
 ┃ 📹 総動画数: {channel_stats['videos']}
 ┃ 　前日比: {f"{stats_changes['daily']['videos']:+,}" if stats_changes else "集計不可（データ不足）"}
 ┃ 　週間比: {f"{stats_changes['weekly']['videos']:+,}" if stats_changes else "集計不可（データ不足）"}
+┃ 　投稿ペース: {posting_pace}
 ┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"""
 
-        # トレンド分析セクション
-        report += "\n\n📈 **週間トレンド分析**"
-        if trend_analysis:
-            report += f"""
+def format_trend_section(trend_analysis):
+    section = "📈 **週間トレンド分析**"
+    if trend_analysis:
+        section += f"""
 ・チャンネル登録者: {trend_analysis['subscribers']:+.1f}%
 ・総再生回数: {trend_analysis['views']:+.1f}%
 ・平均投稿頻度: {trend_analysis['videos_per_day']:.1f}本/日"""
-        else:
-            report += "\n・集計不可（データ不足）"
+    else:
+        section += "\n・集計不可（データ不足）"
+    return section
 
-        # 新着動画セクション（過去24時間）
-        if recent_videos:
-            report += "\n\n📝 **新着動画（過去24時間）**"
-            for video in recent_videos:
-                report += f"""
+def format_recent_section(recent_videos, limit=None):
+    if not recent_videos:
+        return "📝 新着動画はありません"
+    section = "📝 **新着動画（過去24時間）**"
+    for video in recent_videos[:limit]:
+        section += f"""
 ・{video['title']}
 　👀 {video['views']:,} 👍 {video['likes']:,} 💭 {video['comments']:,}
 　🔗 https://youtu.be/{video['video_id']}"""
-        else:
-            report += "\n\n📝 新着動画はありません"
-
-        # 人気動画セクション（過去1ヶ月）
-        if top_videos:
-            report += "\n\n🎬 **人気動画TOP3（過去1ヶ月）**"
-            medals = ["🥇", "🥈", "🥉"]
-            for i, video in enumerate(top_videos[:3]):
-                report += f"""
+    if limit is not None and len(recent_videos) > limit:
+        section += f"\n…ほか{len(recent_videos) - limit}本"
+    return section
+
+def format_top_section(top_videos):
+    if not top_videos:
+        return "🎬 過去1ヶ月の動画はありません"
+    section = "🎬 **人気動画TOP3（過去1ヶ月）**"
+    medals = ["🥇", "🥈", "🥉"]
+    for i, video in enumerate(top_videos[:3]):
+        section += f"""
 {medals[i]} {video['title']}
 　👀 {video['views']:,}
 　👍 {video['likes']:,}
 　💭 {video['comments']:,}
 　🔗 https://youtu.be/{video['video_id']}"""
+    return section
+
+async def send_daily_report(channel):
+    try:
+        print("\n=== レポート生成開始 ===")
+        
+        with REPORT_STAGE_SECONDS.time(stage='total'):
+            # チャンネル統計はキャッシュから取得（古ければ裏でAPIから更新し、レポートは待たない）
+            with REPORT_STAGE_SECONDS.time(stage='channel_stats'):
+                channel_stats = await get_fresh_channel_stats()
+                quota_status = await get_quota_status()
+            print(f"チャンネル統計を取得しました（クォータ残り: {quota_status['remaining']:,}）")
+            
+            # 以降は保存済みデータから集計する（読み込みは並行して実行）
+            with REPORT_STAGE_SECONDS.time(stage='aggregate'):
+                recent_videos, top_videos, posting_pace, trend_analysis = await asyncio.gather(
+                    get_recent_videos(),
+                    get_top_videos(),
+                    calculate_posting_pace(),
+                    analyze_weekly_trend()
+                )
+            if not channel_stats:
+                print(f"❌ チャンネル統計がありません: {RIVAL_CHANNEL_ID}")
+                return
+            print("チャンネル統計・新着動画・人気動画・投稿ペース・トレンドを集計しました")
+            
+            # 統計の変化を取得
+            with REPORT_STAGE_SECONDS.time(stage='stats_changes'):
+                stats_changes = await get_stats_changes(channel_stats)
+            print("統計の変化を取得しました")
 
-        # レポートの送信
-        await channel.send(report)
+            # レポートの作成
+            with REPORT_STAGE_SECONDS.time(stage='render'):
+                report = f"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+　　🎥 **YouTubeチャンネル分析レポート** 🎥
+　　　　　　{datetime.now().strftime('%m/%d %H:%M')}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+""" + format_stats_section(channel_stats, stats_changes, posting_pace)
+
+                # トレンド分析・新着動画（過去24時間）・人気動画（過去1ヶ月）
+                report += "\n\n" + format_trend_section(trend_analysis)
+                report += "\n\n" + format_recent_section(recent_videos)
+                if top_videos:
+                    report += "\n\n" + format_top_section(top_videos)
+
+                # APIクォータの状況
+                report += f"\n\n🔋 APIクォータ残り: {quota_status['remaining']:,} / {quota_status['budget']:,}"
+                if quota_status['degraded']:
+                    report += "\n⚠️ クォータ残量が少ないため、保存済みのデータを表示しています"
+
+            # レポートの送信
+            with REPORT_STAGE_SECONDS.time(stage='send'), DISCORD_SEND_SECONDS.time(kind='report'):
+                await discord_sends.call(lambda: channel.send(report))
         print("✨ レポート生成・送信が完了しました")
 
     except Exception as e:
         print(f"❌ エラーが発生しました: {str(e)}")
         traceback.print_exc()
 
+async def answer_from_snapshot(interaction, kind, channel_id, format_section):
+    """保存済みのスナップショットで即答する（古ければ裏で更新を始め、なければ更新を待つ）"""
+    with COMMAND_SECONDS.time(command=kind):
+        await _answer_from_snapshot(interaction, kind, channel_id, format_section)
+
+async def _answer_from_snapshot(interaction, kind, channel_id, format_section):
+    channel_id = channel_id or RIVAL_CHANNEL_ID
+    if channel_id not in await get_tracked_channels():
+        await interaction.response.send_message(f"追跡していないチャンネルです: {channel_id}", ephemeral=True)
+        return
+    
+    entry, refresh = await read_report_snapshot(kind, channel_id)
+    send = interaction.response.send_message
+    if entry is None:
+        # まだ集計していないチャンネルは、更新を待ってから答える
+        await interaction.response.defer(thinking=True)
+        try:
+            await asyncio.shield(refresh)
+        except Exception as e:
+            print(f"❌ スナップショットの更新でエラーが発生しました: {str(e)}")
+        entry = await cache.peek(snapshot_key(kind, channel_id))
+        refresh = None
+        send = interaction.followup.send
+    
+    if entry is None or (kind == 'stats' and entry.value is None):
+        await send(f"❌ データがありません: {channel_id}")
+        return
+    
+    message = format_section(entry.value)
+    if kind != 'stats':
+        # 統計以外の項目にはチャンネル名を付ける
+        row = await db.fetchone('SELECT channel_name FROM channel_info WHERE channel_id = ?', (channel_id,))
+        message = f"📺 **{row[0] if row else channel_id}**\n" + message
+    message += f"\n\n🕒 {format_age(now_ts() - entry.updated_ts)}のデータ"
+    if refresh is not None:
+        message += "（最新のデータに更新中です）"
+    with DISCORD_SEND_SECONDS.time(kind='command'):
+        await discord_replies.call(lambda: send(message))
+
+@tree.command(name="stats", description="チャンネル登録者数・総再生回数・総動画数と前日比・週間比")
+@app_commands.describe(channel_id="チャンネルID（省略するとレポート対象のチャンネル）")
+async def stats_command(interaction: discord.Interaction, channel_id: str = None):
+    await answer_from_snapshot(
+        interaction, 'stats', channel_id,
+        lambda snapshot: format_stats_section(snapshot['stats'], snapshot['changes'], snapshot['posting_pace'])
+    )
+
+@tree.command(name="top", description="過去1ヶ月の人気動画TOP3")
+@app_commands.describe(channel_id="チャンネルID（省略するとレポート対象のチャンネル）")
+async def top_command(interaction: discord.Interaction, channel_id: str = None):
+    await answer_from_snapshot(interaction, 'top', channel_id, format_top_section)
+
+@tree.command(name="recent", description="過去24時間の新着動画")
+@app_commands.describe(channel_id="チャンネルID（省略するとレポート対象のチャンネル）")
+async def recent_command(interaction: discord.Interaction, channel_id: str = None):
+    await answer_from_snapshot(
+        interaction, 'recent', channel_id,
+        lambda videos: format_recent_section(videos, COMMAND_RECENT_LIMIT)
+    )
+
+@tree.command(name="trend", description="過去7日間の成長率と投稿頻度")
+@app_commands.describe(channel_id="チャンネルID（省略するとレポート対象のチャンネル）")
+async def trend_command(interaction: discord.Interaction, channel_id: str = None):
+    await answer_from_snapshot(interaction, 'trend', channel_id, format_trend_section)
+
+def format_history_section(trend, days):
+    unit = "日" if trend['tier'] == 'day' else "週"
+    section = f"""📆 **長期トレンド（過去{days}日・{unit}ごとの集計 {trend['buckets']}件）**
+・チャンネル登録者: {trend['subscribers_added']:+,}（{trend['subscribers']:+.1f}%）
+・総再生回数: {trend['views_added']:+,}（{trend['views']:+.1f}%）
+・動画数: {trend['videos_added']:+,}本"""
+    if trend['best_bucket_ts'] is not None:
+        section += (f"\n・再生数が最も伸びた{unit}: {from_epoch(trend['best_bucket_ts']).strftime('%Y/%m/%d')}〜"
+                    f"（{trend['best_growth_rate']:+.2f}%）")
+    return section
+
+@tree.command(name="history", description="数ヶ月〜数年の登録者数・総再生回数の推移（日・週ごとの集計から）")
+@app_commands.describe(channel_id="チャンネルID（省略するとレポート対象のチャンネル）", days="期間（日）")
+async def history_command(interaction: discord.Interaction, channel_id: str = None, days: int = 90):
+    with COMMAND_SECONDS.time(command='history'):
+        channel_id = channel_id or RIVAL_CHANNEL_ID
+        days = max(2, days)
+        trend = await analytics.channel_trend(channel_id, days)
+        if trend is None:
+            await interaction.response.send_message(
+                "集計がまだありません（夜間処理で作成されます）", ephemeral=True)
+            return
+        message = format_history_section(trend, days)
+        with DISCORD_SEND_SECONDS.time(kind='command'):
+            await discord_replies.call(lambda: interaction.response.send_message(message))
+
+def format_comment_summary(summary):
+    terms = '・'.join(f"{term}（{count:,}）" for term, count in summary['top_terms']) or 'なし'
+    return (
+        f"💬 **コメント分析**\n"
+        f"コメント: {summary['threads']:,}件 / 返信: {summary['replies']:,}件（返信率 {summary['reply_ratio']:.2f}）\n"
+        f"ペース: {summary['comments_per_hour']:,}件/時（過去24時間 {summary['comments_last_24h']:,}件）\n"
+        f"よく使われる語: {terms}"
+    )
+
+@tree.command(name="comments", description="動画のコメントのよく使われる語・ペース・返信率")
+@app_commands.describe(video_id="動画ID")
+async def comments_command(interaction: discord.Interaction, video_id: str):
+    with COMMAND_SECONDS.time(command='comments'):
+        summary = await get_comment_summary(video_id)
+        if summary is None:
+            await interaction.response.send_message(f"コメントを取り込んでいない動画です: {video_id}", ephemeral=True)
+            return
+        row = await db.fetchone('SELECT title FROM video_stats WHERE video_id = ?', (video_id,))
+        message = f"🎬 **{row[0] if row else video_id}**\n" + format_comment_summary(summary)
+        message += f"\n\n🕒 {format_age(now_ts() - summary['updated_ts'])}のデータ"
+        with DISCORD_SEND_SECONDS.time(kind='command'):
+            await discord_replies.call(lambda: interaction.response.send_message(message))
+
+def format_similar_thumbnails(result):
+    lines = ["🖼️ **似ているサムネイル**"]
+    template = result['template']
+    if template:
+        performance = f"{template['average_performance']:.2f}倍" if template['average_performance'] is not None else '不明'
+        lines.append(
+            f"テンプレート: {template['thumbnails']:,}枚・{template['channels']}チャンネル"
+            f"（平均 {template['average_views'] or 0:,}回再生・チャンネル平均の{performance}）"
+        )
+    if not result['similar']:
+        lines.append("似ているサムネイルはありません")
+    for video in result['similar']:
+        performance = f"・平均の{video['performance_score']:.2f}倍" if video['performance_score'] is not None else ''
+        published = from_epoch(video['published_ts']).strftime('%Y/%m/%d') if video['published_ts'] else '不明'
+        lines.append(
+            f"• {video['title'] or video['video_id']}（距離 {video['distance']}・{published}・"
+            f"{video['views'] or 0:,}回再生{performance}）"
+        )
+    return '\n'.join(lines)
+
+@tree.command(name="similar", description="動画のサムネイルに似ている過去のサムネイルとその成績")
+@app_commands.describe(video_id="動画ID")
+async def similar_command(interaction: discord.Interaction, video_id: str):
+    with COMMAND_SECONDS.time(command='similar'):
+        result = await find_similar_thumbnails(video_id)
+        if result is None:
+            await interaction.response.send_message(f"サムネイルを分析していない動画です: {video_id}", ephemeral=True)
+            return
+        row = await db.fetchone('SELECT title FROM video_stats WHERE video_id = ?', (video_id,))
+        message = f"🎬 **{row[0] if row else video_id}**\n" + format_similar_thumbnails(result)
+        with DISCORD_SEND_SECONDS.time(kind='command'):
+            await discord_replies.call(lambda: interaction.response.send_message(message[:2000]))
+
 # スケジュール設定を朝9時のみに変更
 @client.event
 async def on_ready():
+    global _started
+    # 再接続のたびに on_ready が呼ばれるので、初期化とスケジューラの起動は1回だけ行う
+    # （起動中のレポート送信を待っている間の再接続でも重ならないよう、最初の await より前に印を付ける）
+    if _started:
+        print(f'{client.user} として再接続しました（起動処理は実行済みです）')
+        return
+    _started = True
     print(f'{client.user} としてログインしました')
     
     # データベースの初期化
-    init_db()
-    
-    # レポートの送信
-    target_channel = client.get_channel(1350462901541929060)
-    if target_channel:
-        await send_daily_report(target_channel)
-    else:
-        print('エラー: 対象のチャンネルが見つかりません')
-    
-    # 定期実行タスクの設定（朝9時のみ）
-    schedule.every().day.at("09:00").do(lambda: asyncio.create_task(send_daily_report(client.get_channel(1350462901541929060))))
-    
-    while True:
-        schedule.run_pending()
-        await asyncio.sleep(60)
+    await init_db()
+    
+    # スラッシュコマンドを登録
+    await tree.sync()
+    
+    # 定期実行タスクの設定（レポートは朝9時と夜8時）
+    scheduler.add_daily('daily_report', REPORT_TIMES, send_scheduled_report)
+    # 追跡チャンネルの更新（動画のスナップショットも追記される）を1日に分散させる
+    scheduler.add_interval('refresh', REFRESH_INTERVAL_MINUTES, scheduled_refresh)
+    # 夜間のまとめ処理
+    scheduler.add_daily('nightly_maintenance', [NIGHTLY_MAINTENANCE_TIME], nightly_maintenance)
+    
+    # メトリクスの公開（HTTP と JSON Lines）
+    await registry.start()
+    
+    # 起動時のレポート（実行を記録し、停止中に逃したレポートと重複させない）
+    await scheduler.run_job('daily_report')
+    print(f"起動から最初のレポートまで: {time.perf_counter() - STARTED_AT:.2f}秒")
+    scheduler.start()
+    # 分析ジョブのワーカー（前回の続きから処理する）
+    await job_queue.start()
 
-# Discordクライアントを実行
-load_dotenv()
-client.run(os.getenv('DISCORD_TOKEN'))
+# Discordクライアントを実行（ベンチマークなどから import したときは起動しない）
+if __name__ == '__main__':
+    load_dotenv()
+    client.run(os.getenv('DISCORD_TOKEN'))
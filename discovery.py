@@ -0,0 +1,160 @@
+import asyncio
+from datetime import timezone
+
+from collector import collect_video_stats
+from database import db, now_ts, to_epoch
+from youtube_api import YouTubeAPIError
+
+# 初回同期で遡るページ数の上限（1ページ50件・1ユニット）
+INITIAL_SYNC_PAGES = 4
+# 差分同期で遡るページ数の上限（カーソルが見つからない場合の保険）
+MAX_SYNC_PAGES = 20
+# 統計を毎回更新する動画の公開期間（人気動画TOP3の集計期間に合わせる）
+REFRESH_WINDOW_DAYS = 30
+
+
+def utc_iso(dt):
+    """YouTube API と同じ形式（2024-01-01T00:00:00Z）の文字列に変換"""
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def uploads_playlist_id(channel_id):
+    """チャンネルのアップロード再生リストID（UC... → UU...）"""
+    if channel_id.startswith('UC'):
+        return 'UU' + channel_id[2:]
+    return None
+
+
+async def get_sync_targets(channel_ids):
+    """チャンネルごとのアップロード再生リストと同期カーソルを取得"""
+    placeholders = ','.join('?' * len(channel_ids))
+    rows = await db.fetchall(f'''
+        SELECT tc.channel_id, tc.uploads_playlist_id, ss.last_video_id, ss.last_published_ts
+        FROM tracked_channels tc
+        LEFT JOIN channel_sync_state ss ON ss.channel_id = tc.channel_id
+        WHERE tc.channel_id IN ({placeholders})
+    ''', list(channel_ids))
+    return {
+        row[0]: {
+            "playlist_id": row[1] or uploads_playlist_id(row[0]),
+            "last_video_id": row[2],
+            "last_published_ts": row[3]
+        }
+        for row in rows
+    }
+
+
+async def save_sync_cursors(cursors):
+    """同期カーソル（最後に確認した動画ID・公開日時）を保存"""
+    if not cursors:
+        return
+    ts = now_ts()
+    await db.executemany('''
+        INSERT INTO channel_sync_state (channel_id, last_video_id, last_published_ts, last_synced_ts)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(channel_id) DO UPDATE SET
+            last_video_id = COALESCE(excluded.last_video_id, channel_sync_state.last_video_id),
+            last_published_ts = COALESCE(excluded.last_published_ts, channel_sync_state.last_published_ts),
+            last_synced_ts = excluded.last_synced_ts
+    ''', [(channel_id, cursor["last_video_id"], cursor["last_published_ts"], ts)
+          for channel_id, cursor in cursors.items()])
+
+
+async def get_videos_to_refresh(channel_ids, days=REFRESH_WINDOW_DAYS):
+    """統計を更新すべき既知の動画（最近公開されたもの）を取得"""
+    placeholders = ','.join('?' * len(channel_ids))
+    since = now_ts() - days * 86400
+    rows = await db.fetchall(f'''
+        SELECT video_id
+        FROM video_stats
+        WHERE channel_id IN ({placeholders}) AND published_ts >= ?
+    ''', list(channel_ids) + [since])
+    return [row[0] for row in rows]
+
+
+async def fetch_new_uploads(youtube, playlist_id, last_video_id=None, last_published_ts=None):
+    """アップロード再生リストを新しい順に読み、既知の動画に到達したら止める
+
+    新着動画の (video_id, published_ts) のリストを新しい順で返す。
+    """
+    new_videos = []
+    next_page_token = None
+    max_pages = MAX_SYNC_PAGES if last_video_id else INITIAL_SYNC_PAGES
+
+    for _ in range(max_pages):
+        response = await youtube.playlist_items_list(
+            part="contentDetails",
+            playlistId=playlist_id,
+            maxResults=50,
+            pageToken=next_page_token
+        )
+        for item in response.get("items", []):
+            video_id = item["contentDetails"]["videoId"]
+            published_ts = to_epoch(item["contentDetails"].get("videoPublishedAt"))
+            if video_id == last_video_id:
+                return new_videos
+            if last_published_ts and published_ts and published_ts <= last_published_ts:
+                return new_videos
+            if published_ts:  # 非公開・削除済みの動画は公開日時がない
+                new_videos.append((video_id, published_ts))
+
+        next_page_token = response.get("nextPageToken")
+        if not next_page_token:
+            break
+
+    return new_videos
+
+
+async def sync_channel(youtube, channel_id, target):
+    """1チャンネル分の新着動画を検出する"""
+    if not target["playlist_id"]:
+        return []
+    try:
+        return await fetch_new_uploads(
+            youtube,
+            target["playlist_id"],
+            target["last_video_id"],
+            target["last_published_ts"]
+        )
+    except YouTubeAPIError as e:
+        # 動画のないチャンネルは再生リストが存在しない
+        if e.status == 404:
+            return []
+        raise
+
+
+async def discover_videos(youtube, channel_ids):
+    """追跡チャンネルの新着動画を検出し、最近の動画の統計とあわせて動画インデックスを更新
+
+    search.list（100ユニット）ではなく playlistItems.list（1ユニット）を使う。
+    新たに見つかった動画IDのリストを返す。
+    """
+    if not channel_ids:
+        return []
+    targets = await get_sync_targets(channel_ids)
+
+    results = await asyncio.gather(*[
+        sync_channel(youtube, channel_id, target)
+        for channel_id, target in targets.items()
+    ])
+
+    new_video_ids = []
+    cursors = {}
+    for channel_id, new_videos in zip(targets, results):
+        if new_videos:
+            newest_id, newest_published_ts = max(new_videos, key=lambda v: v[1])
+            cursors[channel_id] = {"last_video_id": newest_id, "last_published_ts": newest_published_ts}
+            new_video_ids.extend(video_id for video_id, _ in new_videos)
+        else:
+            cursors[channel_id] = {"last_video_id": None, "last_published_ts": None}
+
+    # 新着動画と最近の既知動画の統計をまとめて取得（50件ずつ）
+    refresh_ids = list(dict.fromkeys(new_video_ids + await get_videos_to_refresh(list(targets))))
+    await collect_video_stats(youtube, refresh_ids)
+
+    # 動画が保存できてからカーソルを進める
+    await save_sync_cursors(cursors)
+
+    if new_video_ids:
+        print(f"新着動画を{len(new_video_ids)}件検出しました")
+    return new_video_ids
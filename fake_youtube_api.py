@@ -0,0 +1,489 @@
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from collector import add_tracked_channel, collect_channel_stats
+from database import db
+from discovery import discover_videos
+from quota import quota_cost
+from schema import apply_migrations
+from youtube_api import AsyncYouTubeClient
+
+# ローカルで動く YouTube Data API の代わり（負荷試験・クォータ試験用）
+# channels / search / videos / playlistItems / commentThreads の list とサムネイル画像を返す。
+# データはチャンネルIDとシードから決まるので、同じ設定なら何度起動しても同じ内容になる。
+#
+#   python fake_youtube_api.py --port 8765 --latency-ms 80 --error-rate 0.01
+#   YOUTUBE_API_BASE_URL=http://127.0.0.1:8765/youtube/v3 THUMBNAIL_BASE_URL=http://127.0.0.1:8765 \
+#       python discordYoutube.py
+#   python fake_youtube_api.py --load-test 2000      # サーバーを起動し、2000チャンネル分の収集を計測
+
+DEFAULT_PORT = 8765
+# 1チャンネルあたりの動画の数の上限（アップロード再生リストで返す本数）
+MAX_VIDEOS_PER_CHANNEL = 500
+# 1ページあたりの件数の上限（実際の API と同じ）
+MAX_RESULTS = 50
+MAX_COMMENT_RESULTS = 100
+# コメントを無効にしている動画の割合
+COMMENTS_DISABLED_RATE = 0.05
+# 生成したサムネイルを保持する数
+THUMBNAIL_CACHE_SIZE = 512
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def fake_channel_id(i):
+    """負荷試験用のチャンネルID（どの UC... でも応答するが、連番で作れると便利なので）"""
+    return f"UCfake{i:018d}"
+
+
+class FakeYouTubeData:
+    """チャンネルIDとシードから決まる合成データ
+
+    チャンネルごとに投稿間隔と位相を決め、その間隔で動画が投稿され続けているものとして扱う。
+    時間が経てば新しい動画が増え、再生数も伸びる（同じ時刻に問い合わせれば同じ結果）。
+    """
+
+    def __init__(self, seed=0, max_videos=MAX_VIDEOS_PER_CHANNEL):
+        self.seed = seed
+        self.max_videos = max_videos
+
+    def _rng(self, *key):
+        return random.Random(f"{self.seed}:{':'.join(map(str, key))}")
+
+    def channel_profile(self, channel_id):
+        rng = self._rng('channel', channel_id)
+        return {
+            'interval': rng.randint(6, 96) * 3600,   # 投稿間隔
+            'phase': rng.randint(0, 96 * 3600),
+            'popularity': 10 ** rng.uniform(2, 6),   # 1本あたりの再生数の目安
+            'subscribers': int(10 ** rng.uniform(3, 7)),
+            'title': f"テストチャンネル {channel_id[-6:]}"
+        }
+
+    def latest_index(self, profile, now):
+        return int((now - profile['phase']) // profile['interval'])
+
+    def channel(self, channel_id, now):
+        if not channel_id.startswith('UC'):
+            return None
+        profile = self.channel_profile(channel_id)
+        total_videos = min(self.max_videos, self.latest_index(profile, now) + 1)
+        return {
+            'kind': 'youtube#channel',
+            'id': channel_id,
+            'snippet': {'title': profile['title'], 'publishedAt': iso(profile['phase'])},
+            'contentDetails': {'relatedPlaylists': {'uploads': 'UU' + channel_id[2:]}},
+            'statistics': {
+                'subscriberCount': str(profile['subscribers']),
+                'viewCount': str(int(profile['popularity'] * total_videos * 3)),
+                'videoCount': str(total_videos),
+                'hiddenSubscriberCount': False
+            }
+        }
+
+    def video_id(self, channel_id, index):
+        return f"{channel_id[2:]}.{index}"
+
+    def parse_video_id(self, video_id):
+        channel_part, _, index = video_id.rpartition('.')
+        if not channel_part or not index.isdigit():
+            return None, None
+        return 'UC' + channel_part, int(index)
+
+    def video(self, video_id, now, thumbnail_base_url):
+        channel_id, index = self.parse_video_id(video_id)
+        if channel_id is None:
+            return None
+        profile = self.channel_profile(channel_id)
+        published = profile['phase'] + index * profile['interval']
+        if published > now or index <= self.latest_index(profile, now) - self.max_videos:
+            return None
+        rng = self._rng('video', video_id)
+        # 公開直後に伸び、数日で頭打ちになる再生数
+        age_hours = (now - published) / 3600
+        views = int(profile['popularity'] * rng.uniform(0.2, 3.0) * (1 - math.exp(-age_hours / 48)))
+        words = ['ゲーム実況', '検証', '料理', 'vlog', 'live', '100日', '最強', '神回', '【総集編】', '初見']
+        return {
+            'kind': 'youtube#video',
+            'id': video_id,
+            'snippet': {
+                'channelId': channel_id,
+                'channelTitle': profile['title'],
+                'title': f"{' '.join(rng.sample(words, 3))} #{index}",
+                'publishedAt': iso(published),
+                'thumbnails': {'high': {'url': f"{thumbnail_base_url}/vi/{video_id}/hqdefault.jpg"}}
+            },
+            'statistics': {
+                'viewCount': str(views),
+                'likeCount': str(views // rng.randint(20, 80)),
+                'commentCount': str(views // rng.randint(200, 800))
+            }
+        }
+
+    def comments(self, video_id, now):
+        """動画のコメント数と、コメントの投稿間隔（秒）。コメントが無効なら None
+
+        i 番目のコメントは 公開時刻 + i × 間隔 に投稿されたものとし、時間が経つと増える（ID と時刻は変わらない）。
+        """
+        video = self.video(video_id, now, '')
+        if video is None:
+            return None
+        rng = self._rng('comments', video_id)
+        if rng.random() < COMMENTS_DISABLED_RATE:
+            return None
+        channel_id, index = self.parse_video_id(video_id)
+        profile = self.channel_profile(channel_id)
+        published = profile['phase'] + index * profile['interval']
+        spacing = rng.uniform(5, 300)
+        count = min(int(video['statistics']['commentCount']), int((now - published) // spacing) + 1)
+        return published, spacing, max(0, count)
+
+    def comment_thread(self, video_id, index, published, spacing):
+        rng = self._rng('comment', video_id, index)
+        words = ['最高', '神回', '面白い', 'おもしろすぎ', 'ゲーム', '実況', '編集', 'bgm', '初見', '次回', '待ってました', 'www']
+        comment_id = f"Ug{video_id}.{index}"
+        text = ' '.join(rng.sample(words, rng.randint(1, 4)))
+        return {
+            'kind': 'youtube#commentThread',
+            'id': comment_id,
+            'snippet': {
+                'videoId': video_id,
+                'totalReplyCount': rng.choice([0, 0, 0, 1, 2, 5]),
+                'topLevelComment': {
+                    'kind': 'youtube#comment',
+                    'id': comment_id,
+                    'snippet': {
+                        'textOriginal': text,
+                        'textDisplay': text,
+                        'likeCount': int(rng.expovariate(0.2)),
+                        'publishedAt': iso(int(published + index * spacing))
+                    }
+                }
+            }
+        }
+
+    def uploads(self, playlist_id, now):
+        """アップロード再生リストの動画（新しい順）。存在しなければ None"""
+        if not playlist_id.startswith('UU'):
+            return None
+        channel_id = 'UC' + playlist_id[2:]
+        profile = self.channel_profile(channel_id)
+        latest = self.latest_index(profile, now)
+        return [
+            (self.video_id(channel_id, index), profile['phase'] + index * profile['interval'])
+            for index in range(latest, max(-1, latest - self.max_videos), -1)
+        ]
+
+
+class FakeYouTubeAPI:
+    """YouTube Data API v3 と同じ形式で応答する aiohttp アプリケーション
+
+    - 呼び出しごとに実際の API と同じユニット数を数え、daily_quota を超えたら 403 quotaExceeded
+    - latency_ms（± jitter_ms）の遅延、error_rate の割合で 5xx、quota_error_rate の割合で 403 を返す
+    - rate_limit（回/秒）を超えた呼び出しには 403 rateLimitExceeded（Retry-After 付き）を返す
+    - /_stats で呼び出し回数・消費ユニット・返したエラーを確認でき、POST /_reset で0に戻す
+    """
+
+    def __init__(self, seed=0, daily_quota=10000, latency_ms=0, jitter_ms=0, error_rate=0.0,
+                 quota_error_rate=0.0, max_videos=MAX_VIDEOS_PER_CHANNEL, public_url=None, rate_limit=0):
+        self.data = FakeYouTubeData(seed, max_videos)
+        self.daily_quota = daily_quota
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.public_url = public_url
+        self.rate_limit = rate_limit
+        self._window = (0, 0)  # (秒, その秒の呼び出し数)
+        # 遅延・エラーの注入もシードから決める（同じ順で呼べば同じ結果）
+        self.rng = random.Random(seed)
+        self._thumbnails = OrderedDict()
+        self.reset()
+
+    def reset(self):
+        self.units_used = 0
+        self.calls = Counter()
+        self.errors = Counter()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/youtube/v3/channels', self._endpoint('channels.list', self.channels_list))
+        app.router.add_get('/youtube/v3/videos', self._endpoint('videos.list', self.videos_list))
+        app.router.add_get('/youtube/v3/playlistItems', self._endpoint('playlistItems.list', self.playlist_items_list))
+        app.router.add_get('/youtube/v3/search', self._endpoint('search.list', self.search_list))
+        app.router.add_get('/youtube/v3/commentThreads', self._endpoint('commentThreads.list', self.comment_threads_list))
+        app.router.add_get('/vi/{video_id}/{name}', self.thumbnail)
+        app.router.add_get('/_stats', self.stats)
+        app.router.add_post('/_reset', self.reset_handler)
+        return app
+
+    def _base_url(self, request):
+        return self.public_url or f"{request.scheme}://{request.host}"
+
+    @staticmethod
+    def error_response(status, reason, message, domain='youtube.api'):
+        return web.json_response({
+            'error': {
+                'code': status,
+                'message': message,
+                'errors': [{'message': message, 'domain': domain, 'reason': reason}]
+            }
+        }, status=status)
+
+    def _endpoint(self, method, handler):
+        async def endpoint(request):
+            if self.latency_ms or self.jitter_ms:
+                delay = self.latency_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+                await asyncio.sleep(max(0.0, delay) / 1000)
+            self.calls[method] += 1
+            if self._rate_limited():
+                self.errors['rateLimitExceeded'] += 1
+                response = self.error_response(
+                    403, 'rateLimitExceeded', 'The request cannot be completed due to rate limiting.')
+                response.headers['Retry-After'] = '1'
+                return response
+
+            # 失敗した呼び出しもクォータを消費する（実際の API と同じ）
+            cost = quota_cost(method)
+            if self.units_used + cost > self.daily_quota:
+                self.errors['quotaExceeded'] += 1
+                return self.error_response(
+                    403, 'quotaExceeded',
+                    'The request cannot be completed because you have exceeded your quota.',
+                    domain='youtube.quota'
+                )
+            self.units_used += cost
+            if self.rng.random() < self.quota_error_rate:
+                self.errors['quotaExceeded'] += 1
+                return self.error_response(
+                    403, 'quotaExceeded',
+                    'The request cannot be completed because you have exceeded your quota.',
+                    domain='youtube.quota'
+                )
+            if self.rng.random() < self.error_rate:
+                status = self.rng.choice([500, 503])
+                self.errors[str(status)] += 1
+                return self.error_response(status, 'backendError', 'Backend Error', domain='global')
+
+            if not request.query.get('part'):
+                return self.error_response(400, 'required', 'Required parameter: part')
+            result = handler(request, int(time.time()))
+            return result if isinstance(result, web.Response) else web.json_response(result)
+        return endpoint
+
+    def _rate_limited(self):
+        if not self.rate_limit:
+            return False
+        second = int(time.monotonic())
+        start, count = self._window
+        count = count + 1 if start == second else 1
+        self._window = (second, count)
+        return count > self.rate_limit
+
+    def _max_results(self, request, default=5):
+        return max(0, min(MAX_RESULTS, int(request.query.get('maxResults', default))))
+
+    def channels_list(self, request, now):
+        ids = [i for i in request.query.get('id', '').split(',') if i][:MAX_RESULTS]
+        items = [item for item in (self.data.channel(i, now) for i in ids) if item]
+        return {'kind': 'youtube#channelListResponse', 'items': items,
+                'pageInfo': {'totalResults': len(items), 'resultsPerPage': len(items)}}
+
+    def videos_list(self, request, now):
+        ids = [i for i in request.query.get('id', '').split(',') if i][:MAX_RESULTS]
+        base_url = self._base_url(request)
+        items = [item for item in (self.data.video(i, now, base_url) for i in ids) if item]
+        return {'kind': 'youtube#videoListResponse', 'items': items,
+                'pageInfo': {'totalResults': len(items), 'resultsPerPage': len(items)}}
+
+    def _page(self, entries, request, default_max_results=5):
+        start = int(request.query.get('pageToken') or 0)
+        max_results = self._max_results(request, default_max_results)
+        page = entries[start:start + max_results]
+        next_token = str(start + max_results) if start + max_results < len(entries) else None
+        return page, next_token
+
+    def playlist_items_list(self, request, now):
+        uploads = self.data.uploads(request.query.get('playlistId', ''), now)
+        if uploads is None:
+            return self.error_response(404, 'playlistNotFound', 'The playlist could not be found.')
+        page, next_token = self._page(uploads, request)
+        response = {
+            'kind': 'youtube#playlistItemListResponse',
+            'items': [{
+                'kind': 'youtube#playlistItem',
+                'contentDetails': {'videoId': video_id, 'videoPublishedAt': iso(published)}
+            } for video_id, published in page],
+            'pageInfo': {'totalResults': len(uploads), 'resultsPerPage': len(page)}
+        }
+        if next_token:
+            response['nextPageToken'] = next_token
+        return response
+
+    def search_list(self, request, now):
+        # channelId を指定した検索だけに対応（新しい順の動画）
+        channel_id = request.query.get('channelId', '')
+        uploads = self.data.uploads('UU' + channel_id[2:], now) if channel_id.startswith('UC') else []
+        page, next_token = self._page(uploads or [], request)
+        base_url = self._base_url(request)
+        response = {
+            'kind': 'youtube#searchListResponse',
+            'items': [{
+                'kind': 'youtube#searchResult',
+                'id': {'kind': 'youtube#video', 'videoId': video_id},
+                'snippet': self.data.video(video_id, now, base_url)['snippet']
+            } for video_id, _ in page],
+            'pageInfo': {'totalResults': len(uploads or []), 'resultsPerPage': len(page)}
+        }
+        if next_token:
+            response['nextPageToken'] = next_token
+        return response
+
+    def comment_threads_list(self, request, now):
+        # videoId を指定した新しい順（order=time）だけに対応。ページトークンは次に返すコメントの番号
+        video_id = request.query.get('videoId', '')
+        if self.data.video(video_id, now, '') is None:
+            return self.error_response(404, 'videoNotFound', 'The video identified by the videoId parameter could not be found.')
+        comments = self.data.comments(video_id, now)
+        if comments is None:
+            return self.error_response(
+                403, 'commentsDisabled', 'The video identified by the videoId parameter has disabled comments.')
+        published, spacing, count = comments
+        max_results = max(1, min(MAX_COMMENT_RESULTS, int(request.query.get('maxResults', 20))))
+        start = int(request.query.get('pageToken') or count - 1)
+        indexes = range(start, max(-1, start - max_results), -1)
+        response = {
+            'kind': 'youtube#commentThreadListResponse',
+            'items': [self.data.comment_thread(video_id, i, published, spacing) for i in indexes],
+            'pageInfo': {'totalResults': len(indexes), 'resultsPerPage': max_results}
+        }
+        if start - max_results >= 0:
+            response['nextPageToken'] = str(start - max_results)
+        return response
+
+    def _thumbnail_bytes(self, video_id):
+        data = self._thumbnails.get(video_id)
+        if data is None:
+            import numpy as np
+            from benchmark import synthetic_thumbnail
+            seed = int.from_bytes(hashlib.blake2b(f"{self.data.seed}:{video_id}".encode(), digest_size=8).digest(), 'big')
+            data = synthetic_thumbnail(np.random.default_rng(seed))
+            self._thumbnails[video_id] = data
+            while len(self._thumbnails) > THUMBNAIL_CACHE_SIZE:
+                self._thumbnails.popitem(last=False)
+        else:
+            self._thumbnails.move_to_end(video_id)
+        return data
+
+    async def thumbnail(self, request):
+        video_id = request.match_info['video_id']
+        if self.data.parse_video_id(video_id)[0] is None:
+            raise web.HTTPNotFound()
+        self.calls['thumbnail'] += 1
+        data = await asyncio.to_thread(self._thumbnail_bytes, video_id)
+        etag = '"' + hashlib.blake2b(data, digest_size=8).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=data, content_type='image/jpeg', headers={'ETag': etag})
+
+    async def stats(self, request):
+        return web.json_response({
+            'units_used': self.units_used,
+            'daily_quota': self.daily_quota,
+            'calls': dict(self.calls),
+            'errors': dict(self.errors)
+        })
+
+    async def reset_handler(self, request):
+        self.reset()
+        return web.json_response({'ok': True})
+
+
+async def start_server(api, host='127.0.0.1', port=DEFAULT_PORT):
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+async def load_test(api, n_channels, host, port):
+    """サーバーを起動し、一時DBに n_channels チャンネルを登録して収集を1回実行する"""
+    runner = await start_server(api, host, port)
+    # 本番のDBを汚さないよう、最初の接続の前に一時ファイルへ差し替える
+    db.path = os.path.join(tempfile.mkdtemp(prefix='youtube-load-'), 'load.db')
+    youtube = AsyncYouTubeClient('fake', base_url=f"http://{host}:{port}/youtube/v3")
+    try:
+        await db.run_write(apply_migrations)
+        channel_ids = [fake_channel_id(i) for i in range(n_channels)]
+        await asyncio.gather(*[add_tracked_channel(channel_id) for channel_id in channel_ids])
+
+        started = time.perf_counter()
+        try:
+            channel_stats, new_video_ids = await asyncio.gather(
+                collect_channel_stats(youtube, channel_ids),
+                discover_videos(youtube, channel_ids)
+            )
+            elapsed = time.perf_counter() - started
+            print(f"{len(channel_stats)}/{n_channels}チャンネル・新着動画{len(new_video_ids)}件を{elapsed:.2f}秒で収集しました")
+        except Exception as e:
+            print(f"❌ 収集が{time.perf_counter() - started:.2f}秒で失敗しました: {str(e)}")
+        print(f"API呼び出し: {dict(api.calls)} / 消費ユニット: {api.units_used} / エラー: {dict(api.errors)}")
+    finally:
+        await youtube.close()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ローカルで動く YouTube Data API の代わり')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--seed', type=int, default=0, help='合成データと注入するエラーのシード')
+    parser.add_argument('--daily-quota', type=int, default=10000, help='これを超えたら 403 quotaExceeded')
+    parser.add_argument('--latency-ms', type=float, default=0, help='応答までの遅延（ミリ秒）')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='遅延のばらつき（± ミリ秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='5xx を返す割合')
+    parser.add_argument('--quota-error-rate', type=float, default=0.0, help='403 quotaExceeded を返す割合')
+    parser.add_argument('--rate-limit', type=float, default=0, help='1秒あたりの呼び出し数の上限（超えたら 403 rateLimitExceeded）')
+    parser.add_argument('--max-videos', type=int, default=MAX_VIDEOS_PER_CHANNEL, help='1チャンネルの動画数の上限')
+    parser.add_argument('--public-url', help='サムネイルURLに使うこのサーバーのURL（既定はリクエストのホスト）')
+    parser.add_argument('--load-test', type=int, metavar='N', help='N チャンネル分の収集を計測して終了')
+    args = parser.parse_args()
+
+    api = FakeYouTubeAPI(
+        seed=args.seed,
+        daily_quota=args.daily_quota,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        quota_error_rate=args.quota_error_rate,
+        max_videos=args.max_videos,
+        public_url=args.public_url,
+        rate_limit=args.rate_limit
+    )
+    if args.load_test:
+        asyncio.run(load_test(api, args.load_test, args.host, args.port))
+        return 0
+
+    print(f"YouTube API の代わりを起動しました: http://{args.host}:{args.port}/youtube/v3")
+    print(f"例: YOUTUBE_API_BASE_URL=http://{args.host}:{args.port}/youtube/v3 "
+          f"THUMBNAIL_BASE_URL=http://{args.host}:{args.port}")
+    web.run_app(api.app(), host=args.host, port=args.port, print=None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
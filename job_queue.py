@@ -0,0 +1,247 @@
+import asyncio
+import json
+import traceback
+import uuid
+
+from database import db, now_ts
+from metrics import registry
+
+# 取り出したジョブを他のワーカーに渡さない時間（秒）。これを過ぎても終わらなければ、取り出し直せる
+LEASE_SECONDS = 600
+# この回数失敗したジョブは failed にして、それ以上やり直さない
+MAX_ATTEMPTS = 5
+# 失敗したジョブをやり直すまでの時間（秒）。失敗のたびに倍にする
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 3600
+# 取り出せるジョブがないときに、次に確認するまでの時間（秒）。登録されたときはすぐに起きる
+POLL_SECONDS = 5
+# ジョブの取り出し・結果の書き込みに失敗したときに待つ時間の上限（秒）。POLL_SECONDS から失敗のたびに倍にする
+WORKER_BACKOFF_MAX_SECONDS = 300
+# キューの長さをメトリクスに反映する間隔（秒）
+DEPTH_REPORT_SECONDS = 60
+
+QUEUE_JOBS = registry.counter('queue_jobs', '処理したジョブの件数（result: done / retry / failed）', ('kind', 'result'))
+QUEUE_BATCH_SECONDS = registry.histogram('queue_batch_seconds', 'ジョブ1バッチの処理時間', ('kind',))
+QUEUE_DEPTH = registry.gauge('queue_depth', '状態ごとのジョブの件数', ('kind', 'status'))
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+class JobKind:
+    """ジョブの種類ごとの設定
+
+    handler はジョブ（{'key', 'payload', 'attempts'} の辞書）のリストを受け取る async 関数で、
+    失敗したジョブの {key: エラーの説明} を返す（すべて成功なら None でよい）。例外を投げたらバッチ全体の失敗。
+    concurrency は同時に処理するバッチの数、batch_size は1回に取り出すジョブの数。
+    """
+
+    def __init__(self, name, handler, concurrency=1, batch_size=1, max_attempts=MAX_ATTEMPTS,
+                 lease_seconds=LEASE_SECONDS):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+
+class JobQueue:
+    """SQLite の job_queue テーブルを使うジョブキュー
+
+    - (kind, key) ごとに1件（key は動画IDなど）。処理済みのジョブを登録し直しても、もう一度は実行しない
+    - 優先度の高い順、同じなら古い順に取り出す
+    - 取り出したジョブにはリース（期限）を付け、期限が切れたら別のワーカーが取り出し直せる
+    - 失敗したジョブは間を空けてやり直し、max_attempts 回失敗したら failed にする
+    - テーブルに残るので、再起動後は続きから処理する
+    """
+
+    def __init__(self):
+        self.kinds = {}
+        self._tasks = []
+        self._wakeups = {}
+
+    @property
+    def running(self):
+        return any(not task.done() for task in self._tasks)
+
+    def register(self, name, handler, concurrency=1, batch_size=1, max_attempts=MAX_ATTEMPTS,
+                 lease_seconds=LEASE_SECONDS):
+        self.kinds[name] = JobKind(name, handler, concurrency, batch_size, max_attempts, lease_seconds)
+
+    async def enqueue(self, kind, keys, priority=0, payload=None, force=False):
+        """ジョブを登録し、新しく登録した（または優先度を上げた）件数を返す
+
+        登録済みで待機中のジョブは優先度だけ上げる。処理済み・失敗したジョブは force=True のときだけやり直す。
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return 0
+        ts = now_ts()
+        data = json.dumps(payload, ensure_ascii=False) if payload is not None else None
+        if force:
+            conflict = '''
+                DO UPDATE SET status = 'queued', attempts = 0, priority = excluded.priority,
+                    payload = excluded.payload, available_ts = excluded.available_ts,
+                    last_error = NULL, updated_ts = excluded.updated_ts
+                WHERE job_queue.status != 'running'
+            '''
+        else:
+            conflict = '''
+                DO UPDATE SET priority = excluded.priority, updated_ts = excluded.updated_ts
+                WHERE job_queue.status = 'queued' AND job_queue.priority < excluded.priority
+            '''
+        count = await db.executemany(f'''
+            INSERT INTO job_queue (kind, key, payload, priority, available_ts, created_ts, updated_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(kind, key) {conflict}
+        ''', [(kind, key, data, priority, ts, ts, ts) for key in keys])
+        wakeup = self._wakeups.get(kind)
+        if wakeup is not None:
+            wakeup.set()
+        return count
+
+    def _claim(self, c, kind):
+        """取り出せるジョブにリースを付けて返す（書き込みスレッドで呼ぶ）
+
+        リースのトークンは取り出すたびに作る。同じプロセスのワーカーどうしでも、期限切れの後に
+        別のワーカーが取り出し直したジョブの結果を、前のワーカーが書き込まないようにするため。
+        """
+        ts = now_ts()
+        lease = uuid.uuid4().hex
+        rows = c.execute('''
+            SELECT id, key, payload, attempts
+            FROM job_queue
+            WHERE kind = ? AND status IN ('queued', 'running') AND available_ts <= ?
+            ORDER BY priority DESC, available_ts, id
+            LIMIT ?
+        ''', (kind.name, ts, kind.batch_size)).fetchall()
+
+        jobs = []
+        for job_id, key, payload, attempts in rows:
+            if attempts >= kind.max_attempts:
+                # 実行中にプロセスが止まるなどして、リースが切れたまま回数を使い切ったジョブ
+                c.execute('''
+                    UPDATE job_queue SET status = 'failed', lease_owner = NULL, updated_ts = ? WHERE id = ?
+                ''', (ts, job_id))
+                QUEUE_JOBS.inc(kind=kind.name, result='failed')
+                continue
+            jobs.append({
+                'id': job_id,
+                'key': key,
+                'payload': json.loads(payload) if payload else None,
+                'attempts': attempts + 1,
+                'lease': lease
+            })
+        c.executemany('''
+            UPDATE job_queue
+            SET status = 'running', attempts = attempts + 1, available_ts = ?, lease_owner = ?, updated_ts = ?
+            WHERE id = ?
+        ''', [(ts + kind.lease_seconds, lease, ts, job['id']) for job in jobs])
+        return jobs
+
+    def _finish(self, c, kind, jobs, failures):
+        """結果を書き込む（取り出したときのリースのトークンが変わったジョブは書き込まない）"""
+        ts = now_ts()
+        done, retry, failed = [], [], []
+        for job in jobs:
+            error = failures.get(job['key'])
+            if error is None:
+                done.append((ts, job['id'], job['lease']))
+            elif job['attempts'] >= kind.max_attempts:
+                failed.append((error, ts, job['id'], job['lease']))
+            else:
+                retry.append((ts + retry_delay(job['attempts']), error, ts, job['id'], job['lease']))
+        c.executemany('''
+            UPDATE job_queue SET status = 'done', lease_owner = NULL, last_error = NULL, updated_ts = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', done)
+        c.executemany('''
+            UPDATE job_queue SET status = 'queued', available_ts = ?, lease_owner = NULL, last_error = ?, updated_ts = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', retry)
+        c.executemany('''
+            UPDATE job_queue SET status = 'failed', lease_owner = NULL, last_error = ?, updated_ts = ?
+            WHERE id = ? AND lease_owner = ?
+        ''', failed)
+        for result, items in (('done', done), ('retry', retry), ('failed', failed)):
+            if items:
+                QUEUE_JOBS.inc(len(items), kind=kind.name, result=result)
+        return len(done), len(retry), len(failed)
+
+    async def _run_batch(self, kind, jobs):
+        with QUEUE_BATCH_SECONDS.time(kind=kind.name):
+            try:
+                failures = await kind.handler(jobs) or {}
+            except Exception as e:
+                print(f"❌ ジョブ {kind.name} の処理でエラーが発生しました: {str(e)}")
+                traceback.print_exc()
+                failures = {job['key']: f"{type(e).__name__}: {str(e)}" for job in jobs}
+        return await db.run_write(lambda c: self._finish(c, kind, jobs, failures))
+
+    async def _worker(self, kind, wakeup):
+        failures = 0
+        while True:
+            # 取り出す前に合図を消しておき、その後に登録されたジョブを取りこぼさない
+            wakeup.clear()
+            try:
+                jobs = await db.run_write(lambda c: self._claim(c, kind))
+                if jobs:
+                    await self._run_batch(kind, jobs)
+                failures = 0
+            except Exception as e:
+                # DB が書き込めないなど。ワーカーは止めずに間を空けてやり直す（結果を書けなかったジョブはリースの期限後に再実行）
+                failures += 1
+                print(f"❌ ジョブ {kind.name} のワーカーでエラーが発生しました: {str(e)}")
+                traceback.print_exc()
+                await asyncio.sleep(min(WORKER_BACKOFF_MAX_SECONDS, POLL_SECONDS * 2 ** (failures - 1)))
+                continue
+            if not jobs:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def counts(self):
+        """{kind: {status: 件数}}"""
+        rows = await db.fetchall('SELECT kind, status, COUNT(*) FROM job_queue GROUP BY kind, status')
+        counts = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    async def _report_depth(self):
+        while True:
+            counts = await self.counts()
+            for kind in self.kinds:
+                for status in ('queued', 'running', 'done', 'failed'):
+                    QUEUE_DEPTH.set(counts.get(kind, {}).get(status, 0), kind=kind, status=status)
+            await asyncio.sleep(DEPTH_REPORT_SECONDS)
+
+    async def start(self):
+        """登録した種類ごとにワーカーを起動する（起動済みなら何もしない）"""
+        if self.running:
+            return
+        # 前回のプロセスが実行中のまま止まったジョブは、リースの期限を待たずにやり直す
+        resumed = await db.execute('''
+            UPDATE job_queue SET status = 'queued', available_ts = ?, lease_owner = NULL
+            WHERE status = 'running'
+        ''', (now_ts(),))
+        if resumed:
+            print(f"中断されていたジョブを{resumed}件再開します")
+        for kind in self.kinds.values():
+            wakeup = self._wakeups[kind.name] = asyncio.Event()
+            for _ in range(kind.concurrency):
+                self._tasks.append(asyncio.create_task(self._worker(kind, wakeup)))
+        self._tasks.append(asyncio.create_task(self._report_depth()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# プロセス内で共有するジョブキュー
+job_queue = JobQueue()
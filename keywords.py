@@ -0,0 +1,205 @@
+import re
+from collections import Counter
+from datetime import datetime, timezone
+
+from database import db
+from tokenizer import normalize, tokenize, tokenize_many
+
+# 1本のタイトルから集計に使うキーワードの数
+KEYWORDS_PER_TITLE = 5
+# IN 句1回あたりのIDの数
+LOOKUP_CHUNK_SIZE = 500
+
+# タイトルのパターン（正規化後のタイトルに対して使う）
+TITLE_PATTERNS = [
+    ('numbered_series', re.compile(r'#\d+')),
+    ('bracketed', re.compile(r'【.*】')),
+    ('duration_mentioned', re.compile(r'\d+分|分間')),
+]
+
+
+def _top_keywords(tokens, limit):
+    return [word for word, _ in Counter(tokens).most_common(limit)]
+
+
+def extract_keywords(title, limit=KEYWORDS_PER_TITLE):
+    """タイトルから出現回数の多い語を取り出す（同数なら先に出てきた語）"""
+    return _top_keywords(tokenize(title), limit)
+
+
+def extract_keywords_many(titles, limit=KEYWORDS_PER_TITLE):
+    return [_top_keywords(tokens, limit) for tokens in tokenize_many(titles)]
+
+
+def analyze_titles(titles):
+    """複数のタイトルのキーワードとパターンをまとめて分析"""
+    results = []
+    for title, keywords in zip(titles, extract_keywords_many(titles)):
+        normalized = normalize(title)
+        patterns = [name for name, pattern in TITLE_PATTERNS if pattern.search(normalized)]
+        results.append({
+            'keywords': keywords,
+            'pattern_type': ','.join(patterns) if patterns else 'standard',
+            'effectiveness_score': min(100, len(title) * 2),  # 仮のスコアリング
+            'keyword_scores': {word: 1.0 for word in keywords}  # 将来の分析のために
+        })
+    return results
+
+
+def month_of(ts):
+    """UNIX 時刻の年月（'2024-01'）。時刻がなければ現在の年月"""
+    if ts is None:
+        return datetime.now(timezone.utc).strftime('%Y-%m')
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m')
+
+
+def engagement_rate(views, likes, comments):
+    if not views:
+        return 0.0
+    return (likes + comments) / views * 100
+
+
+def _indexed_rows(c, video_ids):
+    """転置インデックスに登録済みの (keyword, month_year) → views, engagement_rate を動画ごとに取得"""
+    indexed = {}
+    for i in range(0, len(video_ids), LOOKUP_CHUNK_SIZE):
+        chunk = video_ids[i:i + LOOKUP_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        rows = c.execute(f'''
+            SELECT video_id, keyword, month_year, views, engagement_rate
+            FROM keyword_videos
+            WHERE video_id IN ({placeholders})
+        ''', chunk).fetchall()
+        for video_id, keyword, month_year, views, rate in rows:
+            indexed.setdefault(video_id, {})[(keyword, month_year)] = (views, rate)
+    return indexed
+
+
+def apply_keyword_updates(c, videos):
+    """動画のキーワードを転置インデックスと月別の集計にまとめて反映（書き込みスレッドで呼ぶ）
+
+    videos は video_id, keywords, views, likes, comments, published_ts を持つ dict のリスト。
+    登録済みの動画は前回の値との差分だけを集計に足すので、同じ動画を何度反映しても
+    use_count は重複せず、avg_views / avg_engagement は正しい平均のまま保たれる。
+    """
+    videos = list({v["video_id"]: v for v in videos}.values())
+    if not videos:
+        return 0
+    indexed = _indexed_rows(c, [v["video_id"] for v in videos])
+
+    deltas = {}    # (keyword, month_year) → [use_count, total_views, total_engagement]
+    upserts = []
+    removals = []
+    for video in videos:
+        month_year = month_of(video.get("published_ts"))
+        rate = engagement_rate(video["views"], video["likes"], video["comments"])
+        current = {(keyword, month_year) for keyword in video["keywords"]}
+        previous = indexed.get(video["video_id"], {})
+
+        for key in current:
+            old_views, old_rate = previous.get(key, (0, 0.0))
+            delta = deltas.setdefault(key, [0, 0, 0.0])
+            delta[0] += 0 if key in previous else 1
+            delta[1] += video["views"] - old_views
+            delta[2] += rate - old_rate
+            upserts.append((key[0], key[1], video["video_id"], video["views"], rate))
+
+        # タイトルが変わって使われなくなったキーワードは集計から引く
+        for key, (old_views, old_rate) in previous.items():
+            if key not in current:
+                delta = deltas.setdefault(key, [0, 0, 0.0])
+                delta[0] -= 1
+                delta[1] -= old_views
+                delta[2] -= old_rate
+                removals.append((key[0], key[1], video["video_id"]))
+
+    c.executemany('''
+        DELETE FROM keyword_videos WHERE keyword = ? AND month_year = ? AND video_id = ?
+    ''', removals)
+    c.executemany('''
+        INSERT INTO keyword_videos (keyword, month_year, video_id, views, engagement_rate)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(keyword, month_year, video_id) DO UPDATE SET
+            views = excluded.views,
+            engagement_rate = excluded.engagement_rate
+    ''', upserts)
+    c.executemany('''
+        INSERT INTO keyword_performance
+        (keyword, month_year, use_count, total_views, total_engagement, avg_views, avg_engagement)
+        VALUES (?1, ?2, ?3, ?4, ?5, ?4 * 1.0 / MAX(?3, 1), ?5 / MAX(?3, 1))
+        ON CONFLICT(keyword, month_year) DO UPDATE SET
+            use_count = use_count + excluded.use_count,
+            total_views = total_views + excluded.total_views,
+            total_engagement = total_engagement + excluded.total_engagement,
+            avg_views = (total_views + excluded.total_views) * 1.0
+                        / MAX(use_count + excluded.use_count, 1),
+            avg_engagement = (total_engagement + excluded.total_engagement)
+                             / MAX(use_count + excluded.use_count, 1)
+    ''', [(keyword, month_year, count, views, engagement)
+          for (keyword, month_year), (count, views, engagement) in deltas.items()])
+    c.execute('DELETE FROM keyword_performance WHERE use_count <= 0')
+    return len(deltas)
+
+
+async def update_keyword_performance(videos):
+    """apply_keyword_updates を1回の書き込みで実行"""
+    return await db.run_write(lambda c: apply_keyword_updates(c, videos))
+
+
+async def get_top_keywords(month_year=None, limit=10, order_by='total_views'):
+    """月別のキーワード集計を上位から取得（order_by は total_views / use_count / avg_engagement）"""
+    if order_by not in ('total_views', 'use_count', 'avg_engagement'):
+        raise ValueError(f"order_by に指定できない列です: {order_by}")
+    rows = await db.fetchall(f'''
+        SELECT keyword, use_count, total_views, avg_views, avg_engagement
+        FROM keyword_performance
+        WHERE month_year = ?
+        ORDER BY {order_by} DESC
+        LIMIT ?
+    ''', (month_year or month_of(None), limit))
+    return [{
+        "keyword": row[0],
+        "use_count": row[1],
+        "total_views": row[2],
+        "avg_views": round(row[3], 1),
+        "avg_engagement": round(row[4], 2)
+    } for row in rows]
+
+
+async def get_keyword_videos(keyword, month_year=None, limit=20):
+    """キーワードを含むタイトルの動画を再生数の多い順に取得"""
+    rows = await db.fetchall('''
+        SELECT video_id, views, engagement_rate
+        FROM keyword_videos
+        WHERE keyword = ? AND month_year = ?
+        ORDER BY views DESC
+        LIMIT ?
+    ''', (keyword, month_year or month_of(None), limit))
+    return [{"video_id": row[0], "views": row[1], "engagement_rate": round(row[2], 2)} for row in rows]
+
+
+def reindex_all_titles(c, batch_size=2000):
+    """保存済みの全動画のタイトルを分割し直し、キーワード集計に反映（書き込みスレッドで呼ぶ）"""
+    last_video_id = ''
+    total = 0
+    while True:
+        rows = c.execute('''
+            SELECT video_id, title, views, likes, comments, published_ts
+            FROM video_stats
+            WHERE video_id > ?
+            ORDER BY video_id
+            LIMIT ?
+        ''', (last_video_id, batch_size)).fetchall()
+        if not rows:
+            return total
+        keywords = extract_keywords_many([row[1] for row in rows])
+        apply_keyword_updates(c, [{
+            "video_id": row[0],
+            "keywords": words,
+            "views": row[2] or 0,
+            "likes": row[3] or 0,
+            "comments": row[4] or 0,
+            "published_ts": row[5]
+        } for row, words in zip(rows, keywords)])
+        total += len(rows)
+        last_video_id = rows[-1][0]
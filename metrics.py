@@ -0,0 +1,249 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 計測値の公開先（METRICS_PORT=0 で HTTP を、METRICS_JSONL= で JSON Lines を無効にする）
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+METRICS_JSONL = os.getenv('METRICS_JSONL', 'metrics.jsonl')
+METRICS_INTERVAL_SECONDS = int(os.getenv('METRICS_INTERVAL_SECONDS', '60'))
+# JSON Lines のファイルがこの大きさを超えたら <path>.1 に移して新しいファイルに書く（古い .1 は消える）
+METRICS_JSONL_MAX_BYTES = int(os.getenv('METRICS_JSONL_MAX_MB', '10')) * 1024 * 1024
+# メトリクス名の接頭辞
+PREFIX = 'youtube_bot_'
+# 処理時間（秒）のヒストグラムの区切り
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ラベルの値ごとに計測値を持つメトリクス（複数のスレッドから更新してよい）"""
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} のラベルは {self.labels} です: {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """(サフィックス, ラベルの値, 追加のラベル, 値) のリスト"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labels, values, extra)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(zip(self.labels, key)), 'value': value} for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [('_total', key, (), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    """値の分布（区切りごとの件数・合計・件数）"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with ブロックの処理時間（秒）を記録（中で await してよい）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), state['sum']))
+                samples.append(('_count', key, (), state['count']))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [{
+                'labels': dict(zip(self.labels, key)),
+                'count': state['count'],
+                'sum': round(state['sum'], 6),
+                'mean': round(state['sum'] / state['count'], 6) if state['count'] else 0.0,
+                'buckets': {_format_value(bound): count for bound, count in zip(self.buckets, state['counts']) if count}
+            } for key, state in self._values.items()]
+
+
+class MetricsRegistry:
+    """メトリクスの登録先。同じ名前で登録すると既存のものを返す"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._runner = None
+
+    def _register(self, cls, name, help, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in list(self._metrics.values())}
+
+    async def _serve(self, host, port):
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render_prometheus(), content_type='text/plain', charset='utf-8',
+                                headers={'X-Content-Type-Options': 'nosniff'})
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"メトリクスを公開しています: http://{host}:{port}/metrics")
+
+    async def _write_periodically(self, path, interval):
+        while True:
+            await asyncio.sleep(interval)
+            line = json.dumps({'ts': int(time.time()), 'metrics': self.snapshot()}, ensure_ascii=False)
+            try:
+                await asyncio.to_thread(self._append, path, line)
+            except OSError as e:
+                # ディスクがいっぱいなどで書けなくても、次の回にもう一度書く
+                print(f"⚠️ メトリクスを {path} に書き込めませんでした: {str(e)}")
+
+    @staticmethod
+    def _append(path, line, max_bytes=METRICS_JSONL_MAX_BYTES):
+        data = (line + '\n').encode('utf-8')
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if max_bytes and size and size + len(data) > max_bytes:
+            os.replace(path, path + '.1')
+        with open(path, 'ab') as f:
+            f.write(data)
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT, jsonl_path=METRICS_JSONL,
+                    interval=METRICS_INTERVAL_SECONDS):
+        """HTTP エンドポイントと JSON Lines の定期出力を始める（起動済みなら何もしない）"""
+        if self._runner is not None or self._tasks:
+            return False
+        if port:
+            try:
+                await self._serve(host, port)
+            except OSError as e:
+                print(f"⚠️ メトリクスのポート {port} を開けませんでした: {str(e)}")
+        if jsonl_path:
+            self._tasks.append(asyncio.create_task(self._write_periodically(jsonl_path, interval)))
+        return True
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# プロセス内で共有するメトリクス
+registry = MetricsRegistry()
@@ -0,0 +1,142 @@
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from database import db, now_ts
+from metrics import registry
+
+# YouTube Data API の1日あたりのクォータ（プロジェクトの上限に合わせて設定）
+DAILY_QUOTA = int(os.getenv('YOUTUBE_DAILY_QUOTA', '10000'))
+# この残量を下回ったら更新を止め、保存済みデータを使う
+QUOTA_RESERVE = int(os.getenv('YOUTUBE_QUOTA_RESERVE', '500'))
+# 時間配分を超えて一度に使ってよい量（1日の予算に対する割合）
+BURST_RATIO = 0.1
+# 1チャンネルあたり最近の動画の想定本数（videos.list の見積もりに使う）
+RECENT_VIDEOS_PER_CHANNEL = 10
+
+# メソッドごとのクォータコスト
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'channels.list': 1,
+    'videos.list': 1,
+    'playlistItems.list': 1,
+    'commentThreads.list': 1,
+    'search.list': 100
+}
+
+# クォータは太平洋時間の0時にリセットされる
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+QUOTA_UNITS = registry.counter('youtube_api_quota_units', '消費したクォータのユニット数', ('method',))
+
+
+def quota_cost(method):
+    return QUOTA_COSTS.get(method, 1)
+
+
+def quota_day_start(now=None):
+    """現在のクォータ日の開始時刻（UTC）"""
+    now = now or datetime.now(timezone.utc)
+    local = now.astimezone(QUOTA_TIMEZONE)
+    start = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.astimezone(timezone.utc)
+
+
+def record_api_call(method, latency_ms, result_items, status):
+    """API呼び出し1回分をクォータ台帳に記録（書き込みスレッドでまとめてコミット）"""
+    QUOTA_UNITS.inc(quota_cost(method), method=method)
+    db.submit_execute('''
+        INSERT INTO quota_ledger (ts, method, units, latency_ms, result_items, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (now_ts(), method, quota_cost(method), round(latency_ms, 1), result_items, status))
+
+
+async def get_quota_used(now=None):
+    """現在のクォータ日に使ったユニット数"""
+    since = int(quota_day_start(now).timestamp())
+    row = await db.fetchone('SELECT COALESCE(SUM(units), 0) FROM quota_ledger WHERE ts >= ?', (since,))
+    return row[0]
+
+
+async def get_quota_usage_by_method(now=None):
+    """メソッドごとの呼び出し回数・ユニット数・平均レイテンシ"""
+    since = int(quota_day_start(now).timestamp())
+    rows = await db.fetchall('''
+        SELECT method, COUNT(*), SUM(units), AVG(latency_ms)
+        FROM quota_ledger
+        WHERE ts >= ?
+        GROUP BY method
+        ORDER BY SUM(units) DESC
+    ''', (since,))
+    return [{
+        "method": row[0],
+        "calls": row[1],
+        "units": row[2],
+        "avg_latency_ms": round(row[3], 1)
+    } for row in rows]
+
+
+async def get_quota_status(now=None):
+    """クォータの使用状況（レポート表示用）"""
+    used = await get_quota_used(now)
+    remaining = max(0, DAILY_QUOTA - used)
+    return {
+        "budget": DAILY_QUOTA,
+        "used": used,
+        "remaining": remaining,
+        "degraded": remaining <= QUOTA_RESERVE
+    }
+
+
+def estimate_refresh_cost(n_channels):
+    """n チャンネルを更新するのに必要なユニット数の見積もり"""
+    if n_channels <= 0:
+        return 0
+    return (
+        math.ceil(n_channels / 50) +                                # channels.list
+        n_channels +                                                # playlistItems.list（1ページ）
+        math.ceil(n_channels * RECENT_VIDEOS_PER_CHANNEL / 50)      # videos.list
+    )
+
+
+async def get_refresh_allowance(now=None):
+    """今使ってよいユニット数
+
+    1日の予算を経過時間に比例して配分し、使い過ぎないようにする。
+    """
+    now = now or datetime.now(timezone.utc)
+    used = await get_quota_used(now)
+    elapsed = (now - quota_day_start(now)) / timedelta(days=1)
+    paced_budget = DAILY_QUOTA * min(1.0, elapsed + BURST_RATIO)
+    hard_limit = DAILY_QUOTA - QUOTA_RESERVE
+    return max(0, int(min(paced_budget, hard_limit) - used))
+
+
+async def select_channels_for_refresh(channel_ids, allowance, required=None):
+    """予算内で更新するチャンネルを、最後の同期が古い順に選ぶ
+
+    required（レポート対象など）は予算が足りる限り優先して含める。
+    """
+    if not channel_ids:
+        return []
+    placeholders = ','.join('?' * len(channel_ids))
+    rows = await db.fetchall(f'''
+        SELECT channel_id, last_synced_ts
+        FROM channel_sync_state
+        WHERE channel_id IN ({placeholders})
+    ''', list(channel_ids))
+    last_synced = dict(rows)
+
+    # 一度も同期していないチャンネルを最優先
+    ordered = sorted(channel_ids, key=lambda cid: last_synced.get(cid) or 0)
+    if required:
+        ordered = [cid for cid in required if cid in channel_ids] + \
+                  [cid for cid in ordered if cid not in required]
+
+    selected = []
+    for channel_id in ordered:
+        if estimate_refresh_cost(len(selected) + 1) > allowance:
+            break
+        selected.append(channel_id)
+    return selected
@@ -0,0 +1,244 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from metrics import registry
+
+# リトライの回数と待ち時間（指数バックオフ・フルジッター）
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+# 連続してこの回数失敗したら回路を開き、RESET_TIMEOUT 秒は呼び出さずに失敗させる
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+# レート制限を受けたときに下げる下限（上限に対する割合）と、成功のたびに戻す量（上限に対する割合）
+MIN_RATE_RATIO = 1 / 32
+RATE_STEP_RATIO = 1 / 100
+
+RETRIES = registry.counter('retries', 'リトライの回数（reason: throttled / error）', ('endpoint', 'reason'))
+CIRCUIT_OPEN = registry.gauge('circuit_open', '回路遮断器が開いているか（1: 開いている）', ('endpoint',))
+CIRCUIT_REJECTIONS = registry.counter('circuit_rejections', '回路が開いていたため呼び出さなかった回数', ('endpoint',))
+RATE_LIMIT = registry.gauge('rate_limit_per_second', 'トークンバケットの現在の補充レート', ('endpoint',))
+RATE_LIMIT_WAIT_SECONDS = registry.histogram(
+    'rate_limit_wait_seconds', 'トークンバケットとリトライで待った時間', ('endpoint', 'reason'))
+
+
+class CircuitOpenError(Exception):
+    """回路遮断器が開いているため呼び出さなかった場合の例外"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} は失敗が続いているため {retry_in:.0f}秒 呼び出しを止めています")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class RetryHint:
+    """リトライしてよい失敗の情報
+
+    throttled はレート制限による失敗（送信レートを下げる）、retry_after はサーバーが指定した待ち時間（秒）。
+    """
+
+    def __init__(self, throttled=False, retry_after=None):
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """Retry-After ヘッダー（秒数か HTTP の日付）を秒数に変換（なければ None）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=BASE_DELAY, maximum=MAX_DELAY):
+    """attempt 回目の失敗後に待つ秒数（0 から指数的に伸びる上限までの一様乱数）"""
+    return random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """補充レート rate（回/秒）・容量 capacity のトークンバケット
+
+    レート制限を受けたら slow_down でレートを半分にし、成功のたびに speed_up で少しずつ rate まで戻す
+    （AIMD）。これにより、サーバーが許す範囲でできるだけ速く送り続ける。
+    """
+
+    def __init__(self, rate, capacity=None, name=None):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate * MIN_RATE_RATIO
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self._report_rate()
+
+    def _report_rate(self):
+        if self.name:
+            RATE_LIMIT.set(round(self.rate, 3), endpoint=self.name)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """トークンを1つ取る（なければ補充されるまで待つ）。待った秒数を返す"""
+        started = time.monotonic()
+        # 待っている呼び出しは到着順に進める
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return time.monotonic() - started
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """seconds 秒のあいだ、すべての呼び出しを止める（Retry-After）"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def slow_down(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 1)
+        self._report_rate()
+
+    def speed_up(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_STEP_RATIO)
+            self._report_rate()
+
+
+class CircuitBreaker:
+    """連続して failure_threshold 回失敗したら reset_timeout 秒のあいだ呼び出しを止める
+
+    時間が過ぎたら1回だけ試し（半開）、成功すれば元に戻し、失敗すればまた止める。
+    """
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def check(self):
+        """呼び出してよいか確認する（止めているなら CircuitOpenError）"""
+        if self.state == 'closed':
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == 'open' and elapsed >= self.reset_timeout:
+            self.state = 'half_open'
+        if self.state == 'half_open' and not self._probing:
+            self._probing = True
+            return
+        CIRCUIT_REJECTIONS.inc(endpoint=self.name)
+        raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - elapsed))
+
+    def record_success(self):
+        if self.state != 'closed':
+            print(f"✅ {self.name} の呼び出しを再開しました")
+            CIRCUIT_OPEN.set(0, endpoint=self.name)
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                print(f"⚠️ {self.name} の失敗が続いたため {self.reset_timeout:.0f}秒 呼び出しを止めます")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self._probing = False
+            CIRCUIT_OPEN.set(1, endpoint=self.name)
+
+    def release(self):
+        """成功とも失敗とも数えない結果だったとき、半開の試行を終える"""
+        self._probing = False
+
+
+class Endpoint:
+    """1つの呼び出し先（API のメソッドなど）に対するレート制限・同時実行数・リトライ・回路遮断
+
+    classify(例外) はリトライしてよい失敗なら RetryHint を、そうでなければ None を返す。
+    None の失敗（404 や権限エラーなど）はそのまま呼び出し元に送り、回路遮断の失敗にも数えない。
+    """
+
+    def __init__(self, name, rate, classify, burst=None, concurrency=10, max_attempts=MAX_ATTEMPTS,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY, failure_threshold=FAILURE_THRESHOLD,
+                 reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.classify = classify
+        self.bucket = TokenBucket(rate, burst, name=name)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(self, func):
+        """func()（引数なしの async 関数）を実行し、リトライしてよい失敗なら待ってやり直す"""
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.check()
+            recorded = False
+            try:
+                waited = await self.bucket.acquire()
+                if waited > 0:
+                    RATE_LIMIT_WAIT_SECONDS.observe(waited, endpoint=self.name, reason='rate_limit')
+                try:
+                    async with self._semaphore:
+                        result = await func()
+                except Exception as e:
+                    hint = self.classify(e)
+                    if hint is None:
+                        raise
+                    if hint.throttled:
+                        # レート制限は呼び出し先の故障ではないので、回路遮断には数えずレートを下げる
+                        self.bucket.slow_down()
+                    else:
+                        self.breaker.record_failure()
+                        recorded = True
+                    if attempt >= self.max_attempts:
+                        raise
+                    delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                    if hint.retry_after is not None:
+                        delay = max(delay, hint.retry_after)
+                        self.bucket.pause(hint.retry_after)
+                    reason = 'throttled' if hint.throttled else 'error'
+                    RETRIES.inc(endpoint=self.name, reason=reason)
+                    RATE_LIMIT_WAIT_SECONDS.observe(delay, endpoint=self.name, reason=reason)
+                    print(f"⚠️ {self.name} が失敗しました（{attempt}/{self.max_attempts}回目）。"
+                          f"{delay:.1f}秒後にやり直します: {str(e)}")
+                else:
+                    self.breaker.record_success()
+                    recorded = True
+                    self.bucket.speed_up()
+                    return result
+            finally:
+                # 成功・失敗を記録しなかった（リトライしない失敗・レート制限・キャンセル）ときは半開の試行を終える。
+                # そうしないと、試行がキャンセルされたまま回路が開きっぱなしになる
+                if not recorded:
+                    self.breaker.release()
+            await asyncio.sleep(delay)
@@ -0,0 +1,230 @@
+import os
+
+from database import db, now_ts
+from metrics import registry
+
+HOUR = 3600
+DAY = 86400
+WEEK = 7 * DAY
+# 生データ（チャンネル統計・ランキング履歴・動画のスナップショット・クォータ台帳）をそのまま残す日数
+RETENTION_RAW_DAYS = int(os.getenv('RETENTION_RAW_DAYS', '30'))
+# 時間ごと・日ごとの集計を残す日数（週ごとの集計は削除しない）
+RETENTION_HOURLY_DAYS = int(os.getenv('RETENTION_HOURLY_DAYS', '90'))
+RETENTION_DAILY_DAYS = int(os.getenv('RETENTION_DAILY_DAYS', '730'))
+# 週は月曜日（UTC）から。1970-01-01 は木曜日なので、最初の月曜日は4日後
+WEEK_OFFSET = 4 * DAY
+
+# 集計の段階: (名前, 区間の長さ, 区間の起点, 集計元の段階（None はチャンネル統計の生データ）, 残す日数)
+TIERS = [
+    ('hour', HOUR, 0, None, RETENTION_HOURLY_DAYS),
+    ('day', DAY, 0, 'hour', RETENTION_DAILY_DAYS),
+    ('week', WEEK, WEEK_OFFSET, 'day', None),
+]
+METRICS = ('subscribers', 'views', 'videos')
+STAT_COLUMNS = [f"{metric}_{stat}" for metric in METRICS for stat in ('min', 'max', 'avg', 'last')]
+
+# 古い行を1日1件（その日の最後）に間引き、RETENTION_DAILY_DAYS を過ぎたら削除する表: (表, 行をまとめるキーの列)
+THINNED_TABLES = [
+    ('top_videos_history', 'channel_id'),
+    ('video_performance_metrics', 'video_id'),
+]
+
+ROLLUP_ROWS = registry.counter('rollup_rows', '書き込んだ集計（historical_trends）の行数', ('tier',))
+RETENTION_DELETED = registry.counter('retention_deleted_rows', '保持期間を過ぎて削除・間引いた行数', ('table',))
+DB_SIZE = registry.gauge('db_size_bytes', 'データベースファイルの大きさ（state: used / free）', ('state',))
+
+
+def bucket_start(ts, size, offset=0):
+    """ts を含む区間の始まり"""
+    return (ts - offset) // size * size + offset
+
+
+def _source_rows(c, source, since):
+    """集計元の行を (channel_id, ts, samples, 指標ごとの min/max/avg/last...) の形で古い順に読む"""
+    if source is None:
+        # 生データは1件 = 1サンプル（min = max = avg = last）
+        values = ', '.join(f"{metric}, {metric}, {metric}, {metric}" for metric in METRICS)
+        return c.execute(f'''
+            SELECT channel_id, ts, 1, {values}
+            FROM channel_stats
+            WHERE ts >= ?
+            ORDER BY channel_id, ts
+        ''', (since,)).fetchall()
+    return c.execute(f'''
+        SELECT channel_id, bucket_ts, samples, {', '.join(STAT_COLUMNS)}
+        FROM historical_trends
+        WHERE tier = ? AND bucket_ts >= ?
+        ORDER BY channel_id, bucket_ts
+    ''', (source, since)).fetchall()
+
+
+def aggregate(rows, size, offset, until):
+    """行を区間ごとにまとめる（until までに終わった区間だけ）
+
+    {(channel_id, 区間の始まり): [samples, [min, max, 合計, 件数, last] × 指標]} を返す。
+    平均はサンプル数で重み付けするので、時間 → 日 → 週と段階的にまとめても生データの平均と一致する。
+    """
+    buckets = {}
+    for row in rows:
+        start = bucket_start(row[1], size, offset)
+        if start + size > until:
+            continue
+        bucket = buckets.get((row[0], start))
+        if bucket is None:
+            bucket = buckets[(row[0], start)] = [0, [[None, None, 0.0, 0, None] for _ in METRICS]]
+        samples = row[2]
+        bucket[0] += samples
+        for i, stat in enumerate(bucket[1]):
+            low, high, avg, last = row[3 + i * 4:7 + i * 4]
+            if last is None:
+                # 非公開の登録者数など
+                continue
+            stat[0] = low if stat[0] is None else min(stat[0], low)
+            stat[1] = high if stat[1] is None else max(stat[1], high)
+            stat[2] += avg * samples
+            stat[3] += samples
+            stat[4] = last
+    return buckets
+
+
+def _previous_views(c, tier, channel_id, before):
+    row = c.execute('''
+        SELECT views_last FROM historical_trends
+        WHERE channel_id = ? AND tier = ? AND bucket_ts < ?
+        ORDER BY bucket_ts DESC
+        LIMIT 1
+    ''', (channel_id, tier, before)).fetchone()
+    return row[0] if row else None
+
+
+def rollup_tier(c, tier, size, offset, source, until):
+    """1つの段階の集計を作る（書き込みスレッドで呼ぶ）
+
+    前回作った最後の区間から作り直す（その区間の後に届いたデータも反映する）。書き込んだ行数を返す。
+    growth_rate は前の区間の最後の値からの総再生回数の増加率（%）。
+    """
+    since = c.execute('SELECT MAX(bucket_ts) FROM historical_trends WHERE tier = ?', (tier,)).fetchone()[0] or 0
+    buckets = aggregate(_source_rows(c, source, since), size, offset, until)
+
+    rows = []
+    previous = {}
+    ts = now_ts()
+    for (channel_id, start), (samples, stats) in sorted(buckets.items()):
+        if channel_id not in previous:
+            previous[channel_id] = _previous_views(c, tier, channel_id, start)
+        values = []
+        for low, high, total, count, last in stats:
+            values.extend((low, high, round(total / count, 1) if count else None, last))
+        views_last = stats[METRICS.index('views')][4]
+        prior = previous[channel_id]
+        growth = round((views_last - prior) / prior * 100, 4) if prior and views_last is not None else None
+        previous[channel_id] = views_last if views_last is not None else prior
+        rows.append((channel_id, tier, start, samples, *values, growth, ts))
+
+    c.executemany(f'''
+        INSERT OR REPLACE INTO historical_trends
+        (channel_id, tier, bucket_ts, samples, {', '.join(STAT_COLUMNS)}, growth_rate, updated_ts)
+        VALUES ({', '.join('?' * (len(STAT_COLUMNS) + 6))})
+    ''', rows)
+    ROLLUP_ROWS.inc(len(rows), tier=tier)
+    return len(rows)
+
+
+def _rolled_until(c, tier, size):
+    """集計済みの最後の区間の終わり（そこより前の集計元は削除してよい）"""
+    last = c.execute('SELECT MAX(bucket_ts) FROM historical_trends WHERE tier = ?', (tier,)).fetchone()[0]
+    return last + size if last is not None else 0
+
+
+def _thin_by_day(c, table, key, start, end):
+    """[start, end) の行を、キーと日（UTC）ごとに最後の1件（ts が同じ行はすべて）だけ残す"""
+    return c.execute(f'''
+        DELETE FROM {table}
+        WHERE ts >= ? AND ts < ?
+          AND ts < (
+              SELECT MAX(t.ts) FROM {table} t
+              WHERE t.{key} = {table}.{key}
+                AND t.ts >= {table}.ts / {DAY} * {DAY}
+                AND t.ts < {table}.ts / {DAY} * {DAY} + {DAY}
+          )
+    ''', (start, end)).rowcount
+
+
+def prune(c, now):
+    """保持期間を過ぎた行を削除・間引く（書き込みスレッドで、集計の後に呼ぶ）。表ごとの削除件数を返す"""
+    deleted = {}
+    raw_cutoff = bucket_start(now - RETENTION_RAW_DAYS * DAY, DAY)
+
+    # チャンネル統計は時間ごとの集計に入ったものだけ削除する（チャンネルごとの最新の1件は残す）
+    deleted['channel_stats'] = c.execute('''
+        DELETE FROM channel_stats
+        WHERE ts < ? AND ts < ?
+          AND ts < (SELECT MAX(cs.ts) FROM channel_stats cs WHERE cs.channel_id = channel_stats.channel_id)
+    ''', (raw_cutoff, _rolled_until(c, 'hour', HOUR))).rowcount
+
+    # 集計はひとつ上の段階に入ったものだけ削除する
+    for (tier, size, _, _, days), (upper, upper_size, _, _, _) in zip(TIERS, TIERS[1:]):
+        cutoff = min(now - days * DAY, _rolled_until(c, upper, upper_size))
+        deleted[f'historical_trends:{tier}'] = c.execute('''
+            DELETE FROM historical_trends WHERE tier = ? AND bucket_ts < ?
+        ''', (tier, cutoff)).rowcount
+
+    # ランキング履歴・動画のスナップショットは1日1件に間引く（前回の続きの日から）
+    for table, key in THINNED_TABLES:
+        row = c.execute('SELECT done_ts FROM retention_state WHERE name = ?', (table,)).fetchone()
+        start = row[0] if row else 0
+        if start < raw_cutoff:
+            deleted[table] = _thin_by_day(c, table, key, start, raw_cutoff)
+            c.execute('''
+                INSERT OR REPLACE INTO retention_state (name, done_ts) VALUES (?, ?)
+            ''', (table, raw_cutoff))
+
+    # 間引いた後も1日1件ずつ増え続けるので、日ごとの集計と同じ日数を過ぎたら削除する
+    daily_cutoff = bucket_start(now - RETENTION_DAILY_DAYS * DAY, DAY)
+    for table, _ in THINNED_TABLES:
+        deleted[f'{table}:expired'] = c.execute(f'DELETE FROM {table} WHERE ts < ?', (daily_cutoff,)).rowcount
+
+    # クォータ台帳は当日分の集計にしか使わない
+    deleted['quota_ledger'] = c.execute('DELETE FROM quota_ledger WHERE ts < ?', (raw_cutoff,)).rowcount
+
+    for table, count in deleted.items():
+        if count:
+            RETENTION_DELETED.inc(count, table=table)
+    return deleted
+
+
+def vacuum(c):
+    """空きページをファイルから返す（トランザクションの外で呼ぶ）
+
+    auto_vacuum が INCREMENTAL でない既存の DB は、1回だけ VACUUM で作り直して切り替える。
+    """
+    converted = c.execute('PRAGMA auto_vacuum').fetchone()[0] != 2
+    if converted:
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        c.execute('VACUUM')
+    freed = c.execute('PRAGMA freelist_count').fetchone()[0]
+    c.execute('PRAGMA incremental_vacuum').fetchall()
+    # WAL ファイルも切り詰める
+    c.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    page_size = c.execute('PRAGMA page_size').fetchone()[0]
+    pages = c.execute('PRAGMA page_count').fetchone()[0]
+    free = c.execute('PRAGMA freelist_count').fetchone()[0]
+    DB_SIZE.set((pages - free) * page_size, state='used')
+    DB_SIZE.set(free * page_size, state='free')
+    return {'converted': converted, 'freed_pages': freed, 'size': pages * page_size}
+
+
+async def run_retention():
+    """時間 → 日 → 週の集計を更新し、保持期間を過ぎた生データを削除して DB を縮める（夜間処理から呼ぶ）"""
+    now = now_ts()
+    rolled = {}
+    for tier, size, offset, source, _ in TIERS:
+        rolled[tier] = await db.run_write(
+            lambda c, tier=tier, size=size, offset=offset, source=source: rollup_tier(c, tier, size, offset, source, now)
+        )
+    deleted = await db.run_write(lambda c: prune(c, now))
+    result = await db.run_maintenance(vacuum)
+    print(f"集計: {', '.join(f'{tier} {count}件' for tier, count in rolled.items())} / "
+          f"削除: {sum(deleted.values())}件 / DB {result['size'] / 1024 / 1024:.1f}MB"
+          f"（空きページ {result['freed_pages']}件を解放{'・INCREMENTAL に切り替え' if result['converted'] else ''}）")
+    return {'rolled': rolled, 'deleted': deleted, **result}
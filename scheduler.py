@@ -0,0 +1,172 @@
+import asyncio
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from database import db, now_ts
+from metrics import registry
+
+# 時計の変更やスリープ復帰に気づけるよう、1回の待機はこの秒数までにする
+MAX_SLEEP_SECONDS = 3600
+
+JOB_SECONDS = registry.histogram('job_seconds', '定期実行ジョブの処理時間', ('job', 'status'))
+
+
+class Job:
+    """定期実行するジョブ
+
+    times（'HH:MM' のリスト、ローカル時刻）か interval（timedelta）のどちらかで実行時刻を決める。
+    """
+
+    def __init__(self, name, func, times=None, interval=None, catch_up=True):
+        self.name = name
+        self.func = func
+        self.times = sorted(datetime.strptime(t, '%H:%M').time() for t in (times or []))
+        self.interval = interval
+        self.catch_up = catch_up
+        self.last_run_ts = None
+        self.next_run = None
+        self.task = None
+
+    def previous_due(self, now):
+        """now 以前で直近の予定時刻（times で指定したジョブ用）"""
+        for days_ago in (0, 1):
+            day = (now - timedelta(days=days_ago)).date()
+            for t in reversed(self.times):
+                due = datetime.combine(day, t)
+                if due <= now:
+                    return due
+        return None
+
+    def following_due(self, now):
+        """now より後で最初の予定時刻"""
+        if self.interval:
+            base = datetime.fromtimestamp(self.last_run_ts) if self.last_run_ts else now
+            return max(base + self.interval, now)
+        for days_ahead in (0, 1):
+            day = (now + timedelta(days=days_ahead)).date()
+            for t in self.times:
+                due = datetime.combine(day, t)
+                if due > now:
+                    return due
+        return None
+
+    def schedule_next(self, now, startup=False):
+        """次の実行時刻を決める
+
+        起動時は、停止中に逃した実行があればすぐに1回だけ実行する（何回分逃しても1回）。
+        """
+        if startup and self.catch_up:
+            if self.interval:
+                missed = (self.last_run_ts is None
+                          or now.timestamp() - self.last_run_ts >= self.interval.total_seconds())
+            else:
+                due = self.previous_due(now)
+                missed = due is not None and self.last_run_ts is not None and self.last_run_ts < due.timestamp()
+            if missed:
+                self.next_run = now
+                return
+        self.next_run = self.following_due(now)
+
+
+class Scheduler:
+    """asyncio 上で動くジョブスケジューラ
+
+    次の予定時刻まで眠り、時刻が来たジョブをタスクとして実行する。
+    最終実行時刻は scheduler_runs テーブルに保存し、再起動後に逃した実行を取り戻す。
+    ジョブは start() の前に登録すること。start() を何度呼んでも、プロセス内で動くループは1つだけ。
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def add_daily(self, name, times, func, catch_up=True):
+        self.jobs[name] = Job(name, func, times=times, catch_up=catch_up)
+
+    def add_interval(self, name, minutes, func, catch_up=True):
+        self.jobs[name] = Job(name, func, interval=timedelta(minutes=minutes), catch_up=catch_up)
+
+    async def _load_last_runs(self):
+        rows = await db.fetchall('SELECT job, last_run_ts FROM scheduler_runs')
+        last_runs = dict(rows)
+        for job in self.jobs.values():
+            job.last_run_ts = last_runs.get(job.name)
+
+    async def run_job(self, name):
+        """ジョブを1回実行し、所要時間と結果を記録する"""
+        job = self.jobs[name]
+        started_ts = now_ts()
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            await job.func()
+        except Exception as e:
+            status = f"error: {type(e).__name__}"
+            print(f"❌ ジョブ {name} でエラーが発生しました: {str(e)}")
+            traceback.print_exc()
+        duration_ms = (time.perf_counter() - started) * 1000
+        JOB_SECONDS.observe(duration_ms / 1000, job=name, status='ok' if status == 'ok' else 'error')
+        job.last_run_ts = started_ts
+        print(f"ジョブ {name} を実行しました（{duration_ms / 1000:.1f}秒・{status}）")
+
+        await db.execute('''
+            INSERT INTO scheduler_runs (job, last_run_ts, last_duration_ms, last_status, run_count)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT(job) DO UPDATE SET
+                last_run_ts = excluded.last_run_ts,
+                last_duration_ms = excluded.last_duration_ms,
+                last_status = excluded.last_status,
+                run_count = scheduler_runs.run_count + 1
+        ''', (name, started_ts, round(duration_ms, 1), status))
+        return status
+
+    def _dispatch(self, job, now):
+        if job.task is not None and not job.task.done():
+            print(f"ジョブ {job.name} は前回の実行が終わっていないためスキップします")
+        else:
+            job.task = asyncio.create_task(self.run_job(job.name))
+        job.next_run = job.following_due(now) if job.times else now + job.interval
+
+    async def _loop(self):
+        await self._load_last_runs()
+        now = datetime.now()
+        for job in self.jobs.values():
+            job.schedule_next(now, startup=True)
+
+        while True:
+            now = datetime.now()
+            for job in self.jobs.values():
+                if job.next_run is not None and job.next_run <= now:
+                    self._dispatch(job, now)
+
+            # 次の予定時刻まで眠る
+            upcoming = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+            delay = MAX_SLEEP_SECONDS
+            if upcoming:
+                delay = min(delay, max(0.0, (min(upcoming) - datetime.now()).total_seconds()))
+            await asyncio.sleep(delay)
+
+    def start(self):
+        """スケジューラを起動する（起動済みなら何もしない）"""
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._loop())
+        return True
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+
+# プロセス内で共有するスケジューラ
+scheduler = Scheduler()
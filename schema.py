@@ -0,0 +1,662 @@
+import os
+
+from cadence import rebuild_all_cadence
+from database import to_epoch
+from keywords import reindex_all_titles
+
+# スキーマのバージョンは PRAGMA user_version で管理する。
+# MIGRATIONS の i 番目（0 始まり）を適用するとバージョン i+1 になる。
+# 既存のマイグレーションは書き換えず、変更は末尾に追加すること。
+
+
+def add_column_if_missing(c, table, column, definition):
+    """既存のテーブルに列がなければ追加する"""
+    columns = [row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def migrate_initial_schema(c):
+    """バージョン管理導入前のスキーマ（既存DBでは何もしない）"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS channel_stats (
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            subscribers INTEGER,
+            views INTEGER,
+            videos INTEGER
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS video_stats (
+            video_id TEXT PRIMARY KEY,
+            title TEXT,
+            published_at DATETIME,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS channel_info (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT,
+            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS top_videos_cache (
+            last_updated DATETIME,
+            video_data TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS top_videos_history (
+            video_id TEXT,
+            rank INTEGER,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (video_id, timestamp)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS video_performance_metrics (
+            video_id TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            engagement_rate REAL,
+            views_per_hour REAL,
+            PRIMARY KEY (video_id, timestamp)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS content_analysis (
+            video_id TEXT PRIMARY KEY,
+            title_keywords TEXT,
+            video_length INTEGER,
+            upload_hour INTEGER,
+            day_of_week INTEGER,
+            category_id TEXT,
+            performance_score REAL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS historical_trends (
+            date DATE,
+            avg_views INTEGER,
+            avg_likes INTEGER,
+            avg_comments INTEGER,
+            total_videos INTEGER,
+            growth_rate REAL,
+            PRIMARY KEY (date)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS thumbnail_analysis (
+            video_id TEXT PRIMARY KEY,
+            analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            dominant_colors TEXT,  -- JSON形式で色情報を保存
+            text_placement TEXT,   -- テキスト配置位置
+            composition_score REAL,
+            impact_score REAL,
+            template_type TEXT,
+            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS title_analysis (
+            video_id TEXT PRIMARY KEY,
+            analyzed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            keywords TEXT,         -- JSON形式でキーワードリストを保存
+            keyword_scores TEXT,   -- JSON形式でキーワードごとのスコアを保存
+            pattern_type TEXT,     -- タイトルパターンの分類
+            effectiveness_score REAL,
+            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS keyword_performance (
+            keyword TEXT,
+            month_year TEXT,
+            use_count INTEGER,
+            avg_views REAL,
+            avg_engagement REAL,
+            PRIMARY KEY (keyword, month_year)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS channel_sync_state (
+            channel_id TEXT PRIMARY KEY,
+            last_video_id TEXT,
+            last_published_at DATETIME,
+            last_synced_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS quota_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            method TEXT,
+            units INTEGER,
+            latency_ms REAL,
+            result_items INTEGER,
+            status INTEGER
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_quota_ledger_timestamp ON quota_ledger (timestamp)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tracked_channels (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT,
+            uploads_playlist_id TEXT,
+            active INTEGER DEFAULT 1,
+            added_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # 複数チャンネル対応のため、統計テーブルにチャンネルIDを追加
+    add_column_if_missing(c, 'channel_stats', 'channel_id', 'TEXT')
+    add_column_if_missing(c, 'video_stats', 'channel_id', 'TEXT')
+    rival_channel_id = os.getenv('RIVAL_CHANNEL_ID')
+    if rival_channel_id:
+        # 単一チャンネル時代のデータは RIVAL_CHANNEL_ID のものとして扱う
+        c.execute('UPDATE channel_stats SET channel_id = ? WHERE channel_id IS NULL', (rival_channel_id,))
+        c.execute('UPDATE video_stats SET channel_id = ? WHERE channel_id IS NULL', (rival_channel_id,))
+
+
+def _to_epoch_or_none(value):
+    try:
+        return to_epoch(value)
+    except ValueError:
+        return None
+
+
+def migrate_epoch_timestamps(c):
+    """時系列テーブルを (channel_id, UNIX時刻) をキーとする形に作り直す
+
+    TEXT の時刻（ローカル時刻と UTC が混在）を整数の UNIX 時刻（秒）に変換し、
+    「ある時刻以前の最新行」をインデックスのシークで引けるようにする。
+    """
+    # チャンネル統計: (channel_id, ts) のクラスタ化キー
+    c.execute('''
+        CREATE TABLE channel_stats_new (
+            channel_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            subscribers INTEGER,
+            views INTEGER,
+            videos INTEGER,
+            PRIMARY KEY (channel_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO channel_stats_new (channel_id, ts, subscribers, views, videos)
+        SELECT COALESCE(channel_id, ''), to_epoch(timestamp), subscribers, views, videos
+        FROM channel_stats
+        WHERE to_epoch(timestamp) IS NOT NULL
+        ORDER BY rowid
+    ''')
+    c.execute('DROP TABLE channel_stats')
+    c.execute('ALTER TABLE channel_stats_new RENAME TO channel_stats')
+
+    # 動画統計: チャンネル×公開日時のインデックス
+    c.execute('''
+        CREATE TABLE video_stats_new (
+            video_id TEXT PRIMARY KEY,
+            channel_id TEXT,
+            title TEXT,
+            published_ts INTEGER,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            updated_ts INTEGER
+        )
+    ''')
+    c.execute('''
+        INSERT INTO video_stats_new
+        (video_id, channel_id, title, published_ts, views, likes, comments, updated_ts)
+        SELECT video_id, channel_id, title, to_epoch(published_at), views, likes, comments,
+               to_epoch(last_updated)
+        FROM video_stats
+        WHERE video_id IS NOT NULL
+    ''')
+    c.execute('DROP TABLE video_stats')
+    c.execute('ALTER TABLE video_stats_new RENAME TO video_stats')
+    c.execute('CREATE INDEX idx_video_stats_channel_published ON video_stats (channel_id, published_ts)')
+
+    # ランキング履歴: チャンネルごとに (ts, rank) で引けるようにする
+    c.execute('''
+        CREATE TABLE top_videos_history_new (
+            channel_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            video_id TEXT,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            PRIMARY KEY (channel_id, ts, rank)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO top_videos_history_new
+        (channel_id, ts, rank, video_id, views, likes, comments)
+        SELECT COALESCE(vs.channel_id, ''), to_epoch(h.timestamp), h.rank, h.video_id,
+               h.views, h.likes, h.comments
+        FROM top_videos_history h
+        LEFT JOIN video_stats vs ON vs.video_id = h.video_id
+        WHERE to_epoch(h.timestamp) IS NOT NULL
+    ''')
+    c.execute('DROP TABLE top_videos_history')
+    c.execute('ALTER TABLE top_videos_history_new RENAME TO top_videos_history')
+
+    # 動画ごとのスナップショット
+    c.execute('''
+        CREATE TABLE video_performance_metrics_new (
+            video_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            engagement_rate REAL,
+            views_per_hour REAL,
+            PRIMARY KEY (video_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        INSERT OR REPLACE INTO video_performance_metrics_new
+        SELECT video_id, to_epoch(timestamp), views, likes, comments, engagement_rate, views_per_hour
+        FROM video_performance_metrics
+        WHERE video_id IS NOT NULL AND to_epoch(timestamp) IS NOT NULL
+    ''')
+    c.execute('DROP TABLE video_performance_metrics')
+    c.execute('ALTER TABLE video_performance_metrics_new RENAME TO video_performance_metrics')
+
+    # クォータ台帳
+    c.execute('''
+        CREATE TABLE quota_ledger_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts INTEGER NOT NULL,
+            method TEXT,
+            units INTEGER,
+            latency_ms REAL,
+            result_items INTEGER,
+            status INTEGER
+        )
+    ''')
+    c.execute('''
+        INSERT INTO quota_ledger_new (id, ts, method, units, latency_ms, result_items, status)
+        SELECT id, COALESCE(to_epoch(timestamp), 0), method, units, latency_ms, result_items, status
+        FROM quota_ledger
+    ''')
+    c.execute('DROP TABLE quota_ledger')
+    c.execute('ALTER TABLE quota_ledger_new RENAME TO quota_ledger')
+    c.execute('CREATE INDEX idx_quota_ledger_ts ON quota_ledger (ts)')
+
+    # チャンネル名キャッシュ・同期カーソル
+    c.execute('''
+        CREATE TABLE channel_info_new (
+            channel_id TEXT PRIMARY KEY,
+            channel_name TEXT,
+            updated_ts INTEGER
+        )
+    ''')
+    c.execute('''
+        INSERT INTO channel_info_new (channel_id, channel_name, updated_ts)
+        SELECT channel_id, channel_name, to_epoch(last_updated)
+        FROM channel_info
+    ''')
+    c.execute('DROP TABLE channel_info')
+    c.execute('ALTER TABLE channel_info_new RENAME TO channel_info')
+
+    c.execute('''
+        CREATE TABLE channel_sync_state_new (
+            channel_id TEXT PRIMARY KEY,
+            last_video_id TEXT,
+            last_published_ts INTEGER,
+            last_synced_ts INTEGER
+        )
+    ''')
+    c.execute('''
+        INSERT INTO channel_sync_state_new (channel_id, last_video_id, last_published_ts, last_synced_ts)
+        SELECT channel_id, last_video_id, to_epoch(last_published_at), to_epoch(last_synced_at)
+        FROM channel_sync_state
+    ''')
+    c.execute('DROP TABLE channel_sync_state')
+    c.execute('ALTER TABLE channel_sync_state_new RENAME TO channel_sync_state')
+
+
+def migrate_compact_video_metrics(c):
+    """動画スナップショットを整数だけの行にする
+
+    エンゲージメント率は 0.01% 単位（basis point）、時間あたり再生数は四捨五入した整数で保存する。
+    SQLite は小さな整数を 1〜4 バイトで格納するため、REAL（8 バイト）より行が小さくなる。
+    """
+    c.execute('''
+        CREATE TABLE video_performance_metrics_new (
+            video_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            views INTEGER,
+            likes INTEGER,
+            comments INTEGER,
+            engagement_bp INTEGER,
+            views_per_hour INTEGER,
+            PRIMARY KEY (video_id, ts)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        INSERT INTO video_performance_metrics_new
+        SELECT video_id, ts, views, likes, comments,
+               CAST(ROUND(engagement_rate * 100) AS INTEGER),
+               CAST(ROUND(views_per_hour) AS INTEGER)
+        FROM video_performance_metrics
+    ''')
+    c.execute('DROP TABLE video_performance_metrics')
+    c.execute('ALTER TABLE video_performance_metrics_new RENAME TO video_performance_metrics')
+
+
+def migrate_thumbnail_content_hash(c):
+    """サムネイル分析に画像のコンテンツハッシュを持たせ、同じ画像の再分析を省けるようにする"""
+    c.execute('''
+        CREATE TABLE thumbnail_analysis_new (
+            video_id TEXT PRIMARY KEY,
+            content_hash TEXT,
+            analyzed_ts INTEGER,
+            dominant_colors TEXT,  -- JSON形式で色情報を保存
+            text_placement TEXT,   -- テキスト配置位置
+            composition_score REAL,
+            impact_score REAL,
+            template_type TEXT
+        )
+    ''')
+    c.execute('''
+        INSERT INTO thumbnail_analysis_new
+        (video_id, analyzed_ts, dominant_colors, text_placement, composition_score, impact_score, template_type)
+        SELECT video_id, to_epoch(COALESCE(last_updated, analyzed_at)), dominant_colors, text_placement,
+               composition_score, impact_score, template_type
+        FROM thumbnail_analysis
+    ''')
+    c.execute('DROP TABLE thumbnail_analysis')
+    c.execute('ALTER TABLE thumbnail_analysis_new RENAME TO thumbnail_analysis')
+    c.execute('CREATE INDEX idx_thumbnail_analysis_hash ON thumbnail_analysis (content_hash)')
+
+
+def migrate_thumbnail_cache(c):
+    """サムネイル画像のディスクキャッシュの索引（URL → コンテンツハッシュ・ETag・最終アクセス）"""
+    c.execute('''
+        CREATE TABLE thumbnail_cache (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            size INTEGER,
+            accessed_ts INTEGER
+        )
+    ''')
+    c.execute('CREATE INDEX idx_thumbnail_cache_hash ON thumbnail_cache (content_hash)')
+
+
+def migrate_keyword_index(c):
+    """キーワード集計を累計値（合計・件数）で持ち、キーワード → 動画の転置インデックスを追加
+
+    旧テーブルの avg_views は最後の動画の再生数で上書きされていたため引き継がず、
+    title_analysis に保存済みのキーワードと video_stats の現在の値から作り直す。
+    """
+    c.execute('''
+        CREATE TABLE keyword_videos (
+            keyword TEXT NOT NULL,
+            month_year TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            views INTEGER,
+            engagement_rate REAL,
+            PRIMARY KEY (keyword, month_year, video_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX idx_keyword_videos_video ON keyword_videos (video_id)')
+    c.execute('''
+        INSERT OR IGNORE INTO keyword_videos (keyword, month_year, video_id, views, engagement_rate)
+        SELECT k.value, strftime('%Y-%m', COALESCE(vs.published_ts, to_epoch(ta.analyzed_at)), 'unixepoch'),
+               ta.video_id, COALESCE(vs.views, 0),
+               CASE WHEN vs.views > 0 THEN (vs.likes + vs.comments) * 100.0 / vs.views ELSE 0 END
+        FROM title_analysis ta
+        JOIN json_each(ta.keywords) k
+        LEFT JOIN video_stats vs ON vs.video_id = ta.video_id
+        WHERE json_valid(ta.keywords)
+    ''')
+
+    c.execute('DROP TABLE keyword_performance')
+    c.execute('''
+        CREATE TABLE keyword_performance (
+            keyword TEXT NOT NULL,
+            month_year TEXT NOT NULL,
+            use_count INTEGER NOT NULL DEFAULT 0,
+            total_views INTEGER NOT NULL DEFAULT 0,
+            total_engagement REAL NOT NULL DEFAULT 0,
+            avg_views REAL,
+            avg_engagement REAL,
+            PRIMARY KEY (keyword, month_year)
+        )
+    ''')
+    c.execute('CREATE INDEX idx_keyword_performance_views ON keyword_performance (month_year, total_views)')
+    c.execute('''
+        INSERT INTO keyword_performance
+        (keyword, month_year, use_count, total_views, total_engagement, avg_views, avg_engagement)
+        SELECT keyword, month_year, COUNT(*), SUM(views), SUM(engagement_rate), AVG(views), AVG(engagement_rate)
+        FROM keyword_videos
+        GROUP BY keyword, month_year
+    ''')
+
+
+def migrate_retokenize_titles(c):
+    """日本語のタイトルを文字種の境界で分割し直し、キーワード集計を更新する"""
+    reindex_all_titles(c)
+
+
+def migrate_scheduler_runs(c):
+    """定期実行ジョブの最終実行時刻・所要時間（再起動後に逃した実行を取り戻すため）"""
+    c.execute('''
+        CREATE TABLE scheduler_runs (
+            job TEXT PRIMARY KEY,
+            last_run_ts INTEGER,
+            last_duration_ms REAL,
+            last_status TEXT,
+            run_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def migrate_cache_entries(c):
+    """キャッシュの SQLite 層（top_videos_cache の JSON はこちらに統合）"""
+    c.execute('''
+        CREATE TABLE cache_entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_ts INTEGER NOT NULL,
+            ttl INTEGER NOT NULL,
+            stale_ttl INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute('DROP TABLE IF EXISTS top_videos_cache')
+
+
+def migrate_job_queue(c):
+    """分析ジョブのキュー（再起動しても残る）
+
+    (kind, key) が一意なので、同じ動画の同じ分析は何度登録しても1件になる。
+    available_ts は次に取り出せる時刻で、実行中はリース期限、失敗後は再試行の時刻を表す。
+    """
+    c.execute('''
+        CREATE TABLE job_queue (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_ts INTEGER NOT NULL,
+            lease_owner TEXT,
+            last_error TEXT,
+            created_ts INTEGER NOT NULL,
+            updated_ts INTEGER NOT NULL,
+            UNIQUE (kind, key)
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX idx_job_queue_ready ON job_queue (kind, status, priority DESC, available_ts)
+    ''')
+
+
+def migrate_comments(c):
+    """コメントの取り込み（本文は保存せず、ID・時刻・件数と語の集計だけを残す）"""
+    c.execute('''
+        CREATE TABLE video_comments (
+            video_id TEXT NOT NULL,
+            comment_id TEXT NOT NULL,
+            published_ts INTEGER,
+            likes INTEGER,
+            replies INTEGER,
+            PRIMARY KEY (video_id, comment_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX idx_video_comments_published ON video_comments (video_id, published_ts)')
+    # 語ごとの、その語を含むコメントの数
+    c.execute('''
+        CREATE TABLE comment_terms (
+            video_id TEXT NOT NULL,
+            term TEXT NOT NULL,
+            comments INTEGER NOT NULL,
+            PRIMARY KEY (video_id, term)
+        ) WITHOUT ROWID
+    ''')
+    # page_token は取り込み途中のページ（再開用）、synced_ts はこの時刻までのコメントを取り込み済み
+    c.execute('''
+        CREATE TABLE comment_sync_state (
+            video_id TEXT PRIMARY KEY,
+            page_token TEXT,
+            pass_newest_ts INTEGER,
+            synced_ts INTEGER,
+            threads INTEGER NOT NULL DEFAULT 0,
+            replies INTEGER NOT NULL DEFAULT 0,
+            disabled INTEGER NOT NULL DEFAULT 0,
+            updated_ts INTEGER
+        )
+    ''')
+
+
+def migrate_thumbnail_phash(c):
+    """サムネイル分析に知覚ハッシュ（似た画像の検索・テンプレートの判定に使う）を持たせる"""
+    add_column_if_missing(c, 'thumbnail_analysis', 'phash', 'INTEGER')
+    c.execute('CREATE INDEX idx_thumbnail_analysis_template ON thumbnail_analysis (template_type)')
+    # 分析済みの動画もハッシュを求めるために分析し直す（画像はキャッシュにあればダウンロードしない）
+    c.execute('''
+        UPDATE job_queue SET status = 'queued', attempts = 0, last_error = NULL
+        WHERE kind = 'thumbnail' AND status = 'done'
+    ''')
+
+
+def migrate_posting_cadence(c):
+    """チャンネルごとの投稿ペースのモデル（新しい動画のたびに更新し、レポートでは1行読むだけにする）"""
+    c.execute('''
+        CREATE TABLE posting_cadence (
+            channel_id TEXT PRIMARY KEY,
+            video_count INTEGER NOT NULL,
+            first_published_ts INTEGER,
+            last_published_ts INTEGER,
+            recent_intervals TEXT NOT NULL,  -- 直近の投稿間隔（秒）の JSON 配列（古い順）
+            slot_counts TEXT NOT NULL,       -- 曜日×時間帯（UTC）ごとの投稿数の JSON 配列（168件）
+            mean_interval INTEGER,
+            median_interval INTEGER,
+            next_expected_ts INTEGER,
+            updated_ts INTEGER
+        )
+    ''')
+    rebuild_all_cadence(c)
+
+
+def migrate_historical_trends(c):
+    """チャンネル統計の時間・日・週ごとの集計（生データは保持期間を過ぎたら削除する）
+
+    以前の historical_trends（チャンネルを区別しない日ごとの表）は書き込まれていなかったので作り直す。
+    """
+    c.execute('DROP TABLE IF EXISTS historical_trends')
+    c.execute('''
+        CREATE TABLE historical_trends (
+            channel_id TEXT NOT NULL,
+            tier TEXT NOT NULL,          -- 'hour' / 'day' / 'week'
+            bucket_ts INTEGER NOT NULL,  -- 区間の始まり（UTC。週は月曜日から）
+            samples INTEGER NOT NULL,    -- 元にしたチャンネル統計の件数
+            subscribers_min INTEGER,
+            subscribers_max INTEGER,
+            subscribers_avg REAL,
+            subscribers_last INTEGER,
+            views_min INTEGER,
+            views_max INTEGER,
+            views_avg REAL,
+            views_last INTEGER,
+            videos_min INTEGER,
+            videos_max INTEGER,
+            videos_avg REAL,
+            videos_last INTEGER,
+            growth_rate REAL,            -- 前の区間の最後の値からの総再生回数の増加率（%）
+            updated_ts INTEGER,
+            PRIMARY KEY (channel_id, tier, bucket_ts)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX idx_historical_trends_tier ON historical_trends (tier, bucket_ts)')
+    # 間引きなどをどこまで済ませたか
+    c.execute('''
+        CREATE TABLE retention_state (
+            name TEXT PRIMARY KEY,
+            done_ts INTEGER NOT NULL
+        )
+    ''')
+
+
+def migrate_comment_sync_count(c):
+    """最後まで読んだときの動画のコメント数を持たせる（増えたときだけ取り込み直す）"""
+    add_column_if_missing(c, 'comment_sync_state', 'synced_comments', 'INTEGER')
+
+
+def migrate_retokenize_kanji_words(c):
+    """長い漢字の連続を重ねずに区切り、送り仮名・活用語尾を除くように分割し直して、キーワード集計を更新する"""
+    reindex_all_titles(c)
+
+
+def migrate_retokenize_katakana(c):
+    """カタカナ語の語末の長音（カレー・サッカー）を残すように分割し直して、キーワード集計を更新する"""
+    reindex_all_titles(c)
+
+
+MIGRATIONS = [
+    migrate_initial_schema,
+    migrate_epoch_timestamps,
+    migrate_compact_video_metrics,
+    migrate_thumbnail_content_hash,
+    migrate_thumbnail_cache,
+    migrate_keyword_index,
+    migrate_retokenize_titles,
+    migrate_scheduler_runs,
+    migrate_cache_entries,
+    migrate_job_queue,
+    migrate_comments,
+    migrate_thumbnail_phash,
+    migrate_posting_cadence,
+    migrate_historical_trends,
+    migrate_comment_sync_count,
+    migrate_retokenize_kanji_words,
+    migrate_retokenize_katakana,
+]
+
+
+def apply_migrations(c):
+    """未適用のマイグレーションを順に適用し、適用後のバージョンを返す"""
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    c.create_function('to_epoch', 1, _to_epoch_or_none, deterministic=True)
+    for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"データベースを移行しています: v{i - 1} → v{i} ({migration.__name__})")
+        migration(c)
+        c.execute(f'PRAGMA user_version = {i}')
+    return max(version, len(MIGRATIONS))
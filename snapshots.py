@@ -0,0 +1,94 @@
+from database import db
+
+# IN 句1回あたりのIDの数（SQLite のパラメータ上限より十分小さく）
+LOOKUP_CHUNK_SIZE = 500
+# NumPy は Bot の起動を遅くするので、最初の計算のときに読み込む（analytics と同じ）
+
+
+def compute_video_metrics(views, likes, comments, published_ts, ts):
+    """エンゲージメント率と時間あたり再生数を全動画まとめて計算
+
+    analyze_video_performance と同じ式を配列で計算し、保存用の整数
+    （エンゲージメント率は 0.01% 単位、時間あたり再生数は四捨五入）で返す。
+    """
+    import numpy as np
+    views = np.asarray(views, dtype=np.float64)
+    interactions = np.asarray(likes, dtype=np.float64) + np.asarray(comments, dtype=np.float64)
+    # 公開日時が不明な動画は経過時間 0 として扱う
+    published = np.array([ts if p is None else p for p in published_ts], dtype=np.float64)
+    hours = (ts - published) / 3600
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        engagement_rate = np.where(views > 0, interactions / views * 100, 0.0)
+        views_per_hour = np.where(hours > 0, views / hours, 0.0)
+
+    return (
+        np.rint(engagement_rate * 100).astype(np.int64),
+        np.rint(views_per_hour).astype(np.int64)
+    )
+
+
+def _previous_counts(c, video_ids):
+    """video_stats に保存済みの直前の再生数・高評価数・コメント数"""
+    previous = {}
+    for i in range(0, len(video_ids), LOOKUP_CHUNK_SIZE):
+        chunk = video_ids[i:i + LOOKUP_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        rows = c.execute(f'''
+            SELECT video_id, views, likes, comments
+            FROM video_stats
+            WHERE video_id IN ({placeholders})
+        ''', chunk).fetchall()
+        previous.update((row[0], row[1:]) for row in rows)
+    return previous
+
+
+def append_video_snapshots(c, video_stats, ts):
+    """動画統計のスナップショットを video_performance_metrics にまとめて追記
+
+    書き込みスレッドで video_stats を上書きする前に呼ぶこと。
+    前回から数値が変わっていない動画は行を追加しない（読む側は直前の行の値が続いているとみなす）。
+    追記した行数を返す。
+    """
+    previous = _previous_counts(c, [v["video_id"] for v in video_stats])
+    changed = [
+        v for v in video_stats
+        if previous.get(v["video_id"]) != (v["views"], v["likes"], v["comments"])
+    ]
+    if not changed:
+        return 0
+
+    engagement_bp, views_per_hour = compute_video_metrics(
+        [v["views"] for v in changed],
+        [v["likes"] for v in changed],
+        [v["comments"] for v in changed],
+        [v["published_ts"] for v in changed],
+        ts
+    )
+    c.executemany('''
+        INSERT OR REPLACE INTO video_performance_metrics
+        (video_id, ts, views, likes, comments, engagement_bp, views_per_hour)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (v["video_id"], ts, v["views"], v["likes"], v["comments"], int(bp), int(vph))
+        for v, bp, vph in zip(changed, engagement_bp, views_per_hour)
+    ])
+    return len(changed)
+
+
+async def get_video_snapshots(video_id, since_ts=0):
+    """1本の動画のスナップショットを古い順に取得（エンゲージメント率は % に戻す）"""
+    rows = await db.fetchall('''
+        SELECT ts, views, likes, comments, engagement_bp, views_per_hour
+        FROM video_performance_metrics
+        WHERE video_id = ? AND ts >= ?
+        ORDER BY ts
+    ''', (video_id, since_ts))
+    return [{
+        "ts": row[0],
+        "views": row[1],
+        "likes": row[2],
+        "comments": row[3],
+        "engagement_rate": row[4] / 100,
+        "views_per_hour": row[5]
+    } for row in rows]
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import os
+import ssl
+
+import aiohttp
+import certifi
+import numpy as np
+
+from database import db, now_ts
+
+# 画像キャッシュの保存先と容量の上限
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', 'thumbnail_cache')
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_MB', '512')) * 1024 * 1024
+# 同時にダウンロードするサムネイルの数（コネクションプールの上限も兼ねる）
+FETCH_CONCURRENCY = 16
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=10)
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ThumbnailCache:
+    """画像をコンテンツハッシュで保存するディスクキャッシュ
+
+    ファイルは <dir>/<ハッシュ先頭2文字>/<ハッシュ> に置き、URL との対応・ETag・最終アクセス時刻は
+    thumbnail_cache テーブルで管理する。容量を超えたら最終アクセスの古い画像から削除する。
+    """
+
+    def __init__(self, directory=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # キャッシュの合計サイズの見積もり（最初の evict で数え、その後はダウンロードした分を足していく）
+        self._total = None
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def contains(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def write(self, data):
+        """画像を保存してコンテンツハッシュを返す（同じ内容ならファイルは1つ）"""
+        digest = content_hash(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 読み込み中のプロセスに書きかけのファイルが見えないよう、書き終えてから置き換える
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def read(self, digest):
+        """画像をメモリマップで読む（コピーせずに cv2.imdecode へ渡せる uint8 配列）"""
+        return read_mapped(self.path(digest))
+
+    def remove(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    async def _measure(self):
+        row = await db.fetchone('''
+            SELECT COALESCE(SUM(size), 0)
+            FROM (SELECT MAX(size) AS size FROM thumbnail_cache GROUP BY content_hash)
+        ''')
+        return row[0]
+
+    async def evict(self, keep_since=None, added=0):
+        """容量の上限を超えた分を、最終アクセスの古い画像から削除
+
+        added はこの回にダウンロードした画像の合計サイズ。見積もった合計が上限以下なら表は読まない
+        （同じ内容の画像を数え直すなど見積もりは多めになるが、超えたときに数え直す）。
+        keep_since 以降にアクセスされた画像（取得したばかりで、これから読むもの）は残す。
+        """
+        if self._total is None:
+            self._total = await self._measure()
+        else:
+            self._total += added
+        if self._total <= self.max_bytes:
+            return 0
+
+        rows = await db.fetchall('''
+            SELECT content_hash, MAX(size), MAX(accessed_ts) AS last_access
+            FROM thumbnail_cache
+            GROUP BY content_hash
+            ORDER BY last_access
+        ''')
+        total = sum(row[1] or 0 for row in rows)
+        evicted = []
+        for digest, size, last_access in rows:
+            if total <= self.max_bytes or (keep_since and last_access >= keep_since):
+                break
+            evicted.append(digest)
+            total -= size or 0
+        self._total = total
+        if not evicted:
+            return 0
+
+        await db.executemany('DELETE FROM thumbnail_cache WHERE content_hash = ?', [(d,) for d in evicted])
+        await asyncio.to_thread(lambda: [self.remove(digest) for digest in evicted])
+        return len(evicted)
+
+
+def read_mapped(path):
+    """ファイルを読み取り専用でメモリマップした uint8 配列（空ファイルは None）"""
+    if os.path.getsize(path) == 0:
+        return None
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+class ThumbnailFetcher:
+    """サムネイルを共有のコネクションプールで並行取得し、ディスクキャッシュに保存する
+
+    キャッシュ済みの URL には If-None-Match / If-Modified-Since を付けて問い合わせ、
+    304 ならダウンロードせずにキャッシュを使う。
+    """
+
+    def __init__(self, cache=None, concurrency=FETCH_CONCURRENCY, timeout=FETCH_TIMEOUT):
+        self.cache = cache or ThumbnailCache()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._session = None
+        self._session_lock = None
+        self._semaphore = None
+
+    async def _get_session(self):
+        # セッションはイベントループ上で遅延生成する
+        if self._session is not None and not self._session.closed:
+            return self._session
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                ssl_context = ssl.create_default_context(cafile=certifi.where())
+                connector = aiohttp.TCPConnector(
+                    ssl=ssl_context,
+                    limit=self.concurrency,
+                    keepalive_timeout=60
+                )
+                self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def _get_entries(self, urls):
+        entries = {}
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = await db.fetchall(f'''
+                SELECT url, content_hash, etag, last_modified
+                FROM thumbnail_cache
+                WHERE url IN ({placeholders})
+            ''', chunk)
+            entries.update((row[0], row[1:]) for row in rows)
+        return entries
+
+    async def _fetch(self, session, url, entry):
+        headers = {}
+        if entry and self.cache.contains(entry[0]):
+            if entry[1]:
+                headers['If-None-Match'] = entry[1]
+            if entry[2]:
+                headers['If-Modified-Since'] = entry[2]
+
+        async with self._semaphore:
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and headers:
+                        return url, entry[0], entry[1], entry[2], None
+                    if response.status != 200:
+                        return url, None, None, None, None
+                    data = await response.read()
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"サムネイル取得エラー: {url} ({type(e).__name__})")
+                return url, None, None, None, None
+
+        digest = await asyncio.to_thread(self.cache.write, data)
+        return url, digest, etag, last_modified, len(data)
+
+    async def fetch_many(self, urls):
+        """URL ごとのコンテンツハッシュを返す（取得できなかったものは None）"""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        session = await self._get_session()
+        entries = await self._get_entries(urls)
+        results = await asyncio.gather(*[self._fetch(session, url, entries.get(url)) for url in urls])
+
+        ts = now_ts()
+        await db.executemany('''
+            INSERT INTO thumbnail_cache (url, content_hash, etag, last_modified, size, accessed_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                size = COALESCE(excluded.size, thumbnail_cache.size),
+                accessed_ts = excluded.accessed_ts
+        ''', [(url, digest, etag, last_modified, size, ts)
+              for url, digest, etag, last_modified, size in results if digest])
+        await self.cache.evict(keep_since=ts, added=sum(size or 0 for _, _, _, _, size in results))
+
+        return {url: digest for url, digest, _, _, _ in results}
+
+    async def fetch(self, url):
+        return (await self.fetch_many([url])).get(url)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+# プロセス内で共有するサムネイル取得クライアント
+fetcher = ThumbnailFetcher()
@@ -0,0 +1,254 @@
+import asyncio
+import itertools
+
+from database import db
+from metrics import registry
+
+# 似ているとみなすハッシュのハミング距離（64ビット中）
+SIMILAR_DISTANCE = 10
+# 同じテンプレートとみなす距離と、テンプレートとして扱う最小の枚数
+TEMPLATE_DISTANCE = 8
+TEMPLATE_MIN_SIZE = 3
+# テンプレートに属さないサムネイルの template_type
+NO_TEMPLATE = 'standard'
+# 索引でハッシュを分ける数と、1つの部分のビット数
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+THUMBNAIL_SEARCH_SECONDS = registry.histogram('thumbnail_search_seconds', '似ているサムネイルの検索時間')
+THUMBNAIL_INDEX_SIZE = registry.gauge('thumbnail_index_size', '索引に入っているサムネイルの枚数')
+
+
+def to_signed(value):
+    """64ビットのハッシュを SQLite の INTEGER（符号付き）に収まる値にする"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _flip_masks(bits, radius):
+    """bits ビットのうち radius ビット以下を反転させるマスクの一覧（0 を含む）"""
+    masks = [0]
+    for count in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), count):
+            masks.append(sum(1 << position for position in positions))
+    return masks
+
+
+class MultiIndexHash:
+    """64ビットのハッシュを CHUNKS 個の部分に分け、部分ごとの辞書で距離 d 以内を探す（multi-index hashing）
+
+    距離が d 以内なら、鳩の巣原理でどれかの部分の距離は d // CHUNKS 以内になる。各部分をその範囲で反転させた値を
+    辞書で引いて候補を集め、候補だけ全体の距離を確かめる。BK 木は距離 10 前後では枝をほとんど刈れず、
+    全件と比べるのと変わらなくなるので使わない。
+    """
+
+    def __init__(self):
+        self.values = []
+        self.keys = []
+        self.tables = [{} for _ in range(CHUNKS)]
+
+    @property
+    def size(self):
+        return len(self.values)
+
+    def add(self, value, key):
+        slot = len(self.values)
+        self.values.append(value)
+        self.keys.append(key)
+        for i, table in enumerate(self.tables):
+            table.setdefault((value >> (i * CHUNK_BITS)) & CHUNK_MASK, []).append(slot)
+
+    def search(self, value, max_distance):
+        """(距離, ハッシュ, キー) のリスト（距離の近い順）"""
+        masks = _masks(max_distance // CHUNKS)
+        seen = set()
+        found = []
+        for i, table in enumerate(self.tables):
+            chunk = (value >> (i * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                for slot in table.get(chunk ^ mask, ()):
+                    if slot in seen:
+                        continue
+                    seen.add(slot)
+                    distance = hamming(value, self.values[slot])
+                    if distance <= max_distance:
+                        found.append((distance, self.values[slot], self.keys[slot]))
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+_MASKS = {}
+
+
+def _masks(radius):
+    masks = _MASKS.get(radius)
+    if masks is None:
+        masks = _MASKS[radius] = _flip_masks(CHUNK_BITS, radius)
+    return masks
+
+
+class ThumbnailIndex:
+    """thumbnail_analysis の知覚ハッシュ（phash）をメモリに載せた索引
+
+    最初の検索のときに一度だけテーブルから読み込み、その後は保存のたびに add で追加する。
+    分析し直してハッシュが変わった動画は、索引から消さずに検索結果から除く（現在のハッシュと一致するものだけ返す）。
+    """
+
+    def __init__(self):
+        self.index = MultiIndexHash()
+        self.hashes = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    async def ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            rows = await db.fetchall('SELECT video_id, phash FROM thumbnail_analysis WHERE phash IS NOT NULL')
+            for video_id, phash in rows:
+                self._add(video_id, to_unsigned(phash))
+            self._loaded = True
+            THUMBNAIL_INDEX_SIZE.set(len(self.hashes))
+
+    def _add(self, video_id, value):
+        if self.hashes.get(video_id) == value:
+            return
+        self.hashes[video_id] = value
+        self.index.add(value, video_id)
+
+    def add_many(self, items):
+        """(video_id, phash) を追加（読み込み前なら何もしない。読み込むときにテーブルから入る）"""
+        if not self._loaded:
+            return
+        for video_id, phash in items:
+            if phash is not None:
+                self._add(video_id, to_unsigned(phash))
+        THUMBNAIL_INDEX_SIZE.set(len(self.hashes))
+
+    async def search(self, phash, max_distance=SIMILAR_DISTANCE):
+        """phash から距離 max_distance 以内の (距離, video_id) のリスト（近い順）"""
+        await self.ensure_loaded()
+        value = to_unsigned(phash)
+        with THUMBNAIL_SEARCH_SECONDS.time():
+            return [(distance, video_id) for distance, value_found, video_id in self.index.search(value, max_distance)
+                    if self.hashes.get(video_id) == value_found]
+
+
+# プロセス内で共有する索引
+thumbnail_index = ThumbnailIndex()
+
+
+async def find_similar_thumbnails(video_id, max_distance=SIMILAR_DISTANCE, limit=10):
+    """動画のサムネイルに似ている過去のサムネイルと、その動画の成績（なければ None）
+
+    成績はチャンネルの平均再生数に対する比（content_analysis.performance_score）と再生数。
+    """
+    row = await db.fetchone('SELECT phash, template_type FROM thumbnail_analysis WHERE video_id = ?', (video_id,))
+    if row is None or row[0] is None:
+        return None
+    matches = [(distance, match) for distance, match in await thumbnail_index.search(row[0], max_distance)
+               if match != video_id][:limit]
+    details = {}
+    if matches:
+        ids = [match for _, match in matches]
+        rows = await db.fetchall(f'''
+            SELECT vs.video_id, vs.channel_id, vs.title, vs.published_ts, vs.views, ca.performance_score
+            FROM video_stats vs
+            LEFT JOIN content_analysis ca ON ca.video_id = vs.video_id
+            WHERE vs.video_id IN ({','.join('?' * len(ids))})
+        ''', ids)
+        details = {r[0]: r for r in rows}
+    similar = []
+    for distance, match in matches:
+        detail = details.get(match)
+        similar.append({
+            'video_id': match,
+            'distance': distance,
+            'channel_id': detail[1] if detail else None,
+            'title': detail[2] if detail else None,
+            'published_ts': detail[3] if detail else None,
+            'views': detail[4] if detail else None,
+            'performance_score': detail[5] if detail else None
+        })
+    return {
+        'video_id': video_id,
+        'template_type': row[1],
+        'similar': similar,
+        'template': await get_template_summary(row[1])
+    }
+
+
+def _cluster(items, max_distance, min_size):
+    """古い順に、まだテンプレートのないサムネイルを代表にして、距離 max_distance 以内のものをまとめる
+
+    全件をつなげていく（単連結）と少しずつ違う画像が連鎖して大きな塊になるので、代表からの距離で区切る。
+    代表が最初にそのテンプレートを使った動画になるので、サムネイルが増えても名前が変わりにくい。
+    スレッドで実行するので、共有の索引ではなくこの中で作った索引を使う。
+    """
+    index = MultiIndexHash()
+    for video_id, value in items:
+        index.add(value, video_id)
+    assigned = {}
+    for video_id, value in items:
+        if video_id in assigned:
+            continue
+        members = [match for _, _, match in index.search(value, max_distance) if match not in assigned]
+        if len(members) < min_size:
+            continue
+        template = f"template_{video_id}"
+        for match in members:
+            assigned[match] = template
+    return assigned
+
+
+async def cluster_templates(max_distance=TEMPLATE_DISTANCE, min_size=TEMPLATE_MIN_SIZE):
+    """サムネイルをテンプレートに分け、thumbnail_analysis.template_type に保存する
+
+    テンプレート名は代表（最も古い）動画から 'template_<video_id>'、どれにも属さなければ 'standard'。
+    """
+    rows = await db.fetchall('''
+        SELECT ta.video_id, ta.phash, ta.template_type
+        FROM thumbnail_analysis ta
+        LEFT JOIN video_stats vs ON vs.video_id = ta.video_id
+        WHERE ta.phash IS NOT NULL
+        ORDER BY vs.published_ts, ta.video_id
+    ''')
+    items = [(row[0], to_unsigned(row[1])) for row in rows]
+    assigned = await asyncio.to_thread(_cluster, items, max_distance, min_size)
+    changes = [(assigned.get(row[0], NO_TEMPLATE), row[0]) for row in rows
+               if assigned.get(row[0], NO_TEMPLATE) != row[2]]
+    if changes:
+        await db.executemany('UPDATE thumbnail_analysis SET template_type = ? WHERE video_id = ?', changes)
+    templates = len(set(assigned.values()))
+    print(f"サムネイルのテンプレート: {templates}種類（{len(assigned)}/{len(rows)}枚・更新 {len(changes)}件）")
+    return {'templates': templates, 'members': len(assigned), 'thumbnails': len(rows), 'updated': len(changes)}
+
+
+async def get_template_summary(template_type):
+    """テンプレートの枚数・使っているチャンネル数・平均の成績（テンプレートでなければ None）"""
+    if not template_type or template_type == NO_TEMPLATE:
+        return None
+    row = await db.fetchone('''
+        SELECT COUNT(*), COUNT(DISTINCT vs.channel_id), AVG(vs.views), AVG(ca.performance_score)
+        FROM thumbnail_analysis ta
+        LEFT JOIN video_stats vs ON vs.video_id = ta.video_id
+        LEFT JOIN content_analysis ca ON ca.video_id = ta.video_id
+        WHERE ta.template_type = ?
+    ''', (template_type,))
+    return {
+        'template_type': template_type,
+        'thumbnails': row[0],
+        'channels': row[1],
+        'average_views': round(row[2]) if row[2] is not None else None,
+        'average_performance': round(row[3], 3) if row[3] is not None else None
+    }
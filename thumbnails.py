@@ -0,0 +1,347 @@
+import asyncio
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from database import db, now_ts
+from metrics import registry
+from thumbnail_cache import fetcher, read_mapped
+from thumbnail_index import thumbnail_index, to_signed
+
+# 輪郭（テキスト領域）検出に使う画像の幅。元画像はこの幅まで縮小する
+ANALYSIS_WIDTH = 320
+# 色クラスタリングに使う画像の幅（代表色を求めるだけなので小さくてよい）
+COLOR_SAMPLE_WIDTH = 64
+N_COLORS = 3
+# 知覚ハッシュ（pHash）: この大きさに縮小した輝度の DCT の、低周波 HASH_SIZE x HASH_SIZE 成分から64ビットを作る
+PHASH_SAMPLE_SIZE = 32
+HASH_SIZE = 8
+KMEANS_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 50, 0.5)
+KMEANS_ATTEMPTS = 3
+# これより少ない件数はプロセスを起動せずスレッドで処理する
+MIN_POOL_BATCH = 8
+# 1回のバッチで処理する件数
+BATCH_SIZE = 200
+# サムネイル画像の配信元（fake_youtube_api.py などに向けるときは環境変数で変更）
+THUMBNAIL_BASE_URL = os.getenv('THUMBNAIL_BASE_URL', 'https://i.ytimg.com').rstrip('/')
+
+
+THUMBNAILS_PROCESSED = registry.counter(
+    'thumbnails_processed', 'サムネイルの処理件数（result: analyzed / skipped / failed）', ('result',))
+THUMBNAIL_BATCH_SECONDS = registry.histogram('thumbnail_batch_seconds', 'サムネイル分析1バッチの処理時間', ('stage',))
+THUMBNAIL_IMAGES_PER_SECOND = registry.gauge('thumbnail_images_per_second', '直近のバッチの画像処理のスループット（枚/秒）')
+
+
+def thumbnail_url(video_id):
+    return f"{THUMBNAIL_BASE_URL}/vi/{video_id}/hqdefault.jpg"
+
+
+def _resize_to_width(image, width):
+    height, current_width = image.shape[:2]
+    if current_width <= width:
+        return image
+    return cv2.resize(image, (width, round(height * width / current_width)), interpolation=cv2.INTER_AREA)
+
+
+def _crop_letterbox(image):
+    """hqdefault（4:3）の上下の黒帯を除く（16:9 の動画では上下 1/8 ずつが帯になる）"""
+    height, width = image.shape[:2]
+    if abs(width * 3 - height * 4) > width // 20:
+        return image
+    band = height // 8
+    return image[band:height - band]
+
+
+def perceptual_hash(gray):
+    """輝度画像の pHash（64ビットの符号付き整数）
+
+    縮小した画像の DCT の低周波成分が中央値より大きいかどうかをビットにする。文字や顔が差し替わっても
+    レイアウト・配色が同じサムネイルは近い値になり、違いはハミング距離で測れる。
+    """
+    small = cv2.resize(gray, (PHASH_SAMPLE_SIZE, PHASH_SAMPLE_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:HASH_SIZE, :HASH_SIZE].ravel()
+    # 直流成分（画像全体の明るさ）は中央値の計算から除く
+    bits = low > np.median(low[1:])
+    return to_signed(int.from_bytes(np.packbits(bits).tobytes(), 'big'))
+
+
+def analyze_image(image):
+    """デコード済みの画像（BGR）から色構成とテキスト配置を分析"""
+    image = _resize_to_width(image, ANALYSIS_WIDTH)
+    height, width = image.shape[:2]
+
+    # 色分析（縮小画像で k-means）
+    pixels = np.float32(_resize_to_width(image, COLOR_SAMPLE_WIDTH).reshape(-1, 3))
+    cv2.setRNGSeed(0)  # 同じ画像なら同じ結果になるようにする
+    _, labels, palette = cv2.kmeans(pixels, N_COLORS, None, KMEANS_CRITERIA, KMEANS_ATTEMPTS, cv2.KMEANS_PP_CENTERS)
+
+    # 各色の割合を計算
+    counts = np.bincount(labels.ravel(), minlength=N_COLORS)
+    percentages = counts / counts.sum() * 100
+
+    # 色情報をRGB形式で保存
+    colors = []
+    for color, percentage in zip(palette, percentages):
+        b, g, r = color
+        colors.append({
+            'rgb': f'#{int(r):02x}{int(g):02x}{int(b):02x}',
+            'percentage': round(float(percentage), 1)
+        })
+
+    # テキスト領域の検出
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    phash = perceptual_hash(_crop_letterbox(gray))
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # テキスト配置の分析
+    text_regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h > (width * height * 0.01):  # 小さすぎる領域を除外
+            text_regions.append({
+                'x': x / width,
+                'y': y / height,
+                'width': w / width,
+                'height': h / height
+            })
+
+    # テキスト配置の分類
+    text_placement = 'center'  # デフォルト
+    if text_regions:
+        avg_x = np.mean([r['x'] for r in text_regions])
+        avg_y = np.mean([r['y'] for r in text_regions])
+
+        if avg_x < 0.33:
+            text_placement = 'left'
+        elif avg_x > 0.66:
+            text_placement = 'right'
+
+        if avg_y < 0.33:
+            text_placement = f'top_{text_placement}'
+        elif avg_y > 0.66:
+            text_placement = f'bottom_{text_placement}'
+
+    # インパクトスコアの計算
+    impact_score = min(100, (
+        len(text_regions) * 20 +  # テキスト領域の数
+        len(colors) * 15 +        # 使用色数
+        (max(percentages) - min(percentages)) * 0.5  # 色の対比
+    ))
+
+    return {
+        'dominant_colors': colors,
+        'text_placement': text_placement,
+        'composition_score': round(min(100, len(text_regions) * 25), 1),
+        'impact_score': round(float(impact_score), 1),
+        'template_type': 'standard',  # テンプレートは thumbnail_index.cluster_templates でまとめて割り当てる
+        'phash': phash
+    }
+
+
+def analyze_image_bytes(data):
+    """画像のバイト列（bytes または uint8 配列）をデコードして分析"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return analyze_image(image)
+
+
+def analyze_image_file(path):
+    """キャッシュの画像ファイルを分析（プロセスプールから呼ばれる）
+
+    プロセス間では画像ではなくパスだけを渡し、各プロセスがメモリマップで読む。
+    """
+    try:
+        data = read_mapped(path)
+    except FileNotFoundError:
+        return None
+    if data is None:
+        return None
+    return analyze_image_bytes(data)
+
+
+def _init_worker():
+    # プロセスごとに OpenCV のスレッドを使うと CPU を取り合うので1本にする
+    cv2.setNumThreads(1)
+
+
+_pool = None
+# analyze_many は executor のスレッドから _get_pool を呼ぶので、同時に2つのプールを作らないようにする
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        # Bot のプロセスは書き込み・読み込みスレッドやイベントループを持つので fork しない（ロックを持ったまま複製される）。
+        # forkserver はスレッドのないサーバーから子プロセスを作る。重い cv2・numpy はサーバーで一度だけ読み込んでおき、
+        # 子プロセスごとに読み込み直さないようにする。このモジュール自体は読み込まない（サーバーは起動時の
+        # 作業ディレクトリから import するので、そこに thumbnails という名前のディレクトリがあると別物になる）
+        context = None
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['cv2', 'numpy'])
+        pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2, mp_context=context, initializer=_init_worker)
+        atexit.register(pool.shutdown)
+        _pool = pool
+        return _pool
+
+
+async def analyze_many(paths):
+    """複数の画像ファイルをまとめて分析し、同じ順で結果を返す"""
+    if len(paths) < MIN_POOL_BATCH:
+        return await asyncio.to_thread(lambda: [analyze_image_file(path) for path in paths])
+    loop = asyncio.get_running_loop()
+    chunksize = max(1, len(paths) // ((os.cpu_count() or 2) * 4))
+    return await loop.run_in_executor(None, lambda: list(_get_pool().map(analyze_image_file, paths, chunksize=chunksize)))
+
+
+async def get_analyzed_hashes(hashes):
+    """分析済みのコンテンツハッシュと、その結果を持つ行"""
+    found = {}
+    hashes = list(set(hashes))
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        placeholders = ','.join('?' * len(chunk))
+        rows = await db.fetchall(f'''
+            SELECT content_hash, video_id, dominant_colors, text_placement,
+                   composition_score, impact_score, template_type, phash
+            FROM thumbnail_analysis
+            WHERE content_hash IN ({placeholders}) AND phash IS NOT NULL
+        ''', chunk)
+        for row in rows:
+            found[row[0]] = {
+                'video_id': row[1],
+                'dominant_colors': json.loads(row[2]),
+                'text_placement': row[3],
+                'composition_score': row[4],
+                'impact_score': row[5],
+                'template_type': row[6],
+                'phash': row[7]
+            }
+    return found
+
+
+async def save_thumbnail_results(results):
+    """(video_id, content_hash, analysis) のリストをまとめて保存し、似たサムネイルの索引にも加える"""
+    if not results:
+        return
+    ts = now_ts()
+    await db.executemany('''
+        INSERT OR REPLACE INTO thumbnail_analysis
+        (video_id, content_hash, analyzed_ts, dominant_colors, text_placement,
+         composition_score, impact_score, template_type, phash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        video_id,
+        digest,
+        ts,
+        json.dumps(analysis['dominant_colors']),
+        analysis['text_placement'],
+        analysis['composition_score'],
+        analysis['impact_score'],
+        analysis['template_type'],
+        analysis['phash']
+    ) for video_id, digest, analysis in results])
+    thumbnail_index.add_many([(video_id, analysis['phash']) for video_id, _, analysis in results])
+
+
+async def analyze_thumbnail_batch(items):
+    """サムネイルをまとめて分析して保存
+
+    items は (video_id, サムネイルURL) のリスト。
+    内容が同じ画像（コンテンツハッシュが一致）がすでに分析済みなら、画像処理を省いて結果を流用する。
+    処理件数とスループットを返す。
+    """
+    started = time.perf_counter()
+    fetched = await fetcher.fetch_many([url for _, url in items])
+    THUMBNAIL_BATCH_SECONDS.observe(time.perf_counter() - started, stage='download')
+    downloaded = [(video_id, fetched[url]) for video_id, url in items if fetched.get(url)]
+    known = await get_analyzed_hashes([digest for _, digest in downloaded])
+
+    results = []
+    pending = {}     # ハッシュ → video_id。同じ画像は1回だけ分析する
+    duplicates = []  # 同じバッチ内で画像が重複した動画
+    skipped = 0
+    for video_id, digest in downloaded:
+        if digest in known:
+            if known[digest]['video_id'] != video_id:
+                results.append((video_id, digest, known[digest]))
+            skipped += 1
+        elif digest in pending:
+            duplicates.append((video_id, digest))
+            skipped += 1
+        else:
+            pending[digest] = video_id
+
+    analyze_started = time.perf_counter()
+    analyses = await analyze_many([fetcher.cache.path(digest) for digest in pending])
+    analyze_elapsed = time.perf_counter() - analyze_started
+    THUMBNAIL_BATCH_SECONDS.observe(analyze_elapsed, stage='analyze')
+
+    failed = len(items) - len(downloaded)
+    analyzed = {}
+    for (digest, video_id), analysis in zip(pending.items(), analyses):
+        if analysis is None:
+            failed += 1
+        else:
+            analyzed[digest] = analysis
+            results.append((video_id, digest, analysis))
+    results.extend((video_id, digest, analyzed[digest]) for video_id, digest in duplicates if digest in analyzed)
+    await save_thumbnail_results(results)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        'analyzed': len(pending),
+        'skipped': skipped,
+        'failed': failed,
+        'elapsed': round(elapsed, 2),
+        'images_per_second': round(len(pending) / analyze_elapsed, 1) if analyze_elapsed > 0 else 0.0
+    }
+    THUMBNAIL_BATCH_SECONDS.observe(elapsed, stage='total')
+    for result in ('analyzed', 'skipped', 'failed'):
+        THUMBNAILS_PROCESSED.inc(summary[result], result=result)
+    if pending:
+        THUMBNAIL_IMAGES_PER_SECOND.set(summary['images_per_second'])
+    print(f"サムネイル分析: {summary['analyzed']}件（分析済みでスキップ {skipped}件・失敗 {failed}件）"
+          f" {summary['elapsed']}秒 / 画像処理 {summary['images_per_second']}枚/秒")
+    return summary
+
+
+async def analyze_thumbnail_backlog(channel_ids=None, limit=None):
+    """まだサムネイル分析のない（知覚ハッシュのない分析も含む）動画を BATCH_SIZE 件ずつ分析"""
+    query = '''
+        SELECT vs.video_id
+        FROM video_stats vs
+        LEFT JOIN thumbnail_analysis ta ON ta.video_id = vs.video_id
+        WHERE ta.phash IS NULL
+    '''
+    params = []
+    if channel_ids:
+        query += f" AND vs.channel_id IN ({','.join('?' * len(channel_ids))})"
+        params.extend(channel_ids)
+    query += ' ORDER BY vs.published_ts DESC'
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+    video_ids = [row[0] for row in await db.fetchall(query, params)]
+
+    totals = {'analyzed': 0, 'skipped': 0, 'failed': 0}
+    for i in range(0, len(video_ids), BATCH_SIZE):
+        batch = video_ids[i:i + BATCH_SIZE]
+        summary = await analyze_thumbnail_batch([(video_id, thumbnail_url(video_id)) for video_id in batch])
+        for key in totals:
+            totals[key] += summary[key]
+    return totals
@@ -0,0 +1,133 @@
+import re
+import unicodedata
+
+# 文字種ごとの連続部分（NFKC 正規化・小文字化した後のテキストに対して使う）
+TOKEN_PATTERN = re.compile(
+    r'(?P<kanji>[㐀-䶿一-鿿豈-﫿々〆ヵヶ]+)'
+    r'|(?P<katakana>[ァ-ヺーヽヾ]+)'
+    r'|(?P<hiragana>[ぁ-ゖゝゞ]+)'
+    r'|(?P<latin>[a-z0-9]+(?:[\'’][a-z]+)?)'
+)
+NUMBER_PATTERN = re.compile(r'^\d+$')
+
+# 漢字の連続がこれより長いときは先頭から2文字ずつに区切る（複合語を構成要素で集計するため）
+MAX_KANJI_WORD = 4
+# 複合語の中で前の2文字に付く1文字の接尾語（東京都・選手権・日本代表戦）。区切りの位置をずらすのに使う
+KANJI_SUFFIXES = frozenset('都道府県市区町村駅党的性化者家員式型版編戦権会所団部局省庁界際内外中後前用風系率')
+# ひらがなだけの語は短いものがほとんど助詞・助動詞なので、この長さ以上だけ残す
+MIN_HIRAGANA_WORD = 3
+# 漢字の直後のひらがなの先頭がこれなら助詞（東京のおすすめ）、それ以外は送り仮名（食べてみた）とみなす
+PARTICLES = frozenset('のがをにへとでもはや')
+# ひらがなの語の末尾から取り除く活用語尾・助動詞（長いものから順に試す）
+AUXILIARY_TAILS = (
+    'てみました', 'でみました', 'ってみた', 'てみた', 'でみた', 'ちゃった', 'じゃった',
+    'すぎた', 'すぎる', 'すぎ', 'ました', 'ません', 'ます', 'です', 'でした', 'ない', 'たい', 'った',
+)
+
+STOPWORDS = frozenset({
+    # 助詞・助動詞・形式名詞など（ひらがな）
+    'する', 'した', 'して', 'します', 'しました', 'される', 'させる', 'しない', 'しよう', 'しか',
+    'です', 'でした', 'ます', 'ました', 'ません', 'ない', 'なる', 'なった', 'なって',
+    'いる', 'いた', 'いて', 'ある', 'あった', 'あり', 'れる', 'られる', 'たい', 'たら',
+    'これ', 'それ', 'あれ', 'どれ', 'この', 'その', 'あの', 'どの', 'ここ', 'そこ', 'どこ',
+    'こと', 'もの', 'ため', 'よう', 'など', 'から', 'まで', 'より', 'けど', 'だけ', 'ので',
+    'のに', 'って', 'ちゃ', 'じゃ', 'でも', 'とか', 'みた', 'みる', 'ってみた', 'てみた',
+    'について', 'ください', 'くれ', 'ちゃん', 'さん', 'くん', 'だけで', 'ように', 'ような',
+    'されて', 'られた', 'してみた', 'やってみた', 'みました', 'とは', 'なのか',
+    # 一般的すぎる漢字語
+    '今日', '今回', '方法', '動画', '公式', '最新', '人気',
+    # 英語
+    'a', 'an', 'the', 'and', 'or', 'of', 'in', 'on', 'at', 'to', 'for', 'with', 'from', 'by',
+    'is', 'are', 'was', 'be', 'it', 'this', 'that', 'my', 'your', 'you', 'i', 'we', 'me',
+    'vs', 'ft', 'feat', 'part', 'ep', 'no', 'shorts', 'short', 'official', 'video',
+})
+
+
+def normalize(text):
+    """全角英数字・半角カナを揃え、小文字にする"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def _kanji_tokens(run):
+    """漢字の連続を語に区切る
+
+    長い連続は2文字ずつ重ねずに区切り、語の境目をまたぐ組（東京都知事 → 京都・都知）を作らない。
+    残りの文字数が奇数のときだけ、接尾語を前の2文字に付けて区切りの位置を合わせる
+    （東京都知事選挙結果速報 → 東京都・知事・選挙・結果・速報）。余った1文字は捨てる。
+    """
+    if len(run) <= MAX_KANJI_WORD:
+        return [run]
+    words = []
+    start = 0
+    while start + 1 < len(run):
+        end = start + 2
+        if end < len(run) and run[end] in KANJI_SUFFIXES and (len(run) - end) % 2 == 1:
+            end += 1
+        words.append(run[start:end])
+        start = end
+    return words
+
+
+def _hiragana_token(run, after_kanji):
+    """ひらがなの連続から、送り仮名・助詞・活用語尾を除いた語（残らなければ空文字）"""
+    if after_kanji:
+        if run[0] not in PARTICLES:
+            # 漢字の送り仮名と、それに続く助動詞（食べてみた・美味しすぎた）
+            return ''
+        run = run[1:]
+    for tail in AUXILIARY_TAILS:
+        if run.endswith(tail):
+            run = run[:-len(tail)]
+            break
+    return run if len(run) >= MIN_HIRAGANA_WORD else ''
+
+
+def tokenize(text):
+    """タイトルをキーワード候補に分割する
+
+    形態素解析の辞書やモデルを使わず、文字種の境界で区切る。
+    - カタカナ語・英単語はそのまま1語
+    - 漢字は4文字までならそのまま、それより長い連続は2文字ずつ（重ねない）。数字の直後の助数詞は除く
+    - ひらがなは送り仮名・助詞・活用語尾を除いて3文字以上残り、ストップワードでないものだけ
+    - 1文字の語と数字だけの語は捨てる
+
+    >>> tokenize('カレーを食べてみた #12')
+    ['カレー']
+    >>> tokenize('サッカー日本代表戦ハイライト')
+    ['サッカー', '日本', '代表戦', 'ハイライト']
+    >>> tokenize('東京都知事選挙結果速報')
+    ['東京都', '知事', '選挙', '結果', '速報']
+    """
+    text = normalize(text)
+    tokens = []
+    previous = None
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        run = match.group()
+        if kind == 'kanji':
+            # 数字の直後の漢字は助数詞（1日・10選・100円）なので語から外す
+            if match.start() > 0 and text[match.start() - 1].isdigit():
+                run = run[1:]
+            candidates = _kanji_tokens(run) if run else []
+        elif kind == 'hiragana':
+            after_kanji = previous is not None and previous.lastgroup == 'kanji' and previous.end() == match.start()
+            candidates = [_hiragana_token(run, after_kanji)]
+        elif kind == 'katakana':
+            # 語末の長音（カレー・サッカー）は語の一部なので残し、先頭に紛れた長音だけ除く
+            candidates = [run.lstrip('ー')]
+        else:
+            candidates = [] if NUMBER_PATTERN.match(run) else [run]
+        tokens.extend(t for t in candidates if len(t) >= 2 and t not in STOPWORDS)
+        previous = match
+    return tokens
+
+
+def tokenize_many(texts):
+    """複数のタイトルをまとめて分割（同じタイトルは1回だけ処理する）"""
+    cache = {}
+    results = []
+    for text in texts:
+        if text not in cache:
+            cache[text] = tokenize(text)
+        results.append(cache[text])
+    return results
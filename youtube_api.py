@@ -0,0 +1,158 @@
+import asyncio
+import os
+import ssl
+import time
+
+import aiohttp
+import certifi
+
+from metrics import registry
+from resilience import Endpoint, RetryHint, parse_retry_after
+
+# YouTube Data API v3 のエンドポイント（fake_youtube_api.py などに向けるときは環境変数で変更）
+YOUTUBE_API_BASE_URL = os.getenv('YOUTUBE_API_BASE_URL', 'https://www.googleapis.com/youtube/v3')
+# メソッドごとの送信レートの上限（回/秒）。レート制限を受けたら自動で下げ、成功が続けばここまで戻す
+YOUTUBE_API_RATE = float(os.getenv('YOUTUBE_API_RATE', '100'))
+# レート制限として扱うエラー（quotaExceeded は1日の上限なので、待ってもやり直さない）
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+API_REQUEST_SECONDS = registry.histogram('youtube_api_request_seconds', 'YouTube API の呼び出しの処理時間', ('method',))
+API_REQUESTS = registry.counter(
+    'youtube_api_requests', 'YouTube API の呼び出し回数（status は HTTP ステータス・通信失敗は error）', ('method', 'status'))
+
+
+class YouTubeAPIError(Exception):
+    """YouTube Data API がエラーを返した場合の例外"""
+
+    def __init__(self, status, reason, message, retry_after=None):
+        super().__init__(f"{status} {reason}: {message}")
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+def classify_youtube_error(e):
+    """リトライしてよい失敗なら RetryHint を返す（429・レート制限の 403・5xx・通信エラー）"""
+    if isinstance(e, YouTubeAPIError):
+        if e.status == 429 or e.reason in RATE_LIMIT_REASONS:
+            return RetryHint(throttled=True, retry_after=e.retry_after)
+        if e.status >= 500:
+            return RetryHint(retry_after=e.retry_after)
+        return None
+    if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return RetryHint()
+    return None
+
+
+class AsyncYouTubeClient:
+    """aiohttp ベースの非同期 YouTube Data API クライアント
+
+    1つの ClientSession（コネクションプール）をプロセス内で使い回す。
+    メソッドごとにトークンバケットでレートを制限し、レート制限・5xx・通信エラーは待ってやり直す
+    （失敗が続いたメソッドは回路遮断器でしばらく止める）。
+    on_request を渡すと、呼び出し（リトライを含む）ごとに (method, latency_ms, result_items, status) で呼ばれる。
+    """
+
+    def __init__(self, api_key, base_url=YOUTUBE_API_BASE_URL, max_connections=20, timeout=30,
+                 on_request=None, rate=YOUTUBE_API_RATE):
+        self.api_key = api_key
+        self.on_request = on_request
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.rate = rate
+        self._session = None
+        self._session_lock = None
+        self._endpoints = {}
+
+    def _endpoint(self, method):
+        endpoint = self._endpoints.get(method)
+        if endpoint is None:
+            endpoint = self._endpoints[method] = Endpoint(
+                f"youtube:{method}", self.rate, classify_youtube_error, concurrency=self.max_connections
+            )
+        return endpoint
+
+    async def _get_session(self):
+        # セッションはイベントループ上で遅延生成する
+        if self._session is not None and not self._session.closed:
+            return self._session
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                ssl_context = ssl.create_default_context(cafile=certifi.where())
+                connector = aiohttp.TCPConnector(
+                    ssl=ssl_context,
+                    limit=self.max_connections,
+                    keepalive_timeout=60
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                )
+        return self._session
+
+    async def request(self, resource, **params):
+        """APIを呼び出してJSONを返す（resource は 'channels' や 'search' など）"""
+        # None のパラメータは送らない（pageToken など）
+        query = {key: value for key, value in params.items() if value is not None}
+        query['key'] = self.api_key
+
+        method = f"{resource}.list"
+        return await self._endpoint(method).call(lambda: self._request_once(resource, method, query))
+
+    async def _request_once(self, resource, method, query):
+        session = await self._get_session()
+        status = None
+        result_items = 0
+        start = time.perf_counter()
+        try:
+            async with session.get(f"{self.base_url}/{resource}", params=query) as response:
+                status = response.status
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    # ゲートウェイのエラーページなど、JSON でない応答
+                    if response.status < 400:
+                        raise
+                    data = None
+                if response.status >= 400:
+                    error = (data or {}).get('error', {})
+                    errors = error.get('errors') or [{}]
+                    raise YouTubeAPIError(
+                        response.status,
+                        errors[0].get('reason', 'unknown'),
+                        error.get('message', ''),
+                        parse_retry_after(response.headers.get('Retry-After'))
+                    )
+                result_items = len(data.get('items', []))
+                return data
+        finally:
+            elapsed = time.perf_counter() - start
+            API_REQUEST_SECONDS.observe(elapsed, method=method)
+            API_REQUESTS.inc(method=method, status=status or 'error')
+            # 失敗した呼び出しもクォータを消費するので記録する
+            if self.on_request is not None:
+                self.on_request(method, elapsed * 1000, result_items, status)
+
+    async def channels_list(self, **params):
+        return await self.request('channels', **params)
+
+    async def search_list(self, **params):
+        return await self.request('search', **params)
+
+    async def videos_list(self, **params):
+        return await self.request('videos', **params)
+
+    async def playlist_items_list(self, **params):
+        return await self.request('playlistItems', **params)
+
+    async def comment_threads_list(self, **params):
+        return await self.request('commentThreads', **params)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None